@@ -0,0 +1,298 @@
+"""Local stand-in for the Discord REST API and gateway, for benchmarking combined_bot.py.
+
+Only the endpoints the bot uses are implemented. Every REST call waits `latency`
+(+/- `jitter`) seconds and a `rate_limit_ratio` share of them is answered with a 429,
+so the bot's retry paths and action scheduler are exercised as they would be in
+production. The load driver talks to the bot through the same server: it pushes
+gateway dispatches (slash commands, reactions) and waits on the REST calls that
+complete them.
+"""
+
+import asyncio
+import collections
+import itertools
+import json
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web, WSMsgType
+
+API_PREFIX = "/api/v10"
+OP_DISPATCH, OP_HEARTBEAT, OP_IDENTIFY, OP_HELLO, OP_HEARTBEAT_ACK = 0, 1, 2, 10, 11
+
+def json_response(data, status=200, headers=None):
+    # discord.py only decodes bodies whose content type is exactly application/json
+    return web.Response(body=json.dumps(data).encode(), status=status, headers=headers,
+                        content_type="application/json")
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+class FakeDiscord:
+    def __init__(self, guild_id, channel_id, role_id, admin_id, user_ids,
+                 latency=0.05, jitter=0.0, rate_limit_ratio=0.0, retry_after=0.5, seed=None):
+        self.guild_id = str(guild_id)
+        self.channel_id = str(channel_id)
+        self.role_id = str(role_id)
+        self.admin_id = str(admin_id)
+        self.user_ids = [str(u) for u in user_ids]
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+        self._ids = itertools.count(1_500_000_000_000_000_000)
+        self.application_id = self.snowflake()
+        self.bot_user = self.user_payload(self.application_id, bot=True)
+
+        self.requests = collections.Counter()
+        self.rate_limited = collections.Counter()
+        self.synced = asyncio.Event()
+        self.verification_messages = collections.deque()  # (order_id, message_id) awaiting a ✅
+        self._waiters = {}
+        self._sockets = set()
+        self._seq = 0
+
+        self.routes = [
+            ("GET", r"/users/@me", self.get_current_user),
+            ("GET", r"/oauth2/applications/@me", self.get_application),
+            ("PUT", r"/applications/(?P<app>\d+)/commands", self.sync_commands),
+            ("PUT", r"/applications/(?P<app>\d+)/guilds/(?P<guild>\d+)/commands", self.sync_commands),
+            ("GET", r"/users/(?P<user>\d+)", self.get_user),
+            ("POST", r"/users/@me/channels", self.create_dm),
+            ("POST", r"/channels/(?P<channel>\d+)/messages", self.create_message),
+            ("GET", r"/channels/(?P<channel>\d+)/messages/(?P<message>\d+)", self.get_message),
+            ("PATCH", r"/channels/(?P<channel>\d+)/messages/(?P<message>\d+)", self.edit_message),
+            ("PUT", r"/channels/(?P<channel>\d+)/messages/(?P<message>\d+)/reactions/[^/]+/@me", self.no_content),
+            ("DELETE", r"/channels/(?P<channel>\d+)/messages/(?P<message>\d+)/reactions", self.no_content),
+            ("PUT", r"/guilds/(?P<guild>\d+)/members/(?P<user>\d+)/roles/(?P<role>\d+)", self.no_content),
+            ("DELETE", r"/guilds/(?P<guild>\d+)/members/(?P<user>\d+)/roles/(?P<role>\d+)", self.no_content),
+            ("GET", r"/guilds/(?P<guild>\d+)/members/(?P<user>\d+)", self.get_member),
+            ("POST", r"/interactions/(?P<interaction>\d+)/(?P<token>[^/]+)/callback", self.interaction_callback),
+            ("POST", r"/webhooks/(?P<app>\d+)/(?P<token>[^/]+)", self.followup),
+            ("PATCH", r"/webhooks/(?P<app>\d+)/(?P<token>[^/]+)/messages/@original", self.followup),
+        ]
+        self.routes = [(method, re.compile(pattern + "$"), handler) for method, pattern, handler in self.routes]
+        # Login and command sync are never throttled so every run starts the same way
+        self.unthrottled = {self.get_current_user, self.get_application, self.sync_commands}
+
+    # ---------- payloads ----------
+    def snowflake(self):
+        return str(next(self._ids))
+
+    def user_payload(self, user_id, bot=False):
+        return {"id": str(user_id), "username": f"user{str(user_id)[-6:]}", "discriminator": "0",
+                "global_name": None, "avatar": None, "bot": bot}
+
+    def member_payload(self, user_id):
+        return {"user": self.user_payload(user_id), "roles": [], "joined_at": now_iso(),
+                "deaf": False, "mute": False, "flags": 0}
+
+    def message_payload(self, channel_id, body, message_id=None):
+        payload = {
+            "id": message_id or self.snowflake(), "channel_id": channel_id, "author": self.bot_user,
+            "content": body.get("content") or "", "timestamp": now_iso(), "edited_timestamp": None,
+            "tts": False, "mention_everyone": False, "mentions": [], "mention_roles": [],
+            "attachments": [], "embeds": body.get("embeds") or [], "pinned": False, "type": 0,
+        }
+        if channel_id == self.channel_id:
+            payload["guild_id"] = self.guild_id
+        return payload
+
+    def guild_payload(self):
+        members = [self.member_payload(u) for u in [self.application_id, self.admin_id, *self.user_ids]]
+        everyone = {"id": self.guild_id, "name": "@everyone", "color": 0, "hoist": False, "position": 0,
+                    "permissions": "0", "managed": False, "mentionable": False}
+        premium = {**everyone, "id": self.role_id, "name": "Premium", "position": 1}
+        channel = {"id": self.channel_id, "type": 0, "name": "verification", "position": 0,
+                   "permission_overwrites": [], "guild_id": self.guild_id}
+        return {
+            "id": self.guild_id, "name": "Bench Guild", "owner_id": self.admin_id, "unavailable": False,
+            "large": False, "member_count": len(members), "members": members, "roles": [everyone, premium],
+            "channels": [channel], "threads": [], "emojis": [], "stickers": [], "features": [],
+            "voice_states": [], "presences": [], "stage_instances": [], "guild_scheduled_events": [],
+            "joined_at": now_iso(), "afk_timeout": 300, "verification_level": 0, "premium_tier": 0,
+            "preferred_locale": "en-US",
+        }
+
+    def interaction_payload(self, user_id, name, options):
+        token = f"tok{self.snowflake()}"
+        member = {**self.member_payload(user_id), "permissions": "0"}
+        return token, {
+            "id": self.snowflake(), "application_id": self.application_id, "type": 2, "token": token,
+            "version": 1, "guild_id": self.guild_id, "channel_id": self.channel_id, "member": member,
+            "app_permissions": "0", "locale": "en-US", "guild_locale": "en-US",
+            "data": {"id": self.snowflake(), "name": name, "type": 1,
+                     "options": [{"name": k, "type": 3, "value": v} for k, v in options.items()]},
+        }
+
+    # ---------- waiting on the bot ----------
+    def expect(self, key):
+        """Future resolved with the request body when the bot makes the matching REST call"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[key] = future
+        return future
+
+    def _resolve(self, key, body):
+        future = self._waiters.pop(key, None)
+        if future and not future.done():
+            future.set_result(body)
+
+    # ---------- gateway ----------
+    async def dispatch(self, event, data):
+        self._seq += 1
+        frame = json.dumps({"op": OP_DISPATCH, "t": event, "s": self._seq, "d": data})
+        for ws in list(self._sockets):
+            await ws.send_str(frame)
+
+    async def slash_command(self, user_id, name, **options):
+        """Invoke a slash command; resolves with the bot's followup body"""
+        token, payload = self.interaction_payload(user_id, name, options)
+        done = self.expect(("followup", token))
+        await self.dispatch("INTERACTION_CREATE", payload)
+        return await done
+
+    async def react(self, message_id, user_id=None, emoji="✅"):
+        """Add a reaction; resolves when the bot edits the message"""
+        done = self.expect(("edit", str(message_id)))
+        await self.dispatch("MESSAGE_REACTION_ADD", {
+            "user_id": str(user_id or self.admin_id), "channel_id": self.channel_id,
+            "message_id": str(message_id), "guild_id": self.guild_id,
+            "member": self.member_payload(user_id or self.admin_id),
+            "emoji": {"id": None, "name": emoji}, "type": 0,
+        })
+        return await done
+
+    async def handle_gateway(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({"op": OP_HELLO, "d": {"heartbeat_interval": 41250}})
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            frame = json.loads(msg.data)
+            if frame["op"] == OP_HEARTBEAT:
+                await ws.send_json({"op": OP_HEARTBEAT_ACK})
+            elif frame["op"] == OP_IDENTIFY:
+                self._sockets.add(ws)
+                await self.dispatch("READY", {
+                    "v": 10, "user": self.bot_user, "session_id": "bench", "resume_gateway_url": str(request.url),
+                    "application": {"id": self.application_id, "flags": 0},
+                    "guilds": [{"id": self.guild_id, "unavailable": True}],
+                })
+                await self.dispatch("GUILD_CREATE", self.guild_payload())
+        self._sockets.discard(ws)
+        return ws
+
+    # ---------- REST ----------
+    async def handle_rest(self, request):
+        path = request.path[len(API_PREFIX):]
+        for method, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if method == request.method and match:
+                break
+        else:
+            return json_response({"message": f"Unknown route {request.method} {path}", "code": 0}, status=404)
+
+        name = handler.__name__
+        self.requests[name] += 1
+        await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+
+        if handler not in self.unthrottled and self.random.random() < self.rate_limit_ratio:
+            self.rate_limited[name] += 1
+            return json_response(
+                {"message": "You are being rate limited.", "retry_after": self.retry_after, "global": False},
+                status=429, headers={"Via": "1.1 google"}
+            )
+
+        return await handler(request, await self.read_body(request), **match.groupdict())
+
+    async def read_body(self, request):
+        if not request.can_read_body:
+            return {}
+        if request.content_type.startswith("multipart/"):
+            form = await request.post()
+            return json.loads(form.get("payload_json") or "{}")
+        try:
+            return await request.json()
+        except json.JSONDecodeError:
+            return {}
+
+    async def no_content(self, request, body, **params):
+        return web.Response(status=204)
+
+    async def get_current_user(self, request, body):
+        return json_response(self.bot_user)
+
+    async def get_application(self, request, body):
+        return json_response({
+            "id": self.application_id, "name": "bench", "description": "", "icon": None,
+            "bot_public": True, "bot_require_code_grant": False, "verify_key": "",
+            "owner": self.user_payload(self.admin_id), "team": None, "flags": 0,
+        })
+
+    async def sync_commands(self, request, body, app, guild=None):
+        self.synced.set()
+        return json_response([
+            {**command, "id": self.snowflake(), "application_id": app, "version": "1", "default_member_permissions": None}
+            for command in body
+        ])
+
+    async def get_user(self, request, body, user):
+        return json_response(self.user_payload(user))
+
+    async def get_member(self, request, body, guild, user):
+        return json_response(self.member_payload(user))
+
+    async def create_dm(self, request, body):
+        return json_response({"id": self.snowflake(), "type": 1, "last_message_id": None,
+                                  "recipients": [self.user_payload(body["recipient_id"])]})
+
+    async def create_message(self, request, body, channel):
+        payload = self.message_payload(channel, body)
+        if channel == self.channel_id:
+            for embed in payload["embeds"]:
+                for field in embed.get("fields", []):
+                    if field["name"] == "Order ID":
+                        self.verification_messages.append((field["value"].strip("`"), payload["id"]))
+        return json_response(payload)
+
+    async def get_message(self, request, body, channel, message):
+        return json_response(self.message_payload(channel, {}, message_id=message))
+
+    async def edit_message(self, request, body, channel, message):
+        self._resolve(("edit", message), body)
+        return json_response(self.message_payload(channel, body, message_id=message))
+
+    async def interaction_callback(self, request, body, interaction, token):
+        if body.get("type") == 4:  # immediate reply, no followup will come
+            self._resolve(("followup", token), body.get("data", {}))
+        return web.Response(status=204)
+
+    async def followup(self, request, body, app, token):
+        self._resolve(("followup", token), body)
+        return json_response(self.message_payload(self.channel_id, body))
+
+    # ---------- server ----------
+    def make_app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/gateway", self.handle_gateway)
+        app.router.add_route("*", API_PREFIX + "/{tail:.*}", self.handle_rest)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start serving; returns (api_base, gateway_url)"""
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}{API_PREFIX}", f"ws://{host}:{port}/gateway"
+
+    async def stop(self):
+        for ws in list(self._sockets):
+            await ws.close()
+        await self._runner.cleanup()
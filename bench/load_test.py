@@ -0,0 +1,336 @@
+"""Offline load test for combined_bot.py.
+
+For each dataset size the bot is started as a subprocess in a scratch directory
+seeded with synthetic orders.json / redeem_codes.json, pointed at bench/fake_discord.py
+instead of Discord, and driven with an open-loop mix of /payment calls, /purchase and
+/redeem slash commands and ✅ reaction verifications.
+
+    python bench/load_test.py --sizes 1000,100000 --rate 50 --duration 30
+    python bench/load_test.py --sizes 1000000 --latency 0.1 --rate-limit-ratio 0.02
+
+Reports throughput and p50/p99 latency per operation, bot startup time, and
+event-loop stall time scraped from the bot's /metrics endpoint.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_discord import FakeDiscord
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "combined_bot.py")
+GUILD_ID, CHANNEL_ID, ROLE_ID, ADMIN_ID = 900000000000000001, 900000000000000002, 900000000000000003, 900000000000000004
+PLANS = {"1d": 1, "7d": 7, "30d": 30, "90d": 90, "AntiAfk-Script": "antiafk", "Items-Script": "items"}
+CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+
+# ========== SYNTHETIC DATA ==========
+def write_synthetic_data(workdir, size, user_ids, rng):
+    """Write `size` orders and `size` codes in the bot's file layouts.
+
+    Returns (unredeemed codes, (order_id, message_id) of pending orders) for the driver.
+    Records are streamed one at a time so 1M-entry files do not need to fit in memory twice.
+    """
+    now = datetime.now()
+    pending = []
+    with open(os.path.join(workdir, "orders.json"), "w") as f:
+        f.write("{")
+        for i in range(size):
+            created = now - timedelta(seconds=rng.randint(0, 180 * 86400))
+            plan = rng.choice(list(PLANS))
+            order_id = f"order_{created.strftime('%Y%m%d%H%M%S')}_{i:07d}"
+            order = {
+                "discord_id": rng.choice(user_ids), "amount": rng.randint(19_000_000, 200_000_000),
+                "days": PLANS[plan], "plan": plan, "is_code_redemption": False,
+                "created_at": created.isoformat(),
+            }
+            if rng.random() < 0.05:
+                message_id = 800000000000000000 + i
+                order.update(status="pending", message_id=message_id)
+                pending.append((order_id, message_id))
+            else:
+                order.update(status="verified", verified_at=created.isoformat(), verified_by="bench")
+            f.write(("," if i else "") + json.dumps(order_id) + ":" + json.dumps(order))
+        f.write("}")
+
+    codes = []
+    with open(os.path.join(workdir, "redeem_codes.json"), "w") as f:
+        f.write('{"codes": [')
+        for i in range(size):
+            code = "".join(rng.choices(CODE_ALPHABET, k=10))
+            plan = rng.choice(list(PLANS))
+            record = {"code": code, "plan": plan, "days": PLANS[plan], "created_at": now.isoformat(),
+                      "created_by": str(ADMIN_ID), "redeemed": rng.random() < 0.5}
+            if not record["redeemed"]:
+                codes.append(code)
+            f.write(("," if i else "") + json.dumps(record))
+        f.write("]}")
+
+    rng.shuffle(codes)
+    return codes, pending
+
+# ========== BOT PROCESS ==========
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def start_bot(workdir, args, api_base, gateway_url, port):
+    env = {
+        **os.environ,
+        "DISCORD_BOT_TOKEN": "bench.fake.token", "DISCORD_API_BASE": api_base, "DISCORD_GATEWAY_URL": gateway_url,
+        "PORT": str(port), "GUILD_ID": str(GUILD_ID), "VERIFICATION_CHANNEL_ID": str(CHANNEL_ID),
+        "PREMIUM_ROLE_ID": str(ROLE_ID), "ADMIN_IDS": str(ADMIN_ID), "STORAGE_BACKEND": args.backend,
+        "PYTHONUNBUFFERED": "1",
+    }
+    log = open(os.path.join(workdir, "bot.log"), "ab")
+    if args.backend == "sqlite":
+        importer = await asyncio.create_subprocess_exec(sys.executable, BOT_PATH, "import-json", cwd=workdir,
+                                                        env=env, stdout=log, stderr=log)
+        await importer.wait()
+    return await asyncio.create_subprocess_exec(sys.executable, BOT_PATH, cwd=workdir, env=env,
+                                                stdout=log, stderr=log)
+
+async def stop_bot(process):
+    if process.returncode is not None:
+        return
+    process.send_signal(signal.SIGINT)
+    try:
+        await asyncio.wait_for(process.wait(), timeout=15)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+async def scrape_loop_lag(session, port):
+    """Return ({bucket bound: cumulative count}, sum, count) of event_loop_lag_seconds"""
+    async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+        text = await response.text()
+    buckets, total, count = {}, 0.0, 0
+    for line in text.splitlines():
+        if line.startswith("event_loop_lag_seconds_bucket"):
+            bound = re.search(r'le="([^"]+)"', line).group(1)
+            buckets[float(bound)] = float(line.rsplit(" ", 1)[1])
+        elif line.startswith("event_loop_lag_seconds_sum"):
+            total = float(line.rsplit(" ", 1)[1])
+        elif line.startswith("event_loop_lag_seconds_count"):
+            count = int(float(line.rsplit(" ", 1)[1]))
+    return buckets, total, count
+
+def lag_summary(before, after):
+    """Stall time, sample count, and the bucket bounds holding p99 and the worst sample"""
+    buckets = {b: after[0].get(b, 0) - before[0].get(b, 0) for b in after[0]}
+    total, count = after[1] - before[1], after[2] - before[2]
+    p99 = worst = None
+    for bound in sorted(buckets):
+        if p99 is None and count and buckets[bound] >= 0.99 * count:
+            p99 = bound
+        if worst is None and count and buckets[bound] >= count:
+            worst = bound
+    return {"stall_seconds": total, "samples": count, "p99_le": p99, "max_le": worst}
+
+# ========== LOAD DRIVER ==========
+class LoadDriver:
+    def __init__(self, fake, port, session, codes, pending, user_ids, rng, timeout):
+        self.fake = fake
+        self.port = port
+        self.session = session
+        self.codes = codes
+        self.reactable = collections.deque(pending)
+        self.user_ids = user_ids
+        self.rng = rng
+        self.timeout = timeout
+        self.unpaid = collections.deque()  # amounts of purchases not paid for yet
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.skipped = collections.Counter()
+
+    async def payment(self):
+        # Pay for an outstanding purchase when there is one so auto-matching is exercised
+        amount = self.unpaid.popleft() if self.unpaid else self.rng.randint(1_000_000, 18_000_000)
+        body = {"minecraft_username": f"player{self.rng.randint(1, 10**6)}", "amount": amount,
+                "timestamp": time.time()}
+        async with self.session.post(f"http://127.0.0.1:{self.port}/payment", json=body) as response:
+            await response.read()
+            if response.status >= 400:
+                raise RuntimeError(f"HTTP {response.status}")
+
+    async def purchase(self):
+        reply = await self.fake.slash_command(self.rng.choice(self.user_ids), "purchase", plan=self.rng.choice(list(PLANS)))
+        match = re.search(r"/pay \S+ (\d+)", reply.get("content") or "")
+        if not match:
+            raise RuntimeError("purchase did not return payment instructions")
+        self.unpaid.append(int(match.group(1)))
+
+    async def redeem(self):
+        if not self.codes:
+            return "skipped"
+        reply = await self.fake.slash_command(self.rng.choice(self.user_ids), "redeem", code=self.codes.pop())
+        if "✅" not in (reply.get("content") or ""):
+            raise RuntimeError("redeem was rejected")
+
+    async def reaction(self):
+        while self.fake.verification_messages:
+            self.reactable.append(self.fake.verification_messages.popleft())
+        if not self.reactable:
+            return "skipped"
+        order_id, message_id = self.reactable.popleft()
+        await self.fake.react(message_id)
+
+    async def run_one(self, name):
+        started = time.perf_counter()
+        try:
+            outcome = await asyncio.wait_for(getattr(self, name)(), timeout=self.timeout)
+        except Exception as e:
+            self.errors[name] += 1
+            if self.errors[name] <= 3:
+                print(f"⚠️ {name} failed: {type(e).__name__}: {e}")
+            return
+        if outcome == "skipped":
+            self.skipped[name] += 1
+        else:
+            self.latencies[name].append(time.perf_counter() - started)
+
+    async def run(self, rate, duration, mix):
+        """Fire operations at `rate` per second for `duration` seconds (open loop)"""
+        names, weights = zip(*mix.items())
+        tasks = set()
+        started = time.perf_counter()
+        fired = 0
+        while time.perf_counter() - started < duration:
+            due = int((time.perf_counter() - started) * rate) + 1
+            while fired < due:
+                task = asyncio.create_task(self.run_one(self.rng.choices(names, weights)[0]))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                fired += 1
+            await asyncio.sleep(1 / rate)
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.timeout)
+        return time.perf_counter() - started
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+# ========== RUN ==========
+async def run_size(size, args):
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix=f"bench_{size}_")
+    user_ids = [str(700000000000000000 + i) for i in range(args.users)]
+
+    print(f"\n📦 {size:,} orders / codes in {workdir}")
+    generated = time.perf_counter()
+    codes, pending = write_synthetic_data(workdir, size, user_ids, rng)
+    print(f"   generated in {time.perf_counter() - generated:.1f}s "
+          f"(orders.json {os.path.getsize(os.path.join(workdir, 'orders.json')) / 1e6:.1f} MB)")
+
+    fake = FakeDiscord(GUILD_ID, CHANNEL_ID, ROLE_ID, ADMIN_ID, user_ids, latency=args.latency,
+                       jitter=args.jitter, rate_limit_ratio=args.rate_limit_ratio,
+                       retry_after=args.retry_after, seed=args.seed)
+    api_base, gateway_url = await fake.start()
+    port = free_port()
+
+    launched = time.perf_counter()
+    bot = await start_bot(workdir, args, api_base, gateway_url, port)
+    result = {"size": size}
+    try:
+        ready = asyncio.ensure_future(fake.synced.wait())
+        exited = asyncio.ensure_future(bot.wait())
+        await asyncio.wait({ready, exited}, timeout=args.startup_timeout, return_when=asyncio.FIRST_COMPLETED)
+        exited.cancel()
+        if not fake.synced.is_set():
+            ready.cancel()
+            raise RuntimeError(f"bot did not become ready, see {workdir}/bot.log")
+        result["startup_seconds"] = time.perf_counter() - launched
+        print(f"   bot ready in {result['startup_seconds']:.1f}s")
+
+        async with aiohttp.ClientSession() as session:
+            before = await scrape_loop_lag(session, port)
+            driver = LoadDriver(fake, port, session, codes, pending, user_ids, rng, args.op_timeout)
+            elapsed = await driver.run(args.rate, args.duration, args.mix)
+            after = await scrape_loop_lag(session, port)
+
+        result["ops"] = {
+            name: {"ok": len(driver.latencies[name]), "errors": driver.errors[name], "skipped": driver.skipped[name],
+                   "per_second": len(driver.latencies[name]) / elapsed,
+                   "p50_ms": percentile(driver.latencies[name], 50) * 1000,
+                   "p99_ms": percentile(driver.latencies[name], 99) * 1000}
+            for name in args.mix
+        }
+        result["event_loop"] = lag_summary(before, after)
+        result["rate_limited"] = dict(fake.rate_limited)
+    finally:
+        await stop_bot(bot)
+        await fake.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+def print_report(result):
+    print(f"\n📊 {result['size']:,} entries — startup {result['startup_seconds']:.1f}s")
+    print(f"   {'operation':<10} {'ok':>7} {'err':>5} {'skip':>5} {'ops/s':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, op in result["ops"].items():
+        print(f"   {name:<10} {op['ok']:>7} {op['errors']:>5} {op['skipped']:>5} {op['per_second']:>8.1f} "
+              f"{op['p50_ms']:>9.1f} {op['p99_ms']:>9.1f}")
+    loop = result["event_loop"]
+    print(f"   event loop stall {loop['stall_seconds']:.3f}s over {loop['samples']} samples "
+          f"(p99 ≤ {loop['p99_le']}s, max ≤ {loop['max_le']}s)")
+    if result["rate_limited"]:
+        print(f"   429s injected: {sum(result['rate_limited'].values())} {result['rate_limited']}")
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("payment", "purchase", "redeem", "reaction"):
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="comma-separated dataset sizes")
+    parser.add_argument("--rate", type=float, default=50, help="operations per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load per size")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("payment=1,purchase=1,redeem=1,reaction=1"),
+                        help="operation weights, e.g. payment=4,purchase=1")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake Discord REST latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="+/- latency jitter in seconds")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of REST calls answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="retry_after sent with injected 429s")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--users", type=int, default=1000, help="guild members to simulate")
+    parser.add_argument("--op-timeout", type=float, default=30)
+    parser.add_argument("--startup-timeout", type=float, default=900)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directories (bot.log, data files)")
+    args = parser.parse_args()
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        result = asyncio.run(run_size(size, args))
+        print_report(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,105 +1,2065 @@
 import os
+import sys
 import discord
 from discord.ext import commands
 import random
 import json
+import sqlite3
 from typing import Literal
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import asyncio
+import collections
+import heapq
+import itertools
+import time
 from aiohttp import web
 import threading
+import logging
+import logging.handlers
+import queue
+import atexit
+import re
+import urllib.parse
+import yarl
+import bisect
+import secrets
+import csv
+import io
+import gzip
+import hashlib
+import zlib
+import multiprocessing
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
-print("🚀 Starting Discord bot with payment processing...")
+# ========== LOGGING ==========
+# Code on the event loop only enqueues log records. A listener thread encodes them
+# as JSON lines and writes stdout, so a slow or captured stdout never delays a request.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Fraction of records kept per level, e.g. "DEBUG=0.01,INFO=0.5"; unlisted levels keep everything
+LOG_SAMPLE_RATES = {
+    level.strip().upper(): float(rate)
+    for level, rate in (item.split('=') for item in os.getenv('LOG_SAMPLE_RATES', '').split(',') if item.strip())
+}
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line; fields passed to `log` become top-level keys"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "fields", {})
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SampledQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the log listener without ever blocking the caller.
+
+    Levels with a sample rate below 1 keep that fraction of their records (the
+    rate is attached to kept records so counts can be scaled back up). Records
+    that arrive while the queue is full are dropped and counted.
+    """
+
+    def __init__(self, log_queue, sample_rates):
+        super().__init__(log_queue)
+        self.sample_rates = {logging.getLevelName(level): rate for level, rate in sample_rates.items()}
+        self.sampled_out = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve the message and traceback now; the listener formats the rest
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        rate = self.sample_rates.get(record.levelno, 1.0)
+        if rate < 1.0:
+            if random.random() >= rate:
+                self.sampled_out += 1
+                return
+            record.fields = {**getattr(record, "fields", {}), "sample_rate": rate}
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+
+class StructuredLogger(logging.LoggerAdapter):
+    """`log.info("message", order_id=..., stage=...)`: keyword arguments become JSON fields"""
+
+    RESERVED = {"exc_info", "stack_info", "stacklevel", "extra"}
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in self.RESERVED}
+        kwargs["extra"] = {"fields": fields}
+        return msg, kwargs
+
+log = StructuredLogger(logging.getLogger("bot"), {})
+log_handler = None
+log_listener = None
+
+def setup_logging():
+    """Send every logger through a fresh queue and listener thread; forked workers call it again"""
+    global log_handler, log_listener
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonLogFormatter())
+    
+    root = logging.getLogger()
+    if log_handler:
+        root.removeHandler(log_handler)
+    log_handler = SampledQueueHandler(log_queue, LOG_SAMPLE_RATES)
+    root.addHandler(log_handler)
+    root.setLevel(LOG_LEVEL)
+    
+    log_listener = logging.handlers.QueueListener(log_queue, stream)
+    log_listener.start()
+
+def stop_logging():
+    """Write out everything still queued"""
+    global log_listener
+    if log_listener:
+        log_listener.stop()
+        log_listener = None
+
+@contextlib.contextmanager
+def log_stage(message, stage, level=logging.INFO, **fields):
+    """Log `message` for `stage` with its duration when the block exits; fields learned inside go into the yielded dict"""
+    started = time.perf_counter()
+    try:
+        yield fields
+    except Exception as e:
+        fields["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if "error" in fields:
+            level = max(level, logging.ERROR)
+        log.log(level, message, stage=stage, duration_ms=round((time.perf_counter() - started) * 1000, 2), **fields)
+
+setup_logging()
+atexit.register(stop_logging)
+# discord.py debug output is gateway chatter, and every payment request would get an aiohttp access line
+logging.getLogger("discord").setLevel(max(logging.INFO, logging.getLogger().level))
+logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+
+log.info("🚀 Starting Discord bot with payment processing...")
 
 # ========== CONFIGURATION ==========
 DISCORD_BOT_TOKEN = os.getenv('DISCORD_BOT_TOKEN')
 
-if not DISCORD_BOT_TOKEN:
-    print("❌ CRITICAL: DISCORD_BOT_TOKEN environment variable is not set!")
+# Maintenance commands (e.g. `python combined_bot.py import-json`) run without Discord
+CLI_COMMAND = sys.argv[1] if __name__ == "__main__" and len(sys.argv) > 1 else None
+
+if not DISCORD_BOT_TOKEN and CLI_COMMAND is None:
+    log.critical("❌ CRITICAL: DISCORD_BOT_TOKEN environment variable is not set!")
     exit(1)
 
 CODES_FILE = "redeem_codes.json"
 ORDERS_FILE = "orders.json"
+ORDERS_JOURNAL_FILE = "orders.journal"
+CODES_JOURNAL_FILE = "redeem_codes.journal"
+COMMAND_SYNC_FILE = "command_sync.json"
+PAYMENT_SPOOL_FILE = os.getenv('PAYMENT_SPOOL_FILE', 'payment_spool.db')
+# The snapshot is rewritten once the journal grows past this fraction of the snapshot
+# size (and past the minimum), so rewrites cost a constant amount per journaled byte
+JOURNAL_COMPACT_RATIO = float(os.getenv('JOURNAL_COMPACT_RATIO', '0.5'))
+JOURNAL_COMPACT_MIN_BYTES = int(os.getenv('JOURNAL_COMPACT_MIN_BYTES', str(1024 * 1024)))
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')  # "json" or "sqlite"
+SQLITE_DB_FILE = os.getenv('SQLITE_DB_FILE', 'bot.db')
+SQLITE_QUICK_CHECK = os.getenv('SQLITE_QUICK_CHECK', 'true').lower() in ('1', 'true', 'yes')
 PAYMENT_TARGET = "number27"
 ADMIN_IDS = os.getenv('ADMIN_IDS', '1388619131984806039').split(',')
 PREMIUM_ROLE_ID = int(os.getenv('PREMIUM_ROLE_ID', '1283132591553380479'))
 VERIFICATION_CHANNEL_ID = int(os.getenv('VERIFICATION_CHANNEL_ID', '1420479936715554928'))
 GUILD_ID = int(os.getenv('GUILD_ID', '1417458795461869670'))
+PAYMENT_WORKERS = int(os.getenv('PAYMENT_WORKERS', '4'))
+PAYMENT_BATCH_MAX = int(os.getenv('PAYMENT_BATCH_MAX', '1000'))
+PURCHASE_RESERVATION_HOURS = float(os.getenv('PURCHASE_RESERVATION_HOURS', '24'))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_TTL_HOURS = float(os.getenv('IDEMPOTENCY_TTL_HOURS', '24'))
+GENERATE_CODES_MAX = int(os.getenv('GENERATE_CODES_MAX', '100000'))
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '90'))  # 0 disables scheduled archival
+ARCHIVE_INTERVAL_HOURS = float(os.getenv('ARCHIVE_INTERVAL_HOURS', '24'))
+LAZY_MEMBERS = os.getenv('LAZY_MEMBERS', 'false').lower() in ('1', 'true', 'yes')
+MEMBER_CACHE_SIZE = int(os.getenv('MEMBER_CACHE_SIZE', '10000'))
+MEMBER_CACHE_TTL_SECONDS = float(os.getenv('MEMBER_CACHE_TTL_SECONDS', '300'))
+COMMAND_SYNC_SCOPE = os.getenv('COMMAND_SYNC_SCOPE', 'global')  # "global" or "guild" (GUILD_ID only)
+# Split deployment: `ingest` workers accept payments on PORT, the `discord` process serves /health and /metrics on ADMIN_PORT
+HTTP_PORT = int(os.getenv('PORT', '5000'))  # Railway provides PORT
+ADMIN_PORT = int(os.getenv('ADMIN_PORT', '5001'))
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', str(os.cpu_count() or 1)))
+SPOOL_POLL_SECONDS = float(os.getenv('SPOOL_POLL_SECONDS', '0.25'))
+# Plan names, price ranges and durations; edits are picked up without a restart
+PLANS_FILE = os.getenv('PLANS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plans.json'))
+PLANS_RELOAD_SECONDS = float(os.getenv('PLANS_RELOAD_SECONDS', '5'))
 
-print("✅ Environment variables loaded successfully")
+log.info("✅ Environment variables loaded successfully")
 
 # Initialize Discord bot
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 intents.reactions = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+if LAZY_MEMBERS:
+    # No member chunking or member cache; members are fetched on demand by MemberResolver
+    bot = commands.Bot(command_prefix="!", intents=intents, chunk_guilds_at_startup=False,
+                       member_cache_flags=discord.MemberCacheFlags.none())
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents)
+
+# Point the client at a local stand-in for Discord (used by bench/load_test.py)
+DISCORD_API_BASE = os.getenv('DISCORD_API_BASE')
+DISCORD_GATEWAY_URL = os.getenv('DISCORD_GATEWAY_URL')
+if DISCORD_API_BASE:
+    discord.http.Route.BASE = DISCORD_API_BASE
+if DISCORD_GATEWAY_URL:
+    discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(DISCORD_GATEWAY_URL)
+
+# ========== METRICS ==========
+class Counter:
+    def __init__(self, registry, name, help_text):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.values = collections.defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        with self.registry.lock:
+            self.values[tuple(sorted(labels.items()))] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(labels)} {value}")
+        return lines
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, registry, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.registry.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["buckets"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(labels + (('le', '+Inf'),))} {series['count']}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {series['sum']}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {series['count']}")
+        return lines
+
+class Gauge:
+    """Reads its value from a callback at scrape time; the callback may return a number
+    or a dict of {label value: number} for the `label` label"""
+
+    def __init__(self, registry, name, help_text, callback, label=None):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.label = label
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        value = self.callback()
+        if isinstance(value, dict):
+            for label_value, number in value.items():
+                lines.append(f"{self.name}{format_labels(((self.label, label_value),))} {number}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+class MetricsRegistry:
+    """Minimal Prometheus text-format registry; counters and histograms are thread-safe"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def counter(self, name, help_text):
+        return self._register(Counter(self, name, help_text))
+
+    def histogram(self, name, help_text, buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help_text, buckets))
+
+    def gauge(self, name, help_text, callback, label=None):
+        return self._register(Gauge(self, name, help_text, callback, label))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                if isinstance(metric, Gauge):
+                    lines.extend(metric.render())
+                else:
+                    with self.lock:
+                        lines.extend(metric.render())
+            except Exception as e:
+                log.error("❌ Error rendering metric", metric=metric.name, error=str(e))
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+http_requests_total = metrics.counter("payment_api_requests_total", "HTTP requests by route, method and status")
+http_request_seconds = metrics.histogram("payment_api_request_seconds", "HTTP request latency by route")
+storage_op_seconds = metrics.histogram("storage_operation_seconds", "Time spent running a storage operation on the storage or archive thread")
+storage_queue_seconds = metrics.histogram("storage_queue_wait_seconds", "Time a storage operation waited for the storage or archive thread")
+storage_bytes_written_total = metrics.counter("storage_bytes_written_total", "Bytes written to storage files")
+discord_api_seconds = metrics.histogram("discord_api_seconds", "Discord REST action latency by route")
+discord_rate_limited_total = metrics.counter("discord_rate_limited_total", "Discord 429 responses by route")
+event_loop_lag_seconds = metrics.histogram("event_loop_lag_seconds", "How late the event loop woke up a 0.5s sleep")
+
+class DiscordRateLimitLogHandler(logging.Handler):
+    """Counts the 429s that discord.py retries internally (it only logs them)"""
+
+    def emit(self, record):
+        if record.msg.startswith("Global rate limit"):
+            discord_rate_limited_total.inc(route="global")
+        elif record.msg.startswith("We are being rate limited") and len(record.args) >= 2:
+            route = re.sub(r"/\d{15,}", "/:id", urllib.parse.urlsplit(str(record.args[1])).path)
+            discord_rate_limited_total.inc(route=f"{record.args[0]} {route}")
+
+logging.getLogger("discord.http").addHandler(DiscordRateLimitLogHandler(logging.WARNING))
+
+async def monitor_event_loop_lag(interval=0.5):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, time.perf_counter() - started - interval))
+
+# ========== STORAGE I/O ==========
+# All disk I/O and JSON encoding runs on one dedicated thread so a slow disk never
+# stalls the event loop shared by the Discord gateway and the payment server.
+# A thread does not help with the GIL, though: json.dumps holds it for the whole
+# value, so large snapshots are encoded one record at a time (see JournaledStore).
+# A single worker also keeps writes in submission order.
+# Archive segments are read and rewritten on a thread of their own, so a lookup or
+# an archival scanning months of history never holds up /payment writes.
+storage_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+
+def run_in_executor_timed(executor, func, *args):
+    submitted = time.perf_counter()
+    
+    def timed():
+        started = time.perf_counter()
+        storage_queue_seconds.observe(started - submitted, op=func.__name__)
+        try:
+            return func(*args)
+        finally:
+            storage_op_seconds.observe(time.perf_counter() - started, op=func.__name__)
+    
+    return asyncio.get_running_loop().run_in_executor(executor, timed)
+
+def run_in_storage_thread(func, *args):
+    """Schedule blocking storage work on the storage thread and return an awaitable"""
+    return run_in_executor_timed(storage_executor, func, *args)
+
+def run_in_archive_thread(func, *args):
+    """Schedule history archive work on the archive thread; HistoryArchive is only used from there"""
+    return run_in_executor_timed(archive_executor, func, *args)
+
+def write_bytes_atomic(path, data):
+    """Write to a temp file and rename it over the target; the rename is fsynced too"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+    storage_bytes_written_total.inc(len(data), file=os.path.basename(path))
+
+def write_json_atomic(path, data, indent=None):
+    """Write JSON to a temp file and rename it over the target"""
+    write_bytes_atomic(path, json.dumps(data, indent=indent).encode())
+
+class StorageCorruptError(Exception):
+    """Stored state failed an integrity check; the bot refuses to start rather than run on part of it"""
+
+# Snapshots start with a header line carrying the SHA-256 of the JSON payload below it and
+# the checksum of the snapshot they replaced. Files without the header are legacy snapshots.
+SNAPSHOT_FORMAT = "snapshot-v2"
+SNAPSHOT_PREFIX = b'{"format": "snapshot-v2"'
+
+# The header line is padded to a fixed width, so it can be filled in after the payload
+# has been streamed out behind it
+SNAPSHOT_HEADER_BYTES = 256
+
+def write_snapshot_stream(path, chunks, previous):
+    """Write a checksummed snapshot from an iterable of payload byte chunks; returns (checksum, size)"""
+    tmp_path = path + ".tmp"
+    digest = hashlib.sha256()
+    size = 0
+    with open(tmp_path, 'wb', buffering=1024 * 1024) as f:
+        f.write(b" " * (SNAPSHOT_HEADER_BYTES - 1) + b"\n")
+        for chunk in chunks:
+            digest.update(chunk)
+            f.write(chunk)
+            size += len(chunk)
+        checksum = digest.hexdigest()
+        header = json.dumps({"format": SNAPSHOT_FORMAT, "sha256": checksum, "bytes": size, "previous": previous}).encode()
+        f.seek(0)
+        f.write(header.ljust(SNAPSHOT_HEADER_BYTES - 1) + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+    storage_bytes_written_total.inc(SNAPSHOT_HEADER_BYTES + size, file=os.path.basename(path))
+    return checksum, SNAPSHOT_HEADER_BYTES + size
+
+def write_snapshot_atomic(path, data, previous):
+    """Write a checksummed snapshot of `data`; returns its checksum"""
+    return write_snapshot_stream(path, [json.dumps(data).encode()], previous)[0]
+
+def json_object_chunks(items):
+    """json.dumps of a mapping, as one chunk per (key, value) pair.
+
+    Encoding record by record lets the event loop thread take the GIL between
+    records instead of waiting out one json.dumps of the whole store.
+    """
+    separator = b"{"
+    for key, value in items:
+        yield separator + f"{json.dumps(key)}: {json.dumps(value)}".encode()
+        separator = b", "
+    yield b"}" if separator == b", " else b"{}"
+
+def read_snapshot(path):
+    """(data, checksum, previous checksum) of a snapshot; legacy snapshots have neither checksum"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    
+    try:
+        if not raw.startswith(SNAPSHOT_PREFIX):
+            return json.loads(raw), None, None
+        
+        header_line, _, payload = raw.partition(b"\n")
+        header = json.loads(header_line)
+        if len(payload) != header["bytes"] or hashlib.sha256(payload).hexdigest() != header["sha256"]:
+            raise StorageCorruptError(f"{path}: checksum mismatch ({len(payload)} of {header['bytes']} bytes)")
+        return json.loads(payload), header["sha256"], header["previous"]
+    except (json.JSONDecodeError, UnicodeDecodeError, KeyError) as e:
+        raise StorageCorruptError(f"{path}: unreadable snapshot ({type(e).__name__}: {e})")
+
+def encode_journal_line(entry):
+    payload = json.dumps(entry)
+    return f"{zlib.crc32(payload.encode()):08x} {payload}\n"
+
+def decode_journal_line(raw):
+    """The entry on a journal line, or None when the line is torn or fails its CRC"""
+    try:
+        if raw.startswith(b"{"):
+            # Entries written before journal lines carried a CRC
+            return json.loads(raw)
+        crc, _, payload = raw.rstrip(b"\n").partition(b" ")
+        if int(crc, 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+# ========== SALES AGGREGATES ==========
+def sales_bucket(order):
+    """(day, plan, status) an order is counted under; code redemptions are not sales"""
+    if order.get("is_code_redemption"):
+        return None
+    return order.get("created_at", "")[:10] or "unknown", order.get("plan", "Unknown"), order.get("status", "pending")
+
+class SalesTotals:
+    """Order count and amount per (day, plan, status) bucket, adjusted one order at a time"""
+
+    def __init__(self):
+        self.buckets = {}
+
+    @classmethod
+    def of(cls, orders):
+        totals = cls()
+        for order in orders:
+            totals.add(order)
+        return totals
+
+    def add(self, order, sign=1):
+        bucket = sales_bucket(order)
+        if bucket is None:
+            return
+        totals = self.buckets.setdefault(bucket, [0, 0])
+        totals[0] += sign
+        totals[1] += sign * order.get("amount", 0)
+        if not totals[0]:
+            del self.buckets[bucket]
+
+    def rows(self):
+        """[(day, plan, status, orders, amount), ...]"""
+        return [(*bucket, count, amount) for bucket, (count, amount) in self.buckets.items()]
+
+# ========== JOURNALED STORES ==========
+class JournaledStore:
+    """In-memory records keyed by id, backed by a snapshot file and an append-only journal.
+
+    Records are loaded once at startup. Every mutation is appended to the journal as a
+    single entry, and the snapshot is rewritten only once the journal has grown past
+    `compact_ratio` of the snapshot's size, so rewriting it costs a constant amount per
+    journaled byte however large the store is, and replay at startup is bounded. The
+    snapshot is encoded and streamed out one record at a time.
+
+    Snapshots carry a SHA-256 and journal lines a CRC32. Each journal starts with a
+    `base` entry naming the snapshot it continues, so a journal is never replayed on
+    top of the wrong snapshot. A journal write that fails is cut back off the file and
+    its change undone in memory.
+    """
+
+    kind = "records"
+
+    def __init__(self, snapshot_path, journal_path, compact_ratio=0.5, compact_min_bytes=1024 * 1024):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self._records = {}
+        self._journal = None
+        self._journal_bytes = 0
+        self._snapshot_bytes = 0
+        self._compacting = False
+        self._checksum = None
+        self._write_error = None
+
+    def _decode_snapshot(self, data):
+        return data
+
+    def _snapshot_chunks(self, records):
+        return json_object_chunks(records.items())
+
+    def _needs_compaction(self):
+        return self._journal_bytes >= max(self.compact_min_bytes, self.compact_ratio * self._snapshot_bytes)
+
+    def load(self):
+        """Rebuild state from the latest snapshot plus the journal written after it.
+
+        A torn entry at the very end of the journal (a crash mid-append) is cut off.
+        Any other damage raises StorageCorruptError instead of starting with part of
+        the history.
+        """
+        with log_stage(f"📦 Loaded {self.kind}", "load", kind=self.kind) as fields:
+            try:
+                data, self._checksum, previous = read_snapshot(self.snapshot_path)
+                snapshot, has_snapshot = self._decode_snapshot(data), True
+                self._snapshot_bytes = os.path.getsize(self.snapshot_path)
+            except FileNotFoundError:
+                snapshot, has_snapshot, previous = {}, False, None
+
+            for key, value in snapshot.items():
+                self._set(key, value)
+
+            entries = self._read_journal()
+            base = entries[0]["snapshot"] if entries and entries[0]["op"] == "base" else None
+            if entries and base != self._checksum:
+                if not (has_snapshot and base == previous):
+                    raise StorageCorruptError(f"{self.journal_path} does not continue {self.snapshot_path}")
+                # The crash came between writing the snapshot and starting its journal,
+                # so every entry of the old journal is in the snapshot already
+                entries = []
+
+            for entry in entries:
+                self._apply(entry)
+            replayed = sum(1 for entry in entries if entry["op"] != "base")
+
+            if entries:
+                self._journal = open(self.journal_path, 'a')
+                self._journal_bytes = self._journal.tell()
+            else:
+                self._start_journal()
+            fields.update(records=len(self._records), replayed=replayed, checksummed=self._checksum is not None)
+
+            # Legacy snapshots are rewritten right away so the next start can verify them
+            if self._needs_compaction() or has_snapshot and self._checksum is None:
+                self._write_snapshot(dict(self._records))
+
+    def _read_journal(self):
+        """Intact journal entries; a torn tail is truncated away"""
+        entries = []
+        intact = 0
+        try:
+            f = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            return entries
+        
+        with f:
+            for raw in f:
+                entry = decode_journal_line(raw) if raw.endswith(b"\n") else None
+                if entry is None and raw.strip():
+                    if f.read().strip():
+                        raise StorageCorruptError(f"{self.journal_path}: damaged entry at byte {intact}")
+                    break
+                if entry is not None:
+                    entries.append(entry)
+                intact += len(raw)
+            size = f.seek(0, os.SEEK_END)
+        
+        if size > intact:
+            log.warning("⚠️ Cutting torn entry off the end of the journal", stage="load", journal=self.journal_path, torn_bytes=size - intact)
+            os.truncate(self.journal_path, intact)
+        return entries
+
+    def _set(self, key, value):
+        self._records[key] = value
+
+    def _delete(self, key):
+        self._records.pop(key, None)
+
+    def _apply(self, entry):
+        if entry["op"] == "put":
+            self._set(entry["id"], entry["value"])
+        elif entry["op"] == "del":
+            self._delete(entry["id"])
+
+    def _write_entries(self, entries):
+        # Runs on the storage thread
+        if self._write_error:
+            raise StorageCorruptError(f"{self.journal_path} is read-only after a failed write: {self._write_error}")
+        encoded = "".join(encode_journal_line(entry) for entry in entries)
+        try:
+            self._journal.write(encoded)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        except OSError as e:
+            self._discard_failed_write(e)
+            raise
+        self._journal_bytes += len(encoded)
+        storage_bytes_written_total.inc(len(encoded), file=os.path.basename(self.journal_path))
+
+    def _discard_failed_write(self, error):
+        """Cut a failed append (ENOSPC, EIO, ...) back off the journal so no partial line is
+        left for later entries to land behind; if that fails too, refuse any further write"""
+        try:
+            try:
+                # Closing drops whatever the failed write left buffered (or writes it, to be cut off below)
+                self._journal.close()
+            except OSError:
+                pass
+            os.truncate(self.journal_path, self._journal_bytes)
+            self._journal = open(self.journal_path, 'a')
+        except OSError as e:
+            self._write_error = f"{type(error).__name__}: {error}"
+            log.error(f"❌ {self.kind.capitalize()} journal is read-only after a failed write", stage="journal", kind=self.kind, error=str(error), truncate_error=str(e))
+        else:
+            log.error(f"❌ {self.kind.capitalize()} journal write failed and was rolled back", stage="journal", kind=self.kind, error=str(error), offset=self._journal_bytes)
+
+    def _start_journal(self):
+        # Runs on the storage thread
+        if self._journal:
+            self._journal.close()
+        self._journal = open(self.journal_path, 'w')
+        self._journal_bytes = 0
+        if self._checksum:
+            self._write_entries([{"op": "base", "snapshot": self._checksum}])
+
+    def _write_snapshot(self, records):
+        # Runs on the storage thread. The new snapshot names the one it replaces, which is
+        # what the current journal starts from, so a crash before the fresh journal is
+        # started is recognized at the next load
+        self._checksum, self._snapshot_bytes = write_snapshot_stream(self.snapshot_path, self._snapshot_chunks(records), self._checksum)
+        self._start_journal()
+        log.info(f"🗜️ Compacted {self.kind} journal", stage="compact", kind=self.kind, records=len(records))
+
+    def _on_compacted(self, future):
+        self._compacting = False
+        if future.exception():
+            log.error(f"❌ {self.kind.capitalize()} journal compaction failed", stage="compact", kind=self.kind, error=str(future.exception()))
+
+    async def _append(self, entries):
+        await run_in_storage_thread(self._write_entries, entries)
+
+        if not self._compacting and self._needs_compaction():
+            # Every in-memory change is submitted to the storage thread in the same step
+            # it is made, so changes in this copy are journaled before the compaction and
+            # later ones after it, in the fresh journal. Replaying a put or del that the
+            # snapshot already holds is harmless.
+            self._compacting = True
+            compaction = run_in_storage_thread(self._write_snapshot, dict(self._records))
+            compaction.add_done_callback(self._on_compacted)
+
+    def __contains__(self, key):
+        return key in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, key):
+        return self._records.get(key)
+
+    def items(self):
+        return self._records.items()
+
+    async def put(self, key, value):
+        await self.put_many([(key, value)])
+
+    async def put_many(self, items):
+        """Store several records with a single journal write"""
+        previous = self._previous(key for key, _ in items)
+        for key, value in items:
+            self._set(key, value)
+        try:
+            await self._append([{"op": "put", "id": key, "value": value} for key, value in items])
+        except Exception:
+            self._restore(previous, dict(items))
+            raise
+
+    async def delete_many(self, keys):
+        """Remove several records with a single journal write"""
+        previous = self._previous(keys)
+        for key in keys:
+            self._delete(key)
+        try:
+            await self._append([{"op": "del", "id": key} for key in keys])
+        except Exception:
+            self._restore(previous, {})
+            raise
+
+    def _previous(self, keys):
+        previous = {}
+        for key in keys:
+            previous.setdefault(key, self._records.get(key))
+        return previous
+
+    def _restore(self, previous, applied):
+        """Undo changes whose journal write failed, unless a later change replaced them already"""
+        for key, old in previous.items():
+            if self._records.get(key) is not applied.get(key):
+                continue
+            if old is None:
+                self._delete(key)
+            else:
+                self._set(key, old)
+
+    async def compact(self):
+        """Rewrite the snapshot now instead of waiting for the journal to fill up"""
+        await run_in_storage_thread(self._write_snapshot, dict(self._records))
+
+    async def update(self, key, **fields):
+        # Records are replaced rather than mutated in place so a snapshot never sees half an update
+        value = {**self._records[key], **fields}
+        await self.put(key, value)
+        return value
+
+class OrderStore(JournaledStore):
+    """Orders keyed by order ID; the snapshot is the orders.json mapping"""
+
+    kind = "orders"
+
+    def __init__(self, snapshot_path, journal_path, compact_ratio=0.5, compact_min_bytes=1024 * 1024):
+        super().__init__(snapshot_path, journal_path, compact_ratio, compact_min_bytes)
+        self.sales = SalesTotals()
+
+    def _set(self, key, value):
+        old = self._records.get(key)
+        if old:
+            self.sales.add(old, -1)
+        self.sales.add(value)
+        super()._set(key, value)
+
+    def _delete(self, key):
+        old = self._records.get(key)
+        if old:
+            self.sales.add(old, -1)
+        super()._delete(key)
+
+    def rebuild_sales(self):
+        self.sales = SalesTotals.of(self._records.values())
+
+class CodeStore(JournaledStore):
+    """Redeem codes indexed by code string, with unredeemed codes tracked in a separate set.
+
+    Available counts per plan are kept as codes change, and unredeemed codes are also
+    listed as (created_at, code) keys for cursor paging. Redeemed codes are left in that
+    list and skipped until enough pile up to rebuild it.
+    The snapshot keeps the redeem_codes.json layout ({"codes": [...]}).
+    """
+
+    kind = "codes"
+
+    def __init__(self, snapshot_path, journal_path, compact_ratio=0.5, compact_min_bytes=1024 * 1024):
+        super().__init__(snapshot_path, journal_path, compact_ratio, compact_min_bytes)
+        self._unredeemed = set()
+        self._available = collections.Counter()
+        self._by_created = []
+        self._by_created_sorted = True
+        self._by_created_stale = 0
+
+    def _decode_snapshot(self, data):
+        return {c["code"]: c for c in data["codes"]}
+
+    def _snapshot_chunks(self, records):
+        # {"codes": [...]}, one code per chunk
+        separator = b'{"codes": ['
+        for value in records.values():
+            yield separator + json.dumps(value).encode()
+            separator = b", "
+        yield b"]}" if separator == b", " else b'{"codes": []}'
+
+    def _forget(self, key):
+        if key in self._unredeemed:
+            self._unredeemed.discard(key)
+            self._available[self._records[key]["plan"]] -= 1
+            self._by_created_stale += 1
+
+    def _set(self, key, value):
+        self._forget(key)
+        super()._set(key, value)
+        if not value.get("redeemed", False):
+            self._unredeemed.add(key)
+            self._available[value["plan"]] += 1
+            entry = (value.get("created_at", ""), key)
+            if self._by_created and entry < self._by_created[-1]:
+                self._by_created_sorted = False
+            self._by_created.append(entry)
+
+    def _delete(self, key):
+        self._forget(key)
+        super()._delete(key)
+
+    async def claim(self, code, user_id):
+        """Validate and mark a code redeemed in one step; returns the code record or None"""
+        if code not in self._unredeemed:
+            return None
+
+        # The check and the in-memory update happen before the first await, so a
+        # concurrent claim for the same code sees it as redeemed already
+        code_data = {
+            **self._records[code],
+            "redeemed": True,
+            "redeemed_by": user_id,
+            "redeemed_at": datetime.now().isoformat()
+        }
+        await self.put(code, code_data)
+        return code_data
+
+    def available_counts(self):
+        return {plan: count for plan, count in self._available.items() if count > 0}
+
+    def unredeemed_page(self, after=None, limit=20):
+        """Up to `limit` unredeemed codes in creation order, starting after the (created_at, code) cursor"""
+        if self._by_created_stale > len(self._unredeemed):
+            self._by_created = [(self._records[c].get("created_at", ""), c) for c in self._unredeemed]
+            self._by_created_sorted = False
+            self._by_created_stale = 0
+        if not self._by_created_sorted:
+            self._by_created.sort()
+            self._by_created_sorted = True
+
+        page = []
+        previous = None
+        for i in range(bisect.bisect_right(self._by_created, tuple(after)) if after else 0, len(self._by_created)):
+            entry = self._by_created[i]
+            # A code redeemed and re-added can appear twice; stale entries are skipped
+            if entry == previous or entry[1] not in self._unredeemed:
+                continue
+            previous = entry
+            page.append(self._records[entry[1]])
+            if len(page) >= limit:
+                break
+        return page
+
+# ========== HISTORY ARCHIVE ==========
+def order_archivable(order, cutoff):
+    """Verified orders with nothing left to deliver, verified before `cutoff` (ISO timestamp)"""
+    return (order.get("status") == "verified" and order.get("notification") != "queued"
+            and (order.get("verified_at") or order.get("created_at", "")) < cutoff)
+
+def code_archivable(code, cutoff):
+    return code.get("redeemed", False) and (code.get("redeemed_at") or code.get("created_at", "")) < cutoff
+
+class HistoryArchive:
+    """Orders and codes moved out of the hot store, as gzip NDJSON segments per month.
+
+    Records are partitioned by the month they were created in; each line is
+    {"id": ..., "value": ...}. Adding records rewrites their month segment through a
+    temp file and a rename, so a crash leaves either the old or the new segment, and
+    re-archiving a record that is already there just replaces it.
+
+    Sales buckets of each orders segment are kept in sales.json, recomputed from
+    the whole segment whenever it is rewritten, so reports never scan the archive.
+    """
+
+    SEGMENT_NAME = re.compile(r'^(orders|codes)-(\d{4}-\d{2})\.ndjson\.gz$')
+    ORDER_ID_MONTH = re.compile(r'^[a-z]+_(\d{4})(\d{2})\d{8}_\d+$')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._sales = None
+
+    def _path(self, kind, month):
+        return os.path.join(self.directory, f"{kind}-{month}.ndjson.gz")
+
+    @staticmethod
+    def _month_of(record):
+        created_at = record.get("created_at", "")
+        return created_at[:7] if re.match(r'\d{4}-\d{2}', created_at) else "0000-00"
+
+    def months(self, kind):
+        """Months with a segment for `kind`, newest first"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        matches = (self.SEGMENT_NAME.match(name) for name in names)
+        return sorted((m.group(2) for m in matches if m and m.group(1) == kind), reverse=True)
+
+    def _read_segment(self, kind, month):
+        records = {}
+        try:
+            with gzip.open(self._path(kind, month), 'rt') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    records[entry["id"]] = entry["value"]
+        except FileNotFoundError:
+            pass
+        return records
+
+    def add(self, kind, items):
+        """Merge (id, record) pairs into their month segments; runs on the archive thread"""
+        os.makedirs(self.directory, exist_ok=True)
+        by_month = collections.defaultdict(list)
+        for key, value in items:
+            by_month[self._month_of(value)].append((key, value))
+
+        for month, month_items in by_month.items():
+            records = self._read_segment(kind, month)
+            records.update(month_items)
+            path = self._path(kind, month)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wb') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                    for key, value in records.items():
+                        f.write((json.dumps({"id": key, "value": value}) + "\n").encode())
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(tmp_path, path)
+            storage_bytes_written_total.inc(os.path.getsize(path), file="archive")
+            if kind == "orders":
+                self._load_sales()[f"{kind}-{month}"] = SalesTotals.of(records.values()).rows()
+        
+        if kind == "orders":
+            write_json_atomic(os.path.join(self.directory, "sales.json"), self._sales)
+
+    def _load_sales(self):
+        if self._sales is None:
+            try:
+                with open(os.path.join(self.directory, "sales.json"), 'r') as f:
+                    self._sales = json.load(f)
+            except FileNotFoundError:
+                self._sales = {}
+        return self._sales
+
+    def sales_rows(self):
+        """Sales buckets of every archived order; runs on the archive thread"""
+        return [tuple(row) for rows in self._load_sales().values() for row in rows]
+
+    def rebuild_sales(self):
+        """Recompute sales.json from the segments themselves"""
+        self._sales = {f"orders-{month}": SalesTotals.of(self._read_segment("orders", month).values()).rows() for month in self.months("orders")}
+        os.makedirs(self.directory, exist_ok=True)
+        write_json_atomic(os.path.join(self.directory, "sales.json"), self._sales)
+
+    def find(self, kind, key):
+        """Look up one archived record; returns (month, record) or None"""
+        months = self.months(kind)
+        # New-style order IDs carry their creation month, so that segment is tried first
+        hint = self.ORDER_ID_MONTH.match(key) if kind == "orders" else None
+        if hint and f"{hint.group(1)}-{hint.group(2)}" in months:
+            months.remove(f"{hint.group(1)}-{hint.group(2)}")
+            months.insert(0, f"{hint.group(1)}-{hint.group(2)}")
+
+        prefix = '{"id": ' + json.dumps(key) + ','
+        for month in months:
+            with gzip.open(self._path(kind, month), 'rt') as f:
+                for line in f:
+                    if line.startswith(prefix):
+                        return month, json.loads(line)["value"]
+        return None
+
+    def iter_records(self, kind):
+        """Every archived (id, record) of `kind`, oldest month first"""
+        for month in reversed(self.months(kind)):
+            yield from self._read_segment(kind, month).items()
+
+history_archive = HistoryArchive(ARCHIVE_DIR)
+
+# ========== STORAGE BACKENDS ==========
+# Both backends expose the same operations; pick one with STORAGE_BACKEND.
+class JsonStorage:
+    """Orders and codes in journaled in-memory stores"""
+
+    def __init__(self, orders_file, orders_journal_file, codes_file, codes_journal_file):
+        self.orders = OrderStore(orders_file, orders_journal_file, JOURNAL_COMPACT_RATIO, JOURNAL_COMPACT_MIN_BYTES)
+        self.codes = CodeStore(codes_file, codes_journal_file, JOURNAL_COMPACT_RATIO, JOURNAL_COMPACT_MIN_BYTES)
+
+    def load(self):
+        self.orders.load()
+        self.codes.load()
+
+    async def get_order(self, order_id):
+        return self.orders.get(order_id)
+
+    async def create_order(self, order_id, order):
+        await self.orders.put(order_id, order)
+
+    async def create_orders(self, orders):
+        """Store several (order_id, order) pairs with a single journal write"""
+        await self.orders.put_many(orders)
+
+    async def update_order(self, order_id, **fields):
+        if order_id not in self.orders:
+            return None
+        return await self.orders.update(order_id, **fields)
+
+    async def verify_order(self, order_id, verified_by, **fields):
+        return await self.update_order(
+            order_id,
+            status="verified",
+            verified_at=datetime.now().isoformat(),
+            verified_by=verified_by,
+            **fields
+        )
+
+    def iter_orders(self):
+        return iter(list(self.orders.items()))
+
+    async def get_code(self, code):
+        return self.codes.get(code)
+
+    async def redeem_code(self, code, user_id):
+        """Claim an unredeemed code; returns the code record or None"""
+        return await self.codes.claim(code, user_id)
+
+    async def add_codes(self, codes):
+        """Store new codes with one journal write; returns the codes skipped because they already exist"""
+        fresh, taken = [], []
+        for c in codes:
+            (taken if c["code"] in self.codes else fresh).append(c)
+        await self.codes.put_many([(c["code"], c) for c in fresh])
+        return taken
+
+    async def available_code_counts(self):
+        return self.codes.available_counts()
+
+    async def archivable_orders(self, cutoff):
+        orders = list(self.orders.items())
+        return await run_in_archive_thread(lambda: [(k, o) for k, o in orders if order_archivable(o, cutoff)])
+
+    async def archivable_codes(self, cutoff):
+        codes = [c for _, c in self.codes.items()]
+        return await run_in_archive_thread(lambda: [c for c in codes if code_archivable(c, cutoff)])
+
+    async def remove_orders(self, order_ids):
+        """Drop archived orders; the snapshot shrinks at the next size-based compaction"""
+        await self.orders.delete_many(order_ids)
+
+    async def remove_codes(self, codes):
+        await self.codes.delete_many(codes)
+
+    async def sales_rows(self):
+        """Sales buckets of the orders in the hot store"""
+        return self.orders.sales.rows()
+
+    async def rebuild_sales(self):
+        # Replay already recomputes the buckets from snapshot + journal at every start
+        self.orders.rebuild_sales()
+
+    async def unredeemed_codes_page(self, after=None, limit=20):
+        return self.codes.unredeemed_page(after, limit)
+
+class SqliteStorage:
+    """SQLite (WAL) backend with indexed orders and codes.
+
+    Each row keeps the full record as JSON in `data`, with the queried fields
+    copied into indexed columns. The connection is only used from the storage
+    thread, which also serializes every read-check-write.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            discord_id TEXT,
+            minecraft_username TEXT,
+            created_at TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+        CREATE INDEX IF NOT EXISTS idx_orders_discord_id ON orders(discord_id);
+        CREATE INDEX IF NOT EXISTS idx_orders_minecraft_username ON orders(minecraft_username);
+        CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at);
+
+        CREATE TABLE IF NOT EXISTS codes (
+            code TEXT PRIMARY KEY,
+            plan TEXT NOT NULL,
+            redeemed INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        DROP INDEX IF EXISTS idx_codes_unredeemed;
+        CREATE INDEX IF NOT EXISTS idx_codes_unredeemed_cursor ON codes(redeemed, created_at, code);
+
+        CREATE TABLE IF NOT EXISTS sales (
+            day TEXT NOT NULL,
+            plan TEXT NOT NULL,
+            status TEXT NOT NULL,
+            orders INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            PRIMARY KEY (day, plan, status)
+        );
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = None
+        self.available = collections.Counter()
+
+    def load(self):
+        with log_stage("📦 Opened SQLite storage", "load", path=self.db_path) as fields:
+            # Opening the connection replays SQLite's own WAL
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            if SQLITE_QUICK_CHECK:
+                problems = [row[0] for row in self.conn.execute("PRAGMA quick_check")]
+                if problems != ["ok"]:
+                    raise StorageCorruptError(f"{self.db_path}: {'; '.join(problems[:5])}")
+            has_sales = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sales'").fetchone()
+            self.conn.executescript(self.SCHEMA)
+            if not has_sales:
+                self._rebuild_sales()
+            self.available.update(dict(self.conn.execute("SELECT plan, COUNT(*) FROM codes WHERE redeemed = 0 GROUP BY plan")))
+            fields["orders"] = self.conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    @staticmethod
+    def _order_row(order_id, order):
+        return (
+            order_id,
+            order.get("status", "pending"),
+            order.get("discord_id"),
+            order.get("minecraft_username"),
+            order.get("created_at", ""),
+            json.dumps(order)
+        )
+
+    @staticmethod
+    def _code_row(code):
+        return (
+            code["code"],
+            code["plan"],
+            1 if code.get("redeemed", False) else 0,
+            code.get("created_at", ""),
+            json.dumps(code)
+        )
+
+    def _stored_orders(self, order_ids):
+        stored = []
+        for start in range(0, len(order_ids), 500):
+            chunk = order_ids[start:start + 500]
+            query = f"SELECT data FROM orders WHERE order_id IN ({','.join('?' * len(chunk))})"
+            stored.extend(json.loads(data) for data, in self.conn.execute(query, chunk))
+        return stored
+
+    def _count_sales(self, removed, added):
+        """Move orders between sales buckets; runs inside the caller's transaction"""
+        delta = SalesTotals()
+        for order in removed:
+            delta.add(order, -1)
+        for order in added:
+            delta.add(order)
+        rows = delta.rows()
+        self.conn.executemany(
+            "INSERT INTO sales VALUES (?, ?, ?, ?, ?) ON CONFLICT (day, plan, status) "
+            "DO UPDATE SET orders = orders + excluded.orders, amount = amount + excluded.amount",
+            rows
+        )
+        # Only buckets that lost orders can have emptied; drop them by primary key
+        self.conn.executemany(
+            "DELETE FROM sales WHERE day = ? AND plan = ? AND status = ? AND orders = 0",
+            [(day, plan, status) for day, plan, status, count, _ in rows if count < 0]
+        )
+
+    def _put_orders(self, orders):
+        """Upsert (order_id, order) pairs and their sales buckets in one transaction"""
+        with self.conn:
+            self._count_sales(self._stored_orders([order_id for order_id, _ in orders]), [order for _, order in orders])
+            self.conn.executemany("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?, ?)",
+                                  [self._order_row(order_id, order) for order_id, order in orders])
+
+    def _put_codes(self, rows):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO codes VALUES (?, ?, ?, ?, ?)", rows)
+
+    def _add_codes(self, codes):
+        taken = []
+        with self.conn:
+            for c in codes:
+                cursor = self.conn.execute("INSERT OR IGNORE INTO codes VALUES (?, ?, ?, ?, ?)", self._code_row(c))
+                if cursor.rowcount == 0:
+                    taken.append(c)
+                elif not c.get("redeemed", False):
+                    self.available[c["plan"]] += 1
+        return taken
+
+    def _get_order(self, order_id):
+        row = self.conn.execute("SELECT data FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _update_order(self, order_id, fields):
+        order = self._get_order(order_id)
+        if order is None:
+            return None
+        order.update(fields)
+        self._put_orders([(order_id, order)])
+        return order
+
+    def _get_code(self, code):
+        row = self.conn.execute("SELECT data FROM codes WHERE code = ?", (code,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _redeem_code(self, code, user_id):
+        code_data = self._get_code(code)
+        if not code_data or code_data.get("redeemed", False):
+            return None
+
+        code_data.update({
+            "redeemed": True,
+            "redeemed_by": user_id,
+            "redeemed_at": datetime.now().isoformat()
+        })
+        self._put_codes([self._code_row(code_data)])
+        self.available[code_data["plan"]] -= 1
+        return code_data
+
+    def _archivable_orders(self, cutoff):
+        # created_at <= verified_at, so the indexed columns narrow the scan first
+        rows = self.conn.execute("SELECT order_id, data FROM orders WHERE status = 'verified' AND created_at < ?", (cutoff,))
+        orders = ((order_id, json.loads(data)) for order_id, data in rows)
+        return [(order_id, order) for order_id, order in orders if order_archivable(order, cutoff)]
+
+    def _archivable_codes(self, cutoff):
+        rows = self.conn.execute("SELECT data FROM codes WHERE redeemed = 1 AND created_at < ?", (cutoff,))
+        return [c for c in (json.loads(data) for data, in rows) if code_archivable(c, cutoff)]
+
+    def _remove(self, table, column, keys):
+        with self.conn:
+            if table == "orders":
+                self._count_sales(self._stored_orders(list(keys)), [])
+            self.conn.executemany(f"DELETE FROM {table} WHERE {column} = ?", [(key,) for key in keys])
+
+    def _rebuild_sales(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM sales")
+            self._count_sales([], (json.loads(data) for data, in self.conn.execute("SELECT data FROM orders")))
+
+    def _unredeemed_codes_page(self, after, limit):
+        if after:
+            rows = self.conn.execute(
+                "SELECT data FROM codes WHERE redeemed = 0 AND (created_at, code) > (?, ?) ORDER BY created_at, code LIMIT ?",
+                (*after, limit)
+            ).fetchall()
+        else:
+            rows = self.conn.execute(
+                "SELECT data FROM codes WHERE redeemed = 0 ORDER BY created_at, code LIMIT ?", (limit,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    async def get_order(self, order_id):
+        return await run_in_storage_thread(self._get_order, order_id)
+
+    async def create_order(self, order_id, order):
+        await run_in_storage_thread(self._put_orders, [(order_id, order)])
+
+    async def create_orders(self, orders):
+        """Store several (order_id, order) pairs in one transaction"""
+        await run_in_storage_thread(self._put_orders, list(orders))
+
+    async def update_order(self, order_id, **fields):
+        return await run_in_storage_thread(self._update_order, order_id, fields)
+
+    async def verify_order(self, order_id, verified_by, **fields):
+        fields.update(status="verified", verified_at=datetime.now().isoformat(), verified_by=verified_by)
+        return await self.update_order(order_id, **fields)
+
+    def iter_orders(self):
+        for order_id, data in self.conn.execute("SELECT order_id, data FROM orders"):
+            yield order_id, json.loads(data)
+
+    async def get_code(self, code):
+        return await run_in_storage_thread(self._get_code, code)
+
+    async def redeem_code(self, code, user_id):
+        """Claim an unredeemed code; returns the code record or None"""
+        return await run_in_storage_thread(self._redeem_code, code, user_id)
+
+    async def add_codes(self, codes):
+        """Store new codes in one transaction; returns the codes skipped because they already exist"""
+        return await run_in_storage_thread(self._add_codes, codes)
+
+    async def available_code_counts(self):
+        return await run_in_storage_thread(lambda: {plan: count for plan, count in self.available.items() if count > 0})
+
+    async def unredeemed_codes_page(self, after=None, limit=20):
+        """One page of unredeemed codes ordered by (created_at, code), starting after the cursor"""
+        return await run_in_storage_thread(self._unredeemed_codes_page, after, limit)
+
+    async def archivable_orders(self, cutoff):
+        return await run_in_storage_thread(self._archivable_orders, cutoff)
+
+    async def archivable_codes(self, cutoff):
+        return await run_in_storage_thread(self._archivable_codes, cutoff)
 
-# Initialize data files
-if not os.path.exists(CODES_FILE):
-    with open(CODES_FILE, 'w') as f:
-        json.dump({"codes": []}, f)
+    async def remove_orders(self, order_ids):
+        await run_in_storage_thread(self._remove, "orders", "order_id", order_ids)
 
-if not os.path.exists(ORDERS_FILE):
-    with open(ORDERS_FILE, 'w') as f:
-        json.dump({}, f)
+    async def remove_codes(self, codes):
+        await run_in_storage_thread(self._remove, "codes", "code", codes)
+
+    async def sales_rows(self):
+        """Sales buckets of the orders in the hot store"""
+        return await run_in_storage_thread(lambda: self.conn.execute("SELECT day, plan, status, orders, amount FROM sales").fetchall())
+
+    async def rebuild_sales(self):
+        await run_in_storage_thread(self._rebuild_sales)
+
+def import_json_to_sqlite():
+    """One-shot migration of orders.json (+ journal) and redeem_codes.json into SQLite"""
+    source = JsonStorage(ORDERS_FILE, ORDERS_JOURNAL_FILE, CODES_FILE, CODES_JOURNAL_FILE)
+    source.load()
+
+    target = SqliteStorage(SQLITE_DB_FILE)
+    target.load()
+    target._put_orders(list(source.orders.items()))
+    target._put_codes([target._code_row(c) for _, c in source.codes.items()])
+
+    log.info("✅ Imported JSON storage into SQLite", path=SQLITE_DB_FILE, orders=len(source.orders), codes=len(source.codes))
+
+if STORAGE_BACKEND == "sqlite":
+    storage = SqliteStorage(SQLITE_DB_FILE)
+else:
+    storage = JsonStorage(ORDERS_FILE, ORDERS_JOURNAL_FILE, CODES_FILE, CODES_JOURNAL_FILE)
+
+# ========== ORDER IDS ==========
+class OrderIdAllocator:
+    """Allocates order IDs of the form `<prefix>_<YYYYmmddHHMMSS>_<seq>`.
+
+    The sequence is shared by all prefixes, restarts every second and borrows the
+    next second when it overflows, so IDs never collide and sort by creation time.
+    Feeding the stored IDs to `observe` at startup keeps them increasing across
+    restarts even if the clock goes backwards.
+    """
+
+    STAMP_FORMAT = '%Y%m%d%H%M%S'
+    SEQ_LIMIT = 10000
+
+    def __init__(self):
+        self._last = ("", -1)
+
+    def observe(self, order_id):
+        # Legacy IDs have no sequence part and count as sequence 0
+        parts = order_id.split("_")
+        if len(parts) < 2 or len(parts[1]) != 14 or not parts[1].isdigit():
+            return
+        seq = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 0
+        self._last = max(self._last, (parts[1], seq))
+
+    def allocate(self, prefix):
+        # No await in here, so concurrent coroutines always get distinct IDs
+        stamp = datetime.now().strftime(self.STAMP_FORMAT)
+        last_stamp, last_seq = self._last
+
+        if stamp > last_stamp:
+            seq = 0
+        elif last_seq + 1 < self.SEQ_LIMIT:
+            stamp, seq = last_stamp, last_seq + 1
+        else:
+            next_second = datetime.strptime(last_stamp, self.STAMP_FORMAT) + timedelta(seconds=1)
+            stamp, seq = next_second.strftime(self.STAMP_FORMAT), 0
+
+        self._last = (stamp, seq)
+        return f"{prefix}_{stamp}_{seq:04d}"
+
+order_ids = OrderIdAllocator()
+
+# ========== ORDER LOCKS ==========
+class KeyedLocks:
+    """One asyncio lock per key, created on first use and dropped when nobody holds or waits for it.
+
+    Read-check-write sequences on an order (verifying it, settling it with an
+    in-game payment) hold that order's lock across their awaits, so two of them
+    never act on the same pending state while unrelated orders go on in parallel.
+    """
+
+    def __init__(self):
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+order_locks = KeyedLocks()
+
+# ========== PLAN CATALOG ==========
+class PlanCatalog:
+    """Plans by name plus a sorted interval table for amount -> plan lookups.
+
+    Price ranges are inclusive and must not overlap, so every amount resolves
+    to at most one plan with a single bisect. A catalog that breaks this is
+    rejected when it is built.
+    """
+
+    def __init__(self, plans, mtime=None):
+        self.mtime = mtime
+        self._plans = {}
+        for plan in plans:
+            name, (low, high), days = plan["name"], plan["price"], plan["days"]
+            if name in self._plans:
+                raise ValueError(f"Plan {name} is defined twice")
+            if not (isinstance(low, int) and isinstance(high, int) and 0 < low <= high):
+                raise ValueError(f"Plan {name} has an invalid price range {low}-{high}")
+            if not (isinstance(days, str) or isinstance(days, int) and days > 0):
+                raise ValueError(f"Plan {name} has invalid days {days!r}")
+            self._plans[name] = {"price": (low, high), "days": days}
+        
+        self._intervals = sorted((info["price"][0], info["price"][1], name) for name, info in self._plans.items())
+        for (_, previous_high, previous), (low, _, name) in zip(self._intervals, self._intervals[1:]):
+            if low <= previous_high:
+                raise ValueError(f"Price ranges of {previous} and {name} overlap")
+        self._lows = [low for low, _, _ in self._intervals]
+
+    @classmethod
+    def load(cls, path):
+        mtime = os.path.getmtime(path)
+        with open(path, 'r') as f:
+            return cls(json.load(f)["plans"], mtime)
+
+    def __len__(self):
+        return len(self._plans)
+
+    def names(self):
+        return list(self._plans)
+
+    def get(self, name):
+        """{"price": (low, high), "days": ...} for a plan, or None"""
+        return self._plans.get(name)
+
+    def detect(self, amount):
+        """Name of the plan whose price range contains `amount`, or None"""
+        index = bisect.bisect_right(self._lows, amount) - 1
+        if index >= 0 and amount <= self._intervals[index][1]:
+            return self._intervals[index][2]
+        return None
+
+try:
+    plan_catalog = PlanCatalog.load(PLANS_FILE)
+except (OSError, ValueError, KeyError, TypeError) as e:
+    log.critical("❌ CRITICAL: plan catalog cannot be loaded", path=PLANS_FILE, error=f"{type(e).__name__}: {e}")
+    exit(1)
+
+async def watch_plan_catalog():
+    """Swap in the plan catalog whenever PLANS_FILE changes; a broken file keeps the current catalog"""
+    global plan_catalog
+    rejected_mtime = None
+    while True:
+        await asyncio.sleep(PLANS_RELOAD_SECONDS)
+        mtime = None
+        try:
+            mtime = await run_in_storage_thread(os.path.getmtime, PLANS_FILE)
+            if mtime in (plan_catalog.mtime, rejected_mtime):
+                continue
+            plan_catalog = await run_in_storage_thread(PlanCatalog.load, PLANS_FILE)
+            log.info("📋 Reloaded plan catalog", path=PLANS_FILE, plans=plan_catalog.names())
+        except Exception as e:
+            rejected_mtime = mtime
+            log.error("❌ Plan catalog rejected, keeping the current one", path=PLANS_FILE, error=f"{type(e).__name__}: {e}")
+
+async def plan_autocomplete(interaction: discord.Interaction, current: str):
+    """Offer the plans of the current catalog, so new tiers need no command sync"""
+    return [
+        discord.app_commands.Choice(name=name, value=name)
+        for name in plan_catalog.names() if current.lower() in name.lower()
+    ][:25]
+
+# ========== PENDING PAYMENT AMOUNTS ==========
+class PendingAmountIndex:
+    """Unique payment amounts reserved by pending purchase orders.
+
+    `purchase` reserves an amount nobody else is expected to pay, so an in-game
+    payment of exactly that amount settles the order with one dict lookup.
+    Reservations expire after `ttl` seconds; expired ones are dropped lazily from
+    a heap ordered by expiry time.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._by_amount = {}
+        self._by_order = {}
+        self._expiry = []
+
+    def __len__(self):
+        return len(self._by_amount)
+
+    def _expire(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, amount, order_id = heapq.heappop(self._expiry)
+            if self._by_order.get(order_id) == amount:
+                self.release(order_id)
+
+    def add(self, order_id, amount, expires_at):
+        self._by_amount[amount] = order_id
+        self._by_order[order_id] = amount
+        heapq.heappush(self._expiry, (expires_at, amount, order_id))
+
+    def reserve(self, order_id, low, high):
+        """Reserve a free amount in [low, high]; returns (amount, expires_at)"""
+        now = time.time()
+        self._expire(now)
+
+        for _ in range(20):
+            amount = random.randint(low, high)
+            if amount not in self._by_amount:
+                break
+        else:
+            # The range is crowded: probe linearly from a random start
+            start = random.randint(low, high)
+            candidates = itertools.chain(range(start, high + 1), range(low, start))
+            amount = next((a for a in candidates if a not in self._by_amount), None)
+            if amount is None:
+                raise RuntimeError(f"No free payment amount left between {low:,} and {high:,}")
+
+        expires_at = now + self.ttl
+        self.add(order_id, amount, expires_at)
+        return amount, expires_at
+
+    def settle(self, amount):
+        """Pop the order waiting for exactly this amount, if any"""
+        self._expire(time.time())
+        order_id = self._by_amount.get(amount)
+        if order_id:
+            self.release(order_id)
+        return order_id
+
+    def release(self, order_id):
+        amount = self._by_order.pop(order_id, None)
+        if amount is not None:
+            self._by_amount.pop(amount, None)
+
+pending_amounts = PendingAmountIndex(PURCHASE_RESERVATION_HOURS * 3600)
+
+# ========== DISCORD ACTION SCHEDULER ==========
+# Lower value runs first: role grants, then embeds/reactions/edits, then DMs, then
+# removing expired roles (a revocation a few seconds late costs nothing)
+PRIORITY_ROLE = 0
+PRIORITY_EMBED = 1
+PRIORITY_DM = 2
+PRIORITY_REVOKE = 3
+
+# Route family -> (requests, per seconds). Buckets are per route, keyed like Discord's
+# own buckets by their major parameter, e.g. "messages:<channel_id>", "roles:<guild_id>",
+# "dm:<user_id>". Families without an entry ("roles", "dm", "members", "users", "fetches")
+# are only held to the global limit: discord.py paces them with the limits it learns
+# from the X-RateLimit headers.
+ROUTE_LIMITS = {
+    "messages": (5, 5),
+    "edits": (5, 5),
+    "reactions": (4, 1),
+}
+GLOBAL_LIMIT = (40, 1)
+
+def route_family(route):
+    return route.split(":", 1)[0]
+
+class TokenBucket:
+    def __init__(self, capacity, per):
+        self.capacity = capacity
+        self.rate = capacity / per
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is available now)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class DiscordAction:
+    def __init__(self, route, priority, action, coalesce_key):
+        self.route = route
+        self.priority = priority
+        self.action = action
+        self.coalesce_key = coalesce_key
+        self.future = asyncio.get_running_loop().create_future()
+        self.attempts = 0
+
+class DiscordActionScheduler:
+    """Single outbound queue for Discord REST calls.
+
+    Actions are dispatched in priority order, each one waiting for a token from its
+    route bucket (if its family has one) and the global bucket. One route family may
+    use at most half of the in-flight slots, so calls that discord.py is holding back
+    for a learned rate limit do not stall the other families. Submitting an action
+    with the `coalesce_key` of one that has not started yet replaces it, so e.g.
+    several edits of the same message collapse into the last one. Callers await the
+    returned future.
+    """
+
+    def __init__(self, route_limits, global_limit, max_in_flight=8, max_429_retries=3):
+        self.route_limits = route_limits
+        self.max_429_retries = max_429_retries
+        self.max_family_in_flight = max(1, max_in_flight // 2)
+        self._heap = []
+        self._seq = itertools.count()
+        self._coalesced = {}
+        self._buckets = {}
+        self._global = TokenBucket(*global_limit)
+        self._wakeup = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._running = collections.Counter()
+
+    def submit(self, route, priority, action, coalesce_key=None):
+        """Queue `action` (a coroutine function) and return a future for its result"""
+        if coalesce_key and coalesce_key in self._coalesced:
+            item = self._coalesced[coalesce_key]
+            item.action = action
+            return item.future
+
+        item = DiscordAction(route, priority, action, coalesce_key)
+        if coalesce_key:
+            self._coalesced[coalesce_key] = item
+        self._push(item)
+        return item.future
+
+    def depth(self):
+        return len(self._heap)
+
+    def _push(self, item):
+        heapq.heappush(self._heap, (item.priority, next(self._seq), item))
+        self._wakeup.set()
+
+    def _bucket(self, route):
+        """The route's token bucket, or None when discord.py alone paces its family"""
+        if route not in self._buckets:
+            limit = self.route_limits.get(route_family(route))
+            self._buckets[route] = TokenBucket(*limit) if limit else None
+        return self._buckets[route]
+
+    def _next_ready(self):
+        """Pop the highest-priority action whose buckets have a token, or return how long to wait"""
+        now = time.monotonic()
+        global_delay = self._global.delay(now)
+        if global_delay:
+            return None, global_delay
+
+        skipped = []
+        ready = None
+        wait = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if self._running[route_family(entry[2].route)] >= self.max_family_in_flight:
+                # Woken again when one of the family's actions finishes
+                skipped.append(entry)
+                continue
+            bucket = self._bucket(entry[2].route)
+            delay = bucket.delay(now) if bucket else 0
+            if not delay:
+                if bucket:
+                    bucket.take()
+                self._global.take()
+                ready = entry[2]
+                break
+            skipped.append(entry)
+            wait = delay if wait is None else min(wait, delay)
+
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+
+        if ready and ready.coalesce_key:
+            self._coalesced.pop(ready.coalesce_key, None)
+        return ready, wait
+
+    async def run(self):
+        while True:
+            item, wait = self._next_ready() if self._heap else (None, None)
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._in_flight.acquire()
+            self._running[route_family(item.route)] += 1
+            asyncio.create_task(self._execute(item))
+
+    async def _execute(self, item):
+        family = route_family(item.route)
+        started = time.perf_counter()
+        try:
+            result = await item.action()
+        except discord.HTTPException as e:
+            if e.status == 429 and item.attempts < self.max_429_retries:
+                # discord.py already retried internally; back off before requeueing
+                item.attempts += 1
+                discord_rate_limited_total.inc(route=family)
+                asyncio.get_running_loop().call_later(2 ** item.attempts, self._push, item)
+            elif not item.future.done():
+                item.future.set_exception(e)
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            discord_api_seconds.observe(time.perf_counter() - started, route=family)
+            self._running[family] -= 1
+            self._in_flight.release()
+            self._wakeup.set()
+
+discord_actions = DiscordActionScheduler(ROUTE_LIMITS, GLOBAL_LIMIT)
+
+# ========== MEMBER RESOLUTION ==========
+class MemberResolver:
+    """Finds guild members by ID without needing every member in discord.py's cache.
+
+    Tries the gateway cache, then a bounded TTL cache, then `fetch_member` through
+    the action scheduler ("members:<guild_id>") at the priority of the call the lookup
+    is for. Concurrent lookups for the same ID share one request, and users who are
+    not in the guild are cached as None so they are not fetched again until the entry
+    expires.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._cache = collections.OrderedDict()  # user_id -> (expires_at, member or None)
+        self._inflight = {}
+
+    async def resolve(self, guild, user_id, fresh=False, priority=PRIORITY_ROLE):
+        """Return the member or None; `fresh` skips the TTL cache, e.g. when roles must be current"""
+        user_id = int(user_id)
+        member = guild.get_member(user_id)
+        if member:
+            return member
+
+        cached = self._cache.get(user_id)
+        if cached and not fresh and cached[0] > time.monotonic():
+            self._cache.move_to_end(user_id)
+            return cached[1]
+
+        future = self._inflight.get(user_id)
+        if future is None:
+            future = self._inflight[user_id] = asyncio.ensure_future(self._fetch(guild, user_id, priority))
+            future.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        # Shielded so one cancelled caller does not cancel the lookup for the others
+        return await asyncio.shield(future)
+
+    async def _fetch(self, guild, user_id, priority):
+        try:
+            member = await discord_actions.submit(f"members:{guild.id}", priority, lambda: guild.fetch_member(user_id))
+        except discord.NotFound:
+            member = None
+        self._cache[user_id] = (time.monotonic() + self.ttl, member)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return member
+
+members = MemberResolver(MEMBER_CACHE_SIZE, MEMBER_CACHE_TTL_SECONDS)
+
+# ========== SUBSCRIPTION EXPIRY ==========
+class SubscriptionExpiryScheduler:
+    """Removes the premium role when a timed subscription runs out.
+
+    Keeps each user's expiry time (and the order it came from) plus a min-heap of
+    (due_at, discord_id, expires_at) and sleeps until the earliest one is due.
+    Extending a subscription pushes a new heap entry; stale entries are skipped when
+    popped. Users who bought a permanent script plan are never expired. A completed
+    revocation is stored on the order as `role_revoked_at`, so a restart does not
+    revoke the same expiry again.
+    """
+
+    def __init__(self, batch_size=25, retry_seconds=60):
+        self.batch_size = batch_size
+        self.retry_seconds = retry_seconds
+        self._expires = {}
+        self._orders = {}
+        self._permanent = set()
+        self._heap = []
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._expires)
+
+    def observe(self, discord_id, expires_at, order_id=None):
+        """Restore a stored expiry (keeps the latest one per user)"""
+        if expires_at > self._expires.get(discord_id, 0):
+            self._expires[discord_id] = expires_at
+            self._orders[discord_id] = order_id
+            heapq.heappush(self._heap, (expires_at, discord_id, expires_at))
+            self._wakeup.set()
+
+    def observe_revocation(self, discord_id, revoked_at):
+        """Forget the user's expiry if the role was already removed after it ran out"""
+        if self._expires.get(discord_id, float("inf")) <= revoked_at:
+            del self._expires[discord_id]
+            self._orders.pop(discord_id, None)
+
+    def extend(self, discord_id, days, start=None, order_id=None):
+        """Stack `days` on top of the user's current subscription; returns the new expiry"""
+        start = start or time.time()
+        expires_at = max(start, self._expires.get(discord_id, 0)) + days * 86400
+        self.observe(discord_id, expires_at, order_id)
+        return expires_at
+
+    def make_permanent(self, discord_id):
+        self._permanent.add(discord_id)
+        self._expires.pop(discord_id, None)
+        self._orders.pop(discord_id, None)
+
+    def is_active(self, discord_id):
+        return discord_id in self._permanent or self._expires.get(discord_id, 0) > time.time()
+
+    def _pop_due(self, now):
+        """Pop up to `batch_size` due expiries as (discord_id, expires_at, order_id)"""
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            _, discord_id, expires_at = heapq.heappop(self._heap)
+            if self._expires.get(discord_id) == expires_at and discord_id not in self._permanent:
+                del self._expires[discord_id]
+                due.append((discord_id, expires_at, self._orders.pop(discord_id, None)))
+        return due
+
+    def _retry(self, entries):
+        """Put expiries that could not be revoked back, due again in `retry_seconds`"""
+        retry_at = time.time() + self.retry_seconds
+        for discord_id, expires_at, order_id in entries:
+            if expires_at > self._expires.get(discord_id, 0) and discord_id not in self._permanent:
+                self._expires[discord_id] = expires_at
+                self._orders[discord_id] = order_id
+                heapq.heappush(self._heap, (retry_at, discord_id, expires_at))
+
+    async def run(self):
+        await bot.wait_until_ready()
+        while True:
+            due = self._pop_due(time.time())
+            if due:
+                await self._revoke(due)
+                continue
+
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _revoke(self, due):
+        guild = bot.get_guild(GUILD_ID)
+        role = guild.get_role(PREMIUM_ROLE_ID) if guild else None
+        if not role:
+            log.error("❌ Cannot revoke expired subscriptions: role not found, retrying later", stage="expire", role_id=PREMIUM_ROLE_ID, expired=len(due))
+            self._retry(due)
+            return
+
+        resolved = await asyncio.gather(*(members.resolve(guild, d[0], fresh=True, priority=PRIORITY_REVOKE) for d in due), return_exceptions=True)
+        done, failed, removals = [], [], []
+        for entry, member in zip(due, resolved):
+            if isinstance(member, Exception):
+                failed.append((entry, member))
+            elif member is None or role not in member.roles:
+                done.append(entry)
+            else:
+                removals.append((entry, discord_actions.submit(f"roles:{guild.id}", PRIORITY_REVOKE, lambda member=member: member.remove_roles(role, reason="Subscription expired"))))
+
+        results = await asyncio.gather(*(future for _, future in removals), return_exceptions=True)
+        for (entry, _), result in zip(removals, results):
+            if isinstance(result, Exception):
+                failed.append((entry, result))
+            else:
+                done.append(entry)
+
+        for (discord_id, _, _), error in failed:
+            log.error("❌ Error removing expired role", stage="expire", discord_id=discord_id, error=str(error))
+        # Forbidden will not go away by retrying; anything else (5xx, timeouts) is tried again
+        self._retry([entry for entry, error in failed if not isinstance(error, discord.Forbidden)])
+        await self._mark_revoked(done)
+        log.info("⌛ Expired subscriptions", stage="expire", expired=len(due), roles_removed=len(removals) - len(failed), failed=len(failed))
+
+    async def _mark_revoked(self, entries):
+        revoked_at = datetime.now().isoformat()
+
+        async def mark(order_id):
+            async with order_locks.hold(order_id):
+                await storage.update_order(order_id, role_revoked_at=revoked_at)
+
+        results = await asyncio.gather(*(mark(order_id) for _, _, order_id in entries if order_id), return_exceptions=True)
+        for error in results:
+            if isinstance(error, Exception):
+                log.error("❌ Error recording role revocation", stage="expire", error=str(error))
+
+subscriptions = SubscriptionExpiryScheduler()
+
+def schedule_subscription(order_id, discord_id, days):
+    """Register a verified purchase with the expiry scheduler; returns fields to store on the order"""
+    if not discord_id or discord_id == "unknown":
+        return {}
+    if not isinstance(days, int):
+        subscriptions.make_permanent(discord_id)
+        return {}
+    expires_at = subscriptions.extend(discord_id, days, order_id=order_id)
+    return {"expires_at": datetime.fromtimestamp(expires_at).isoformat()}
 
 # ========== HELPER FUNCTIONS ==========
 def is_admin(user_id):
     return str(user_id) in ADMIN_IDS
 
-def load_orders():
-    try:
-        with open(ORDERS_FILE, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        return {}
+async def send_dm(user, text):
+    dm_channel = await user.create_dm()
+    await dm_channel.send(text)
 
-def save_orders(orders):
-    with open(ORDERS_FILE, 'w') as f:
-        json.dump(orders, f, indent=2)
+def queue_dm(user, text, stage, **fields):
+    """Send a DM in the background so the caller can reply right away; the outcome is logged"""
+    def done(future):
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled() or isinstance(error, discord.Forbidden):
+            log.warning("📭 DM not delivered", stage=stage, discord_id=str(user.id), dm_error="DMs disabled" if error else "cancelled", **fields)
+        elif error:
+            log.error("❌ Error sending DM", stage=stage, discord_id=str(user.id), dm_error=str(error), **fields)
+        else:
+            log.debug("📨 DM sent", stage=stage, discord_id=str(user.id), **fields)
 
-def load_codes():
-    try:
-        with open(CODES_FILE, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        return {"codes": []}
+    future = discord_actions.submit(f"dm:{user.id}", PRIORITY_DM, lambda: send_dm(user, text))
+    future.add_done_callback(done)
+    return future
 
-def save_codes(codes):
-    with open(CODES_FILE, 'w') as f:
-        json.dump(codes, f, indent=2)
+async def post_verification_embed(channel, embed):
+    """Post an embed to the verification channel and add the ✅ reaction"""
+    message = await discord_actions.submit(f"messages:{channel.id}", PRIORITY_EMBED, lambda: channel.send(embed=embed))
+    await discord_actions.submit(f"reactions:{channel.id}", PRIORITY_EMBED, lambda: message.add_reaction("✅"))
+    return message
+
+def build_verification_embed(discord_id, amount, plan, minecraft_username=None, order_id=None):
+    embed = discord.Embed(
+        title="🛒 Payment Verification Required",
+        color=0xFFA500,
+        description="**React with ✅ to verify this payment**",
+        timestamp=datetime.now(timezone.utc)
+    )
+    
+    embed.add_field(name="Discord User", value=f"<@{discord_id}>", inline=True)
+    if minecraft_username:
+        embed.add_field(name="Minecraft Username", value=f"```{minecraft_username}```", inline=True)
+    embed.add_field(name="Amount", value=f"```{amount:,}```", inline=True)
+    embed.add_field(name="Plan", value=f"```{plan}```", inline=True)
+    embed.add_field(name="Order ID", value=f"```{order_id}```", inline=False)
+    return embed
+
+def build_direct_payment_embed(minecraft_username, amount, plan, order_id):
+    embed = discord.Embed(
+        title="💰 Direct Payment Received",
+        color=0x00FF00,
+        description="**⚡ Payment detected in-game! React with ✅ to verify**",
+        timestamp=datetime.now(timezone.utc)
+    )
+    
+    embed.add_field(name="Minecraft Username", value=f"```{minecraft_username}```", inline=True)
+    embed.add_field(name="Amount", value=f"```{amount:,}```", inline=True)
+    embed.add_field(name="Detected Plan", value=f"```{plan}```", inline=True)
+    embed.add_field(name="Order ID", value=f"```{order_id}```", inline=False)
+    embed.add_field(name="Status", value="🟡 **Needs Verification**", inline=False)
+    embed.add_field(name="Action", value="Ask user for their Discord ID and use `/manual_verify` if needed", inline=False)
+    return embed
+
+def build_order_embed(order_id, order):
+    """Rebuild the verification embed of a stored order without fetching the message"""
+    if order.get("needs_verification"):
+        return build_direct_payment_embed(order.get("minecraft_username"), order["amount"], order["plan"], order_id)
+    return build_verification_embed(order["discord_id"], order["amount"], order["plan"], order.get("minecraft_username"), order_id)
 
 async def send_verification_message(discord_id, amount, plan, minecraft_username=None, order_id=None):
     """Send verification message to admin channel"""
     try:
         channel = bot.get_channel(VERIFICATION_CHANNEL_ID)
         if not channel:
-            print(f"Verification channel {VERIFICATION_CHANNEL_ID} not found")
+            log.error("❌ Verification channel not found", channel_id=VERIFICATION_CHANNEL_ID)
             return None
 
-        embed = discord.Embed(
-            title="🛒 Payment Verification Required",
-            color=0xFFA500,
-            description="**React with ✅ to verify this payment**",
-            timestamp=datetime.now(timezone.utc)
-        )
-        
-        embed.add_field(name="Discord User", value=f"<@{discord_id}>", inline=True)
-        if minecraft_username:
-            embed.add_field(name="Minecraft Username", value=f"```{minecraft_username}```", inline=True)
-        embed.add_field(name="Amount", value=f"```{amount:,}```", inline=True)
-        embed.add_field(name="Plan", value=f"```{plan}```", inline=True)
-        embed.add_field(name="Order ID", value=f"```{order_id}```", inline=False)
+        embed = build_verification_embed(discord_id, amount, plan, minecraft_username, order_id)
+        message = await post_verification_embed(channel, embed)
         
-        message = await channel.send(embed=embed)
-        await message.add_reaction("✅")
-        
-        print(f"✅ Verification message sent for order {order_id}")
+        log.info("✅ Verification message sent", stage="notify", order_id=order_id, discord_id=discord_id)
         return message
         
     except Exception as e:
-        print(f"Error sending verification message: {e}")
+        log.error("❌ Error sending verification message", stage="notify", order_id=order_id, error=str(e))
         return None
 
 async def send_direct_payment_message(minecraft_username, amount, plan, order_id):
@@ -107,243 +2067,968 @@ async def send_direct_payment_message(minecraft_username, amount, plan, order_id
     try:
         channel = bot.get_channel(VERIFICATION_CHANNEL_ID)
         if not channel:
-            print(f"Verification channel {VERIFICATION_CHANNEL_ID} not found")
+            log.error("❌ Verification channel not found", channel_id=VERIFICATION_CHANNEL_ID)
             return None
 
-        embed = discord.Embed(
-            title="💰 Direct Payment Received",
-            color=0x00FF00,
-            description="**⚡ Payment detected in-game! React with ✅ to verify**",
-            timestamp=datetime.now(timezone.utc)
-        )
-        
-        embed.add_field(name="Minecraft Username", value=f"```{minecraft_username}```", inline=True)
-        embed.add_field(name="Amount", value=f"```{amount:,}```", inline=True)
-        embed.add_field(name="Detected Plan", value=f"```{plan}```", inline=True)
-        embed.add_field(name="Order ID", value=f"```{order_id}```", inline=False)
-        embed.add_field(name="Status", value="🟡 **Needs Verification**", inline=False)
-        embed.add_field(name="Action", value="Ask user for their Discord ID and use `/manual_verify` if needed", inline=False)
+        embed = build_direct_payment_embed(minecraft_username, amount, plan, order_id)
+        message = await post_verification_embed(channel, embed)
         
-        message = await channel.send(embed=embed)
-        await message.add_reaction("✅")
-        
-        print(f"✅ Direct payment message sent for order {order_id}")
+        log.info("✅ Direct payment message sent", stage="notify", order_id=order_id, minecraft_username=minecraft_username)
         return message
         
     except Exception as e:
-        print(f"Error sending direct payment message: {e}")
+        log.error("❌ Error sending direct payment message", stage="notify", order_id=order_id, minecraft_username=minecraft_username, error=str(e))
         return None
 
+# message_id -> order_id for verification messages of orders that are not verified yet
+verification_messages = {}
+
+async def record_verification_message(order_id, message, **fields):
+    """Remember which order a verification message belongs to"""
+    verification_messages[message.id] = order_id
+    return await storage.update_order(order_id, message_id=message.id, **fields)
+
+embed_tasks = set()
+
+async def post_purchase_embed(order_id, discord_id, amount, plan):
+    """Post a purchase's verification embed and record it once it lands"""
+    message = await send_verification_message(discord_id, amount, plan, None, order_id)
+    if not message:
+        return
+
+    async with order_locks.hold(order_id):
+        order = await storage.get_order(order_id)
+        if not order:
+            return
+        if order.get("status") != "verified":
+            await record_verification_message(order_id, message)
+            return
+        # Paid (or verified by an admin) before the embed got through: delivery found no
+        # message to update, so the embed is turned green here instead
+        order = await storage.update_order(order_id, message_id=message.id)
+
+    verified_by = "🤖 In-game payment" if order.get("verified_by") == "auto" else f"<@{order.get('verified_by')}>"
+    await mark_message_verified(message, order_id, order, verified_by)
+
+def queue_purchase_embed(order_id, discord_id, amount, plan):
+    """Post the admin embed in the background so the purchaser's reply does not wait for it"""
+    task = asyncio.create_task(post_purchase_embed(order_id, discord_id, amount, plan))
+    embed_tasks.add(task)
+    task.add_done_callback(embed_tasks.discard)
+
 def detect_plan_from_amount(amount):
     """Detect which plan corresponds to the payment amount"""
-    plan_ranges = {
-        "1d": (19_000_000, 20_000_000),
-        "7d": (49_000_000, 50_000_000), 
-        "30d": (119_000_000, 120_000_000),
-        "90d": (199_000_000, 200_000_000),
-        "AntiAfk-Script": (99_000_000, 100_000_000),
-        "Items-Script": (199_000_000, 200_000_000)
+    catalog = plan_catalog
+    plan = catalog.detect(amount)
+    if plan is None:
+        return "Unknown", 1
+    return plan, catalog.get(plan)["days"]
+
+def build_direct_payment_order(minecraft_username, amount):
+    """Build the order record for a direct payment from Minecraft"""
+    plan, days = detect_plan_from_amount(amount)
+    return {
+        "discord_id": "unknown",  # Will be filled later
+        "amount": amount,
+        "days": days,
+        "plan": plan,
+        "status": "paid",
+        "is_code_redemption": False,
+        "created_at": datetime.now().isoformat(),
+        "paid_at": datetime.now().isoformat(),
+        "minecraft_username": minecraft_username,
+        "needs_verification": True,
+        "notification": "queued"
     }
+
+async def match_pending_order(minecraft_username, amount, held):
+    """Settle the pending purchase that reserved this exact amount; returns (order_id, order) or None
+
+    The order's lock is entered on `held` (an AsyncExitStack) and stays held
+    until the caller has stored the returned order.
+    """
+    order_id = pending_amounts.settle(amount)
+    if not order_id:
+        return None
     
-    plan = "Unknown"
-    days = 1
-    
-    for plan_name, (min_price, max_price) in plan_ranges.items():
-        if min_price <= amount <= max_price:
-            plan = plan_name
-            if plan_name == "1d":
-                days = 1
-            elif plan_name == "7d":
-                days = 7
-            elif plan_name == "30d":
-                days = 30
-            elif plan_name == "90d":
-                days = 90
-            elif plan_name == "AntiAfk-Script":
-                days = "antiafk"
-            elif plan_name == "Items-Script":
-                days = "items"
-            break
-    
-    return plan, days
-
-async def process_direct_payment(minecraft_username, amount):
-    """Process direct payment from Minecraft"""
-    try:
-        print(f"💰 Processing direct payment: {amount} from {minecraft_username}")
-        
-        # Detect plan from amount
-        plan, days = detect_plan_from_amount(amount)
-        
-        # Create the order
-        orders = load_orders()
-        order_id = f"direct_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        
-        orders[order_id] = {
-            "discord_id": "unknown",  # Will be filled later
-            "amount": amount,
-            "days": days,
-            "plan": plan,
-            "status": "paid",
-            "is_code_redemption": False,
-            "created_at": datetime.now().isoformat(),
-            "paid_at": datetime.now().isoformat(),
-            "minecraft_username": minecraft_username,
-            "needs_verification": True
-        }
-        
-        save_orders(orders)
-        
-        print(f"💰 Direct payment recorded - Order: {order_id}, Player: {minecraft_username}, Amount: {amount}, Plan: {plan}")
-        
-        # Send verification message to Discord
-        await send_direct_payment_message(minecraft_username, amount, plan, order_id)
+    await held.enter_async_context(order_locks.hold(order_id))
+    order = await storage.get_order(order_id)
+    if not order or order.get("status") != "pending":
+        return None
+    
+    verification_messages.pop(order.get("message_id"), None)
+    now = datetime.now().isoformat()
+    return order_id, {
+        **order,
+        "status": "verified",
+        "minecraft_username": minecraft_username,
+        "paid_at": now,
+        "verified_at": now,
+        "verified_by": "auto",
+        "notification": "queued",
+        **schedule_subscription(order_id, order["discord_id"], order["days"])
+    }
+
+def payment_result(order_id, order):
+    """The /payment response for a stored payment; also replayed to retried requests"""
+    if order.get("verified_by") == "auto":
+        message = "Payment matched a pending order and was verified"
+    else:
+        message = "Payment recorded, awaiting admin verification"
+    # "success" is what the Minecraft side has always checked for; 202 tells it the rest is queued
+    return {"status": "success", "order_id": order_id, "plan": order["plan"], "message": message}
+
+async def process_direct_payment(minecraft_username, amount, idempotency_key=None):
+    """Record a direct payment from Minecraft and queue its Discord notification"""
+    with log_stage("💰 Direct payment recorded", "payment.record", minecraft_username=minecraft_username, amount=amount) as fields:
+        try:
+            async with contextlib.AsyncExitStack() as held:
+                matched = await match_pending_order(minecraft_username, amount, held)
+                if matched:
+                    order_id, order = matched
+                else:
+                    order_id = order_ids.allocate("direct")
+                    order = build_direct_payment_order(minecraft_username, amount)
+                fields.update(order_id=order_id, plan=order["plan"], matched=bool(matched))
+                
+                if idempotency_key:
+                    order["idempotency_key"] = idempotency_key
+                
+                # create_order upserts, which also covers the matched purchase order
+                await storage.create_order(order_id, order)
+            
+            # The order is durable now; Discord is notified by a queue worker
+            payment_queue.submit(order_id)
+            
+            return payment_result(order_id, order)
+            
+        except Exception as e:
+            fields["error"] = str(e)
+            return {"status": "error", "message": str(e)}
+
+async def process_direct_payments(payments):
+    """Record a batch of (minecraft_username, amount, idempotency_key) payments in one storage write"""
+    created = []
+    with log_stage("💰 Direct payment batch recorded", "payment.batch", orders=len(payments), matched=0) as fields:
+        # Matched orders stay locked until the batch is written. A reservation is settled
+        # only once, so two batches never wait for each other's locks
+        async with contextlib.AsyncExitStack() as held:
+            for minecraft_username, amount, idempotency_key in payments:
+                matched = await match_pending_order(minecraft_username, amount, held)
+                order_id, order = matched or (order_ids.allocate("direct"), build_direct_payment_order(minecraft_username, amount))
+                if idempotency_key:
+                    order["idempotency_key"] = idempotency_key
+                created.append((order_id, order))
+                fields["matched"] += bool(matched)
+                log.debug("💰 Direct payment in batch", stage="payment.record", order_id=order_id, minecraft_username=minecraft_username, amount=amount, plan=order["plan"], matched=bool(matched))
+            
+            # create_orders upserts, so matched purchase orders are updated in the same write
+            await storage.create_orders(created)
         
+        for order_id, _ in created:
+            payment_queue.submit(order_id)
+    
+    return created
+
+# ========== REDEEM CODE GENERATION ==========
+CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+CODE_LENGTH = 10
+# 256 is a multiple of the 32-letter alphabet, so mapping random bytes through this table stays uniform
+CODE_BYTE_TABLE = bytes(ord(CODE_ALPHABET[b % len(CODE_ALPHABET)]) for b in range(256))
+
+def random_code_strings(count):
+    """`count` distinct codes drawn from the OS CSPRNG"""
+    codes = set()
+    while len(codes) < count:
+        missing = count - len(codes)
+        raw = secrets.token_bytes(missing * CODE_LENGTH).translate(CODE_BYTE_TABLE).decode()
+        codes.update(raw[i:i + CODE_LENGTH] for i in range(0, len(raw), CODE_LENGTH))
+    return codes
+
+async def create_codes(plan, days, count, created_by):
+    """Generate and store `count` new codes; a code already in the index is replaced by a fresh one"""
+    created_at = datetime.now(timezone.utc).isoformat()
+    created = []
+    while len(created) < count:
+        batch = [
+            {"code": code, "plan": plan, "days": days, "created_at": created_at, "created_by": created_by, "redeemed": False}
+            for code in random_code_strings(count - len(created))
+        ]
+        taken = await storage.add_codes(batch)
+        if taken:
+            log.warning("⚠️ Generated codes already existed, generating replacements", plan=plan, taken=len(taken))
+            taken = {c["code"] for c in taken}
+            batch = [c for c in batch if c["code"] not in taken]
+        created.extend(batch)
+    return created
+
+def export_codes_file(codes, file_format, filename):
+    """Render codes as a CSV (code, plan, days, created_at) or one-code-per-line TXT attachment"""
+    buffer = io.StringIO()
+    if file_format == "csv":
+        writer = csv.writer(buffer)
+        writer.writerow(["code", "plan", "days", "created_at"])
+        writer.writerows((c["code"], c["plan"], c["days"], c["created_at"]) for c in codes)
+    else:
+        buffer.writelines(f"{c['code']}\n" for c in codes)
+    return discord.File(io.BytesIO(buffer.getvalue().encode()), filename=f"{filename}.{file_format}")
+
+# ========== PAYMENT IDEMPOTENCY ==========
+class IdempotencyCache:
+    """Bounded LRU/TTL cache of /payment results keyed by idempotency key.
+
+    Retries of a payment that is still being processed wait for the first
+    attempt instead of recording it again. The keys are also stored on the
+    orders, so recent entries are restored at startup.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._in_flight = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if stored_at + self.ttl < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def put(self, key, result, stored_at=None):
+        self._entries[key] = (stored_at or time.time(), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def in_flight(self, key):
+        """Future for the result of a payment with this key that is being processed, or None"""
+        return self._in_flight.get(key)
+
+    def begin(self, key):
+        """Mark `key` as being processed; other requests with it wait for `finish`"""
+        self._in_flight[key] = asyncio.get_running_loop().create_future()
+
+    def finish(self, key, result):
+        if result["status"] == "success":
+            self.put(key, result)
+        self._in_flight.pop(key).set_result(result)
+
+    async def run_once(self, key, process):
+        """Run `process()` once per key; returns (result, is_duplicate)"""
+        cached = self.get(key)
+        if cached is not None:
+            return cached, True
+        if key in self._in_flight:
+            return await asyncio.shield(self._in_flight[key]), True
+
+        self.begin(key)
+        result = {"status": "error", "message": "Payment processing failed"}
+        try:
+            result = await process()
+            return result, False
+        finally:
+            self.finish(key, result)
+
+payment_results = IdempotencyCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL_HOURS * 3600)
+
+def payment_idempotency_key(data, header_key=None):
+    """Idempotency key from the header, the body, or username + amount + in-game timestamp"""
+    key = header_key or data.get('idempotency_key')
+    if key:
+        return str(key)
+    if data.get('timestamp') is not None:
+        return f"{data['minecraft_username']}:{data['amount']}:{data['timestamp']}"
+    return None
+
+# ========== PAYMENT NOTIFICATION QUEUE ==========
+class PaymentNotificationQueue:
+    """Worker pool that posts verification messages for accepted payments.
+
+    The durable side of the queue is the order itself: it is stored with
+    `notification: "queued"` before the HTTP response goes out, and queued
+    orders are resubmitted at startup. Failed sends are retried with
+    exponential backoff.
+    """
+
+    def __init__(self, workers=4, max_attempts=8, base_delay=2, max_delay=300):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._queue = asyncio.Queue()
+        self._accepted_at = {}
+        self._tasks = []
+
+    def submit(self, order_id, accepted_at=None, attempt=0):
+        self._accepted_at.setdefault(order_id, accepted_at or time.time())
+        self._queue.put_nowait((order_id, attempt))
+
+    def start(self):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    def stats(self):
+        """Number of payments waiting for a notification and the age of the oldest one"""
+        oldest = min(self._accepted_at.values(), default=None)
         return {
-            "status": "success", 
-            "order_id": order_id,
-            "plan": plan,
-            "message": "Payment recorded, awaiting admin verification"
+            "depth": len(self._accepted_at),
+            "oldest_age_seconds": round(time.time() - oldest, 1) if oldest else 0
         }
+
+    async def _worker(self):
+        await bot.wait_until_ready()
+        while True:
+            order_id, attempt = await self._queue.get()
+            try:
+                await self._deliver(order_id, attempt)
+            except Exception as e:
+                log.exception("❌ Payment notification worker error", stage="notify", order_id=order_id)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, order_id, attempt):
+        order = await storage.get_order(order_id)
+        if not order or order.get("notification") != "queued":
+            self._accepted_at.pop(order_id, None)
+            return
+
+        if order.get("status") == "verified":
+            # Automatically matched purchase: grant the role instead of asking an admin
+            delivered = await deliver_matched_payment(order_id, order)
+            if delivered:
+                await storage.update_order(order_id, notification="sent")
+        else:
+            message = await send_direct_payment_message(order["minecraft_username"], order["amount"], order["plan"], order_id)
+            delivered = message is not None
+            if delivered:
+                await record_verification_message(order_id, message, notification="sent")
         
-    except Exception as e:
-        print(f"❌ Direct payment processing failed: {str(e)}")
-        return {"status": "error", "message": str(e)}
+        if delivered:
+            self._accepted_at.pop(order_id, None)
+            return
+
+        attempt += 1
+        if attempt >= self.max_attempts:
+            log.error("❌ Giving up on verification message", stage="notify", order_id=order_id, attempts=attempt)
+            await storage.update_order(order_id, notification="failed")
+            self._accepted_at.pop(order_id, None)
+            return
+
+        delay = min(self.base_delay * 2 ** attempt, self.max_delay) * random.uniform(0.5, 1.0)
+        log.warning("🔁 Retrying verification message", stage="notify", order_id=order_id, delay_seconds=round(delay), attempt=attempt + 1, max_attempts=self.max_attempts)
+        asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, (order_id, attempt))
+
+payment_queue = PaymentNotificationQueue(workers=PAYMENT_WORKERS)
+
+metrics.gauge("payment_queue_depth", "Accepted payments waiting for their Discord notification", lambda: payment_queue.stats()["depth"])
+metrics.gauge("payment_queue_oldest_age_seconds", "Age of the oldest payment waiting for its Discord notification", lambda: payment_queue.stats()["oldest_age_seconds"])
+metrics.gauge("discord_action_queue_depth", "Discord REST actions waiting for a rate limit token", lambda: discord_actions.depth())
+metrics.gauge("storage_queue_depth", "Storage operations waiting for the storage thread", lambda: storage_executor._work_queue.qsize())
+metrics.gauge("archive_queue_depth", "Archive operations waiting for the archive thread", lambda: archive_executor._work_queue.qsize())
+metrics.gauge("subscriptions_tracked", "Timed subscriptions waiting to expire", lambda: len(subscriptions))
+metrics.gauge("log_records_dropped", "Log records dropped because the log queue was full", lambda: log_handler.dropped)
+metrics.gauge("log_records_sampled_out", "Log records skipped by per-level sampling", lambda: log_handler.sampled_out)
+metrics.gauge("startup_recovery_seconds", "Time spent loading and verifying stored state at startup", lambda: recovery_seconds)
+metrics.gauge("order_locks_active", "Orders with a verification or payment match in progress", lambda: len(order_locks))
+metrics.gauge("pending_amount_reservations", "Purchase amounts reserved for automatic matching", lambda: len(pending_amounts))
+metrics.gauge("idempotency_cache_entries", "Payment results cached for retries", lambda: len(payment_results))
+
+# ========== STARTUP STATE ==========
+recovery_seconds = 0.0
+
+def rebuild_runtime_state(orders):
+    """Rebuild in-memory state that is derived from stored orders"""
+    requeued = 0
+    legacy_subscriptions = []
+    revocations = {}
+    recent_payments = []
+    for order_id, order in orders:
+        order_ids.observe(order_id)
+        
+        if order.get("idempotency_key"):
+            stored_at = datetime.fromisoformat(order.get("paid_at") or order["created_at"]).timestamp()
+            if stored_at + payment_results.ttl > time.time():
+                recent_payments.append((stored_at, order["idempotency_key"], payment_result(order_id, order)))
+        
+        if order.get("status") == "verified" and order.get("discord_id", "unknown") != "unknown":
+            if not isinstance(order.get("days"), int):
+                subscriptions.make_permanent(order["discord_id"])
+            elif order.get("expires_at"):
+                subscriptions.observe(order["discord_id"], datetime.fromisoformat(order["expires_at"]).timestamp(), order_id)
+            else:
+                # Verified before expiries were recorded: replay the stacking in verification order
+                verified_at = datetime.fromisoformat(order.get("verified_at") or order["created_at"]).timestamp()
+                legacy_subscriptions.append((verified_at, order["discord_id"], order["days"], order_id))
+            if order.get("role_revoked_at"):
+                revoked_at = datetime.fromisoformat(order["role_revoked_at"]).timestamp()
+                revocations[order["discord_id"]] = max(revoked_at, revocations.get(order["discord_id"], 0))
+        
+        if order.get("message_id") and order.get("status") != "verified":
+            verification_messages[order["message_id"]] = order_id
+        
+        if order.get("status") == "pending" and order.get("reserved_until"):
+            expires_at = datetime.fromisoformat(order["reserved_until"]).timestamp()
+            if expires_at > time.time():
+                pending_amounts.add(order_id, order["amount"], expires_at)
+        
+        if order.get("notification") == "queued":
+            accepted_at = datetime.fromisoformat(order["created_at"]).timestamp()
+            payment_queue.submit(order_id, accepted_at)
+            requeued += 1
+
+    for verified_at, discord_id, days, order_id in sorted(legacy_subscriptions):
+        subscriptions.extend(discord_id, days, start=verified_at, order_id=order_id)
+    
+    # Expiries whose role was already removed are not revoked (and fetched) again
+    for discord_id, revoked_at in revocations.items():
+        subscriptions.observe_revocation(discord_id, revoked_at)
+    
+    for stored_at, key, result in sorted(recent_payments, key=lambda p: p[0]):
+        payment_results.put(key, result, stored_at)
+
+    if requeued:
+        log.info("📬 Requeued payment notifications", requeued=requeued)
+    log.info("⌛ Tracking timed subscriptions", subscriptions=len(subscriptions))
+
+# ========== ARCHIVAL ==========
+async def archive_history(days):
+    """Move verified orders and redeemed codes older than `days` into the archive; returns (orders, codes) moved"""
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    # Orders of users with a running subscription stay hot, since startup rebuilds expiries from them
+    orders = [(order_id, order) for order_id, order in await storage.archivable_orders(cutoff)
+              if not subscriptions.is_active(order.get("discord_id"))]
+    codes = await storage.archivable_codes(cutoff)
+    
+    # Segments are written and synced before anything leaves the hot store
+    if orders:
+        await run_in_archive_thread(history_archive.add, "orders", orders)
+        await storage.remove_orders([order_id for order_id, _ in orders])
+    if codes:
+        await run_in_archive_thread(history_archive.add, "codes", [(c["code"], c) for c in codes])
+        await storage.remove_codes([c["code"] for c in codes])
+    
+    log.info("🗄️ Archived history", stage="archive", orders=len(orders), codes=len(codes), days=days)
+    return len(orders), len(codes)
+
+async def lookup_record(kind, key):
+    """Find an order or code in the hot store, then in the archive; returns (where, record) or None"""
+    record = await (storage.get_order(key) if kind == "orders" else storage.get_code(key))
+    if record:
+        return "active", record
+    found = await run_in_archive_thread(history_archive.find, kind, key)
+    if found:
+        return f"archive {found[0]}", found[1]
+    return None
+
+async def sales_rows():
+    """Sales buckets of hot and archived orders together"""
+    # An order archived right before a crash is in both until the next archival removes it
+    hot, archived = await asyncio.gather(storage.sales_rows(), run_in_archive_thread(history_archive.sales_rows))
+    return [*hot, *archived]
+
+async def rebuild_sales():
+    """Recompute the sales buckets from the stored orders and the archive segments"""
+    await asyncio.gather(storage.rebuild_sales(), run_in_archive_thread(history_archive.rebuild_sales))
+
+def format_sales_report(rows, days):
+    """Totals by plan and status plus verified revenue per day, for the last `days` days (0 for all time)"""
+    since = (datetime.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d') if days > 0 else None
+    by_plan = collections.defaultdict(lambda: collections.defaultdict(lambda: [0, 0]))
+    by_day = collections.defaultdict(lambda: [0, 0])
+    for day, plan, status, count, amount in rows:
+        if since and not (day[:1].isdigit() and day >= since):
+            continue
+        by_plan[plan][status][0] += count
+        by_plan[plan][status][1] += amount
+        by_day[day][0] += count
+        if status == "verified":
+            by_day[day][1] += amount
+    
+    revenue = sum(statuses["verified"][1] for statuses in by_plan.values() if "verified" in statuses)
+    verified = sum(statuses["verified"][0] for statuses in by_plan.values() if "verified" in statuses)
+    lines = [
+        f"📈 **Sales report — {f'last {days} days' if since else 'all time'}**",
+        f"Revenue: `{revenue:,}` from {verified} verified orders\n",
+        "**By plan:**"
+    ]
+    for plan, statuses in sorted(by_plan.items()):
+        parts = [f"{count} {status}" + (f" (`{amount:,}`)" if status == "verified" else "")
+                 for status, (count, amount) in sorted(statuses.items())]
+        lines.append(f"• {plan}: " + " · ".join(parts))
+    if not by_plan:
+        lines.append("ℹ️ No orders")
+    
+    lines.append("\n**By day** (orders, verified revenue):")
+    for day in sorted(by_day, reverse=True)[:14]:
+        count, amount = by_day[day]
+        lines.append(f"• {day}: {count} orders, `{amount:,}`")
+    return "\n".join(lines)
+
+async def archive_history_periodically():
+    await bot.wait_until_ready()
+    while True:
+        try:
+            await archive_history(ARCHIVE_AFTER_DAYS)
+        except Exception as e:
+            log.exception("❌ Scheduled archival failed", stage="archive")
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
 
 # ========== HTTP SERVER FOR MINECRAFT PAYMENTS ==========
+def parse_payment(data):
+    """Validate one payment record; returns (minecraft_username, amount) or raises ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError("Payment must be a JSON object")
+    
+    minecraft_username = data.get('minecraft_username')
+    amount = data.get('amount')
+    
+    if not minecraft_username or not amount:
+        raise ValueError("Missing minecraft_username or amount")
+    
+    try:
+        amount = int(amount)
+    except (TypeError, ValueError):
+        raise ValueError("Amount must be an integer")
+    
+    return str(minecraft_username), amount
+
+def batch_response(results, accepted):
+    """Reply to a payment batch: "success" when every payment was taken (replayed duplicates
+    included), "partial" when some were rejected, and a 400 when none was or the batch was empty"""
+    failed = sum(1 for result in results if result["status"] == "error")
+    if failed == len(results):
+        message = "Empty payment batch" if not results else "No payment in the batch was accepted"
+        return web.json_response({"status": "error", "message": message, "accepted": 0, "failed": failed, "results": results}, status=400)
+    status = "partial" if failed else "success"
+    return web.json_response({"status": status, "accepted": accepted, "failed": failed, "results": results}, status=202)
+
 async def handle_payment(request):
     """Handle payment requests from Minecraft"""
     try:
         data = await request.json()
-        minecraft_username = data.get('minecraft_username')
-        amount = data.get('amount')
         
-        if not minecraft_username or not amount:
-            return web.json_response({"status": "error", "message": "Missing minecraft_username or amount"}, status=400)
+        try:
+            minecraft_username, amount = parse_payment(data)
+        except ValueError as e:
+            return web.json_response({"status": "error", "message": str(e)}, status=400)
+        
+        log.debug("📥 Received payment from Minecraft", stage="payment.received", minecraft_username=minecraft_username, amount=amount)
+        
+        # Record the payment; Discord is notified in the background
+        key = payment_idempotency_key(data, request.headers.get('Idempotency-Key'))
+        if key:
+            result, duplicate = await payment_results.run_once(key, lambda: process_direct_payment(minecraft_username, amount, key))
+            if duplicate:
+                log.info("♻️ Duplicate payment answered from cache", stage="payment.duplicate", idempotency_key=key, order_id=result.get("order_id"), minecraft_username=minecraft_username)
+                result = {**result, "duplicate": True}
+        else:
+            result = await process_direct_payment(minecraft_username, amount)
         
-        print(f"📥 Received payment from Minecraft: {amount} from {minecraft_username}")
+        return web.json_response(result, status=202 if result["status"] == "success" else 500)
         
-        # Process the payment
-        result = await process_direct_payment(minecraft_username, amount)
+    except Exception as e:
+        log.exception("❌ Payment handling error", stage="payment.request")
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+
+async def handle_payment_batch(request):
+    """Handle a burst of payments sent as a JSON array or NDJSON"""
+    try:
+        body = (await request.text()).strip()
         
-        return web.json_response(result)
+        try:
+            if body.startswith('['):
+                records = json.loads(body)
+            else:
+                records = [json.loads(line) for line in body.splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            return web.json_response({"status": "error", "message": f"Invalid JSON: {e}"}, status=400)
+        
+        if len(records) > PAYMENT_BATCH_MAX:
+            return web.json_response({"status": "error", "message": f"Batch larger than {PAYMENT_BATCH_MAX} payments"}, status=413)
+        
+        results = [None] * len(records)
+        valid = []
+        first_index = {}
+        repeats = []
+        waiting = []
+        for index, record in enumerate(records):
+            try:
+                minecraft_username, amount = parse_payment(record)
+            except ValueError as e:
+                results[index] = {"index": index, "status": "error", "message": str(e)}
+                continue
+            
+            key = payment_idempotency_key(record)
+            cached = payment_results.get(key) if key else None
+            if cached:
+                results[index] = {"index": index, **cached, "duplicate": True}
+            elif key in first_index:
+                repeats.append((index, first_index[key]))
+            elif key and payment_results.in_flight(key):
+                # A concurrent /payment or batch is recording this payment right now
+                waiting.append((index, payment_results.in_flight(key)))
+            else:
+                if key:
+                    first_index[key] = index
+                    payment_results.begin(key)
+                valid.append((index, (minecraft_username, amount, key)))
+        
+        log.debug("📥 Received payment batch from Minecraft", stage="payment.received", received=len(records), new=len(valid))
+        
+        if valid:
+            unfinished = set(first_index)
+            try:
+                created = await process_direct_payments([payment for _, payment in valid])
+                for (index, (_, _, key)), (order_id, order) in zip(valid, created):
+                    result = payment_result(order_id, order)
+                    if key:
+                        payment_results.finish(key, result)
+                        unfinished.discard(key)
+                    results[index] = {"index": index, **result}
+            finally:
+                # Requests waiting on a key this batch failed to record get the error, not a hang
+                for key in unfinished:
+                    payment_results.finish(key, {"status": "error", "message": "Payment processing failed"})
+        
+        for index, original in repeats:
+            results[index] = {**results[original], "index": index, "duplicate": True}
+        
+        for index, future in waiting:
+            results[index] = {"index": index, **await asyncio.shield(future), "duplicate": True}
+        
+        return batch_response(results, len(valid))
         
     except Exception as e:
-        print(f"❌ Payment handling error: {e}")
+        log.exception("❌ Payment batch handling error", stage="payment.request")
         return web.json_response({"status": "error", "message": str(e)}, status=500)
 
+@web.middleware
+async def metrics_middleware(request, handler):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource else "unmatched"
+        http_requests_total.inc(route=route, method=request.method, status=str(status))
+        http_request_seconds.observe(time.perf_counter() - started, route=route)
+
+async def handle_metrics(request):
+    """Prometheus metrics endpoint"""
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
 async def handle_health(request):
     """Health check endpoint"""
-    return web.json_response({"status": "healthy", "service": "Payment API"})
+    return web.json_response({"status": "healthy", "service": "Payment API", "payment_queue": payment_queue.stats()})
 
-async def start_http_server():
-    """Start the HTTP server for Minecraft payments"""
-    app = web.Application()
-    app.router.add_post('/payment', handle_payment)
-    app.router.add_get('/health', handle_health)
+async def start_http_server(port=HTTP_PORT, payment_handlers=(handle_payment, handle_payment_batch), health_handler=handle_health, reuse_port=False):
+    """Start the HTTP server for Minecraft payments; without payment handlers only /health and /metrics are served"""
+    app = web.Application(middlewares=[metrics_middleware])
+    if payment_handlers:
+        app.router.add_post('/payment', payment_handlers[0])
+        app.router.add_post('/payments/batch', payment_handlers[1])
+    app.router.add_get('/health', health_handler)
+    app.router.add_get('/metrics', handle_metrics)
     
-    # Use the same port as Railway provides
-    port = int(os.getenv('PORT', 5000))
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', port)
+    site = web.TCPSite(runner, '0.0.0.0', port, reuse_port=reuse_port)
     await site.start()
-    print(f"🌐 HTTP payment server running on port {port}")
+    log.info(f"🌐 HTTP {'payment' if payment_handlers else 'admin'} server running", port=port, pid=os.getpid())
     
     # Keep running
     await asyncio.Event().wait()
 
+# ========== PAYMENT SPOOL (SPLIT DEPLOYMENT) ==========
+class PaymentSpool:
+    """SQLite (WAL) queue between the HTTP ingest workers and the Discord process.
+
+    Ingest workers insert accepted payments; the Discord process reads unconsumed rows
+    in id order, turns them into orders and marks them consumed. Consumed rows are kept
+    for the idempotency TTL so a retried payment is still recognised as a duplicate.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE,
+            minecraft_username TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            received_at REAL NOT NULL,
+            consumed_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_payments_pending ON payments(id) WHERE consumed_at IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_payments_consumed_at ON payments(consumed_at);
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = None
+
+    def open(self):
+        # Several processes share the file, so wait for the write lock instead of failing
+        self.conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def enqueue(self, payments):
+        """Insert (minecraft_username, amount, key) payments in one transaction; returns [(id, duplicate)]"""
+        results = []
+        now = time.time()
+        with self.conn:
+            for minecraft_username, amount, key in payments:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO payments (idempotency_key, minecraft_username, amount, received_at) VALUES (?, ?, ?, ?)",
+                    (key, minecraft_username, amount, now)
+                )
+                if cursor.rowcount:
+                    results.append((cursor.lastrowid, False))
+                else:
+                    row = self.conn.execute("SELECT id FROM payments WHERE idempotency_key = ?", (key,)).fetchone()
+                    results.append((row[0], True))
+        return results
+
+    def pending(self, limit):
+        return self.conn.execute(
+            "SELECT id, minecraft_username, amount, idempotency_key, received_at FROM payments "
+            "WHERE consumed_at IS NULL ORDER BY id LIMIT ?", (limit,)
+        ).fetchall()
+
+    def mark_consumed(self, ids):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("UPDATE payments SET consumed_at = ? WHERE id = ?", [(now, i) for i in ids])
+            self.conn.execute("DELETE FROM payments WHERE consumed_at < ?", (now - IDEMPOTENCY_TTL_HOURS * 3600,))
+
+    def stats(self):
+        depth, oldest = self.conn.execute("SELECT COUNT(*), MIN(received_at) FROM payments WHERE consumed_at IS NULL").fetchone()
+        return {"depth": depth, "oldest_age_seconds": time.time() - oldest if oldest else 0.0}
+
+payment_spool = PaymentSpool(PAYMENT_SPOOL_FILE)
+
+def spool_result(spool_id, duplicate):
+    result = {"status": "success", "payment_id": spool_id, "message": "Payment queued for processing"}
+    return {**result, "duplicate": True} if duplicate else result
+
+async def handle_spool_payment(request):
+    """Ingest-worker /payment: validate and spool the payment; the Discord process creates the order"""
+    try:
+        data = await request.json()
+        
+        try:
+            minecraft_username, amount = parse_payment(data)
+        except ValueError as e:
+            return web.json_response({"status": "error", "message": str(e)}, status=400)
+        
+        key = payment_idempotency_key(data, request.headers.get('Idempotency-Key'))
+        [(spool_id, duplicate)] = await run_in_storage_thread(payment_spool.enqueue, [(minecraft_username, amount, key)])
+        return web.json_response(spool_result(spool_id, duplicate), status=202)
+        
+    except Exception as e:
+        log.exception("❌ Payment spooling error", stage="spool")
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+
+async def handle_spool_payment_batch(request):
+    """Ingest-worker /payments/batch: spool every valid payment in one transaction"""
+    try:
+        body = (await request.text()).strip()
+        
+        try:
+            if body.startswith('['):
+                records = json.loads(body)
+            else:
+                records = [json.loads(line) for line in body.splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            return web.json_response({"status": "error", "message": f"Invalid JSON: {e}"}, status=400)
+        
+        if len(records) > PAYMENT_BATCH_MAX:
+            return web.json_response({"status": "error", "message": f"Batch larger than {PAYMENT_BATCH_MAX} payments"}, status=413)
+        
+        results = [None] * len(records)
+        valid = []
+        for index, record in enumerate(records):
+            try:
+                minecraft_username, amount = parse_payment(record)
+            except ValueError as e:
+                results[index] = {"index": index, "status": "error", "message": str(e)}
+                continue
+            valid.append((index, (minecraft_username, amount, payment_idempotency_key(record))))
+        
+        spooled = await run_in_storage_thread(payment_spool.enqueue, [payment for _, payment in valid])
+        for (index, _), (spool_id, duplicate) in zip(valid, spooled):
+            results[index] = {"index": index, **spool_result(spool_id, duplicate)}
+        
+        return batch_response(results, sum(1 for _, duplicate in spooled if not duplicate))
+        
+    except Exception as e:
+        log.exception("❌ Payment batch spooling error", stage="spool")
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+
+async def handle_ingest_health(request):
+    stats = await run_in_storage_thread(payment_spool.stats)
+    return web.json_response({"status": "healthy", "service": "Payment ingest", "pid": os.getpid(), "spool": stats})
+
+async def consume_payment_spool(batch_size=PAYMENT_BATCH_MAX):
+    """Discord process: turn spooled payments into orders, oldest first"""
+    while True:
+        try:
+            rows = await run_in_storage_thread(payment_spool.pending, batch_size)
+            if not rows:
+                await asyncio.sleep(SPOOL_POLL_SECONDS)
+                continue
+            
+            # Rows without a key use their spool id, so a replay after a crash is still deduplicated
+            fresh = []
+            seen = set()
+            for spool_id, minecraft_username, amount, key, _ in rows:
+                key = key or f"spool:{spool_id}"
+                if key not in seen and not payment_results.get(key):
+                    seen.add(key)
+                    fresh.append((minecraft_username, amount, key))
+            
+            if fresh:
+                created = await process_direct_payments(fresh)
+                for (_, _, key), (order_id, order) in zip(fresh, created):
+                    payment_results.put(key, payment_result(order_id, order))
+            
+            # Orders are durable before the rows are marked consumed
+            await run_in_storage_thread(payment_spool.mark_consumed, [row[0] for row in rows])
+            
+        except Exception as e:
+            log.exception("❌ Payment spool error", stage="spool")
+            await asyncio.sleep(SPOOL_POLL_SECONDS)
+
+async def ingest_main():
+    """One HTTP ingest worker; workers share PORT through SO_REUSEPORT"""
+    await run_in_storage_thread(payment_spool.open)
+    asyncio.create_task(monitor_event_loop_lag())
+    await start_http_server(HTTP_PORT, (handle_spool_payment, handle_spool_payment_batch), handle_ingest_health, reuse_port=True)
+
+def run_ingest_worker():
+    # The log listener thread does not survive the fork, and forked children skip atexit
+    setup_logging()
+    try:
+        asyncio.run(ingest_main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_logging()
+
+def start_ingest_workers(count):
+    # Workers are forked before any event loop or storage thread exists in this process
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=run_ingest_worker, name=f"ingest-{i}", daemon=True) for i in range(count)]
+    for worker in workers:
+        worker.start()
+    log.info("🌐 Started payment ingest workers", workers=count, port=HTTP_PORT)
+    return workers
+
 # ========== DISCORD COMMANDS ==========
 @bot.tree.command(name="purchase", description="Purchase premium access")
-async def purchase(interaction: discord.Interaction, plan: Literal["1d", "7d", "30d", "90d", "AntiAfk-Script", "Items-Script"]):
+@discord.app_commands.autocomplete(plan=plan_autocomplete)
+async def purchase(interaction: discord.Interaction, plan: str):
     try:
         await interaction.response.defer(ephemeral=True)
         
-        plans = {
-            "1d": {"price": random.randint(19_000_000, 20_000_000), "days": 1},
-            "7d": {"price": random.randint(49_000_000, 50_000_000), "days": 7},
-            "30d": {"price": random.randint(119_000_000, 120_000_000), "days": 30},
-            "90d": {"price": random.randint(199_000_000, 200_000_000), "days": 90},
-            "AntiAfk-Script": {"price": random.randint(99_000_000, 100_000_000), "days": "antiafk"},
-            "Items-Script": {"price": random.randint(199_000_000, 200_000_000), "days": "items"}
-        }
+        plan_info = plan_catalog.get(plan)
+        if not plan_info:
+            await interaction.followup.send("❌ Unknown plan!", ephemeral=True)
+            return
         
-        amount = plans[plan]["price"]
-        days = plans[plan]["days"]
+        # Reserve an amount no other pending order uses, so the payment can be matched automatically
+        order_id = order_ids.allocate("order")
+        amount, reserved_until = pending_amounts.reserve(order_id, *plan_info["price"])
+        days = plan_info["days"]
         
         # Create order
-        orders = load_orders()
-        order_id = f"order_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        
-        orders[order_id] = {
+        await storage.create_order(order_id, {
             "discord_id": str(interaction.user.id),
             "amount": amount,
             "days": days,
             "plan": plan,
             "status": "pending",
             "is_code_redemption": False,
-            "created_at": datetime.now().isoformat()
-        }
-        
-        save_orders(orders)
-        
-        # Send verification message
-        await send_verification_message(interaction.user.id, amount, plan, None, order_id)
+            "created_at": datetime.now().isoformat(),
+            "reserved_until": datetime.fromtimestamp(reserved_until).isoformat()
+        })
         
         payment_message = (
             f"💎 Инструкция по покупке:\n\n"
             f"Отправьте `{amount:,}` игроку `{PAYMENT_TARGET}` на Анархии 602 (/an602)\n"
             f"Команда: ```/pay {PAYMENT_TARGET} {amount}```\n\n"
-            f"После отправки денег ваш заказ будет автоматически проверен администрацией!\n"
+            f"После отправки точной суммы ваш заказ будет подтвержден автоматически!\n"
             f"Не нужно пинговать админов - они увидят ваш заказ автоматически."
         )
         
         await interaction.followup.send(payment_message, ephemeral=True)
         
+        # Send verification message
+        queue_purchase_embed(order_id, interaction.user.id, amount, plan)
+        
     except Exception as e:
-        print(f"❌ Purchase command error: {type(e).__name__}: {e}")
+        log.exception("❌ Purchase command error", stage="purchase", discord_id=str(interaction.user.id), plan=plan)
         await interaction.followup.send("❌ Error processing purchase", ephemeral=True)
 
 @bot.tree.command(name="manual_verify", description="[ADMIN] Manually verify a direct payment")
 async def manual_verify(interaction: discord.Interaction, order_id: str, discord_user: discord.User):
-    try:
-        if not is_admin(interaction.user.id):
-            await interaction.response.send_message("❌ No permission!", ephemeral=True)
-            return
-        
-        await interaction.response.defer(ephemeral=True)
-        
-        orders = load_orders()
-        
-        if order_id not in orders:
-            await interaction.followup.send("❌ Order not found!", ephemeral=True)
-            return
+    with log_stage("🛠️ Manual verification", "verify.manual", order_id=order_id, admin_id=str(interaction.user.id), discord_id=str(discord_user.id)) as fields:
+        try:
+            if not is_admin(interaction.user.id):
+                await interaction.response.send_message("❌ No permission!", ephemeral=True)
+                return
             
-        order = orders[order_id]
-        
-        if order.get("status") == "verified":
-            await interaction.followup.send("❌ Order already verified!", ephemeral=True)
-            return
-        
-        # Update order with Discord ID
-        orders[order_id]["discord_id"] = str(discord_user.id)
-        orders[order_id]["status"] = "verified"
-        orders[order_id]["verified_at"] = datetime.now().isoformat()
-        orders[order_id]["verified_by"] = str(interaction.user.id)
-        
-        save_orders(orders)
-        
-        # Assign role
-        guild = bot.get_guild(GUILD_ID)
-        if guild:
-            member = guild.get_member(discord_user.id)
-            if member:
-                role = guild.get_role(PREMIUM_ROLE_ID)
-                if role:
-                    await member.add_roles(role)
-                    print(f"✅ Role {PREMIUM_ROLE_ID} assigned to {member.display_name}")
-                    
-                    try:
+            await interaction.response.defer(ephemeral=True)
+            
+            # Holding the order's lock makes a concurrent ✅ reaction or payment match see the verified order
+            async with order_locks.hold(order_id):
+                order = await storage.get_order(order_id)
+                
+                if not order:
+                    fields["outcome"] = "not_found"
+                    await interaction.followup.send("❌ Order not found!", ephemeral=True)
+                    return
+                
+                if order.get("status") == "verified":
+                    fields["outcome"] = "already_verified"
+                    await interaction.followup.send("❌ Order already verified!", ephemeral=True)
+                    return
+                
+                # Update order with Discord ID
+                order = await storage.verify_order(
+                    order_id,
+                    str(interaction.user.id),
+                    discord_id=str(discord_user.id),
+                    **schedule_subscription(order_id, str(discord_user.id), order["days"])
+                )
+                verification_messages.pop(order.get("message_id"), None)
+                pending_amounts.release(order_id)
+                fields.update(outcome="verified", plan=order["plan"], minecraft_username=order.get("minecraft_username"))
+            
+            # Assign role
+            guild = bot.get_guild(GUILD_ID)
+            if guild:
+                member = await members.resolve(guild, discord_user.id)
+                if member:
+                    role = guild.get_role(PREMIUM_ROLE_ID)
+                    if role:
+                        await discord_actions.submit(f"roles:{guild.id}", PRIORITY_ROLE, lambda: member.add_roles(role))
+                        fields["role_assigned"] = True
+                        
                         dm_message = (
                             f"🎉 Ваша покупка подтверждена! Вы получили доступ к конфигурациям.\n\n"
                             f"**Детали заказа:**\n"
@@ -356,100 +3041,73 @@ async def manual_verify(interaction: discord.Interaction, order_id: str, discord
                             f"**ПРИМЕР КОМАНДЫ ДЛЯ АВТОРИЗАЦИИ:** `/register hwid: 731106141075386bfac06e0f2ab053be`\n"
                             f"Канал находится в дискорд сервере невера. После авторизации перезапусти майн!"
                         )
-                        
-                        dm_channel = await member.create_dm()
-                        await dm_channel.send(dm_message)
-                        print(f"✅ DM sent to {member.display_name}")
-                        
-                    except discord.Forbidden:
-                        print(f"❌ Cannot send DM to {member.display_name} (DMs disabled)")
-                    except Exception as e:
-                        print(f"❌ Error sending DM: {e}")
-        
-        await interaction.followup.send(
-            f"✅ Order {order_id} verified!\n"
-            f"• Minecraft: `{order.get('minecraft_username', 'N/A')}`\n"
-            f"• Amount: `{order['amount']:,}`\n"
-            f"• Plan: `{order['plan']}`\n"
-            f"• Discord: {discord_user.mention}\n"
-            f"• Role assigned: ✅",
-            ephemeral=True
-        )
-        
-    except Exception as e:
-        print(f"Manual verify error: {e}")
-        await interaction.followup.send("❌ Error verifying order", ephemeral=True)
+                        queue_dm(member, dm_message, "manual_verify", order_id=order_id)
+                        fields["dm_queued"] = True
+            
+            await interaction.followup.send(
+                f"✅ Order {order_id} verified!\n"
+                f"• Minecraft: `{order.get('minecraft_username', 'N/A')}`\n"
+                f"• Amount: `{order['amount']:,}`\n"
+                f"• Plan: `{order['plan']}`\n"
+                f"• Discord: {discord_user.mention}\n"
+                f"• Role assigned: ✅",
+                ephemeral=True
+            )
+            
+        except Exception as e:
+            fields["error"] = f"{type(e).__name__}: {e}"
+            await interaction.followup.send("❌ Error verifying order", ephemeral=True)
 
 @bot.tree.command(name="redeem", description="Redeem a premium code")
 async def redeem(interaction: discord.Interaction, code: str):
-    try:
-        await interaction.response.defer(ephemeral=True)
-        
-        with open(CODES_FILE, 'r') as f:
-            data = json.load(f)
-        
-        code_data = next((c for c in data["codes"] if c["code"] == code and not c.get("redeemed", False)), None)
-        
-        if not code_data:
-            await interaction.followup.send("❌ Invalid or already redeemed code!", ephemeral=True)
-            return
+    with log_stage("🎟️ Code redemption", "redeem", code=code, discord_id=str(interaction.user.id)) as fields:
+        try:
+            await interaction.response.defer(ephemeral=True)
             
-        # Process code redemption
-        codes_data = load_codes()
-        code_data_local = next((c for c in codes_data["codes"] if c["code"] == code and not c.get("redeemed", False)), None)
-        
-        if not code_data_local:
-            await interaction.followup.send("❌ Invalid or already redeemed code!", ephemeral=True)
-            return
+            # Claim the code first so two concurrent redeems cannot both succeed
+            code_data = await storage.redeem_code(code, str(interaction.user.id))
+            
+            if not code_data:
+                fields["outcome"] = "rejected"
+                await interaction.followup.send("❌ Invalid or already redeemed code!", ephemeral=True)
+                return
 
-        orders = load_orders()
-        order_id = f"redeem_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        
-        orders[order_id] = {
-            "discord_id": str(interaction.user.id),
-            "amount": 0,
-            "days": code_data_local["days"],
-            "plan": code_data_local["plan"],
-            "status": "verified",
-            "is_code_redemption": True,
-            "created_at": datetime.now().isoformat(),
-            "paid_at": datetime.now().isoformat(),
-            "verified_at": datetime.now().isoformat(),
-            "code_used": code
-        }
-        
-        code_data_local.update({
-            "redeemed": True,
-            "redeemed_by": str(interaction.user.id),
-            "redeemed_at": datetime.now().isoformat()
-        })
-        
-        save_orders(orders)
-        save_codes(codes_data)
-        
-        # Update original data for response
-        code_data["redeemed"] = True
-        code_data["redeemed_by"] = str(interaction.user.id)
-        code_data["redeemed_at"] = datetime.utcnow().isoformat()
-        
-        with open(CODES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-        
-        # Assign role
-        try:
-            guild = bot.get_guild(GUILD_ID)
-            if guild:
-                member = guild.get_member(interaction.user.id)
-                if member:
-                    role = guild.get_role(PREMIUM_ROLE_ID)
-                    if role:
-                        await member.add_roles(role)
-                        print(f"✅ Role assigned to {interaction.user.display_name} via code redemption")
-        except Exception as e:
-            print(f"Role assignment error: {e}")
-        
-        # Send DM
-        try:
+            order_id = order_ids.allocate("redeem")
+            fields.update(outcome="redeemed", order_id=order_id, plan=code_data["plan"])
+            
+            await storage.create_order(order_id, {
+                "discord_id": str(interaction.user.id),
+                "amount": 0,
+                "days": code_data["days"],
+                "plan": code_data["plan"],
+                "status": "verified",
+                "is_code_redemption": True,
+                "created_at": datetime.now().isoformat(),
+                "paid_at": datetime.now().isoformat(),
+                "verified_at": datetime.now().isoformat(),
+                "code_used": code,
+                **schedule_subscription(order_id, str(interaction.user.id), code_data["days"])
+            })
+            
+            # Assign role
+            try:
+                guild = bot.get_guild(GUILD_ID)
+                if guild:
+                    member = await members.resolve(guild, interaction.user.id)
+                    if member:
+                        role = guild.get_role(PREMIUM_ROLE_ID)
+                        if role:
+                            await discord_actions.submit(f"roles:{guild.id}", PRIORITY_ROLE, lambda: member.add_roles(role))
+                            fields["role_assigned"] = True
+            except Exception as e:
+                fields["role_error"] = str(e)
+            
+            await interaction.followup.send(
+                f"✅ Промокод успешно введен на {code_data['plan']}! Вы получили доступ к конфигурациям.",
+                ephemeral=True
+            )
+            
+            # Send DM in the background, after the reply
             dm_message = (
                 f"✅ Промокод успешно введен на {code_data['plan']}! Вы получили доступ к конфигурациям.\n\n"
                 f"Если не загружается кфг - при входе в майн копируется хвид (если не копируется то используйте https://discord.com/channels/1288902708777979904/1424880610324910121)\n"
@@ -457,76 +3115,115 @@ async def redeem(interaction: discord.Interaction, code: str):
                 f"**ПРИМЕР КОМАНДЫ ДЛЯ АВТОРИЗАЦИИ:** `/register hwid: 731106141075386bfac06e0f2ab053be`\n"
                 f"Канал находится в дискорд сервере невера. После авторизации перезапусти майн!"
             )
-            dm_channel = await interaction.user.create_dm()
-            await dm_channel.send(dm_message)
-            print(f"✅ DM sent to {interaction.user.display_name} for code redemption")
-        except discord.Forbidden:
-            print(f"❌ Cannot send DM to {interaction.user.display_name} (DMs disabled)")
+            queue_dm(interaction.user, dm_message, "redeem", order_id=order_id)
+            fields["dm_queued"] = True
+            
         except Exception as e:
-            print(f"❌ Error sending DM for code redemption: {e}")
-        
-        await interaction.followup.send(
-            f"✅ Промокод успешно введен на {code_data['plan']}! Вы получили доступ к конфигурациям.",
-            ephemeral=True
-        )
-        
-    except Exception as e:
-        print(f"Redeem error: {e}")
-        await interaction.followup.send("❌ Error redeeming code", ephemeral=True)
+            fields["error"] = f"{type(e).__name__}: {e}"
+            await interaction.followup.send("❌ Error redeeming code", ephemeral=True)
 
 @bot.tree.command(name="generate_codes", description="[ADMIN] Generate premium codes")
+@discord.app_commands.autocomplete(plan=plan_autocomplete)
 async def generate_codes(
     interaction: discord.Interaction,
-    plan: Literal["1d", "7d", "30d", "90d", "AntiAfk-Script", "Items-Script"],
-    count: int = 1
+    plan: str,
+    count: int = 1,
+    file_format: Literal["csv", "txt"] = "csv"
 ):
     try:
         if not is_admin(interaction.user.id):
             await interaction.response.send_message("❌ No permission!", ephemeral=True)
             return
         
+        plan_info = plan_catalog.get(plan)
+        if not plan_info:
+            await interaction.response.send_message("❌ Unknown plan!", ephemeral=True)
+            return
+        
         await interaction.response.defer(ephemeral=True)
-            
-        plan_data = {
-            "1d": {"days": 1}, "7d": {"days": 7}, "30d": {"days": 30}, "90d": {"days": 90},
-            "AntiAfk-Script": {"days": "antiafk"}, "Items-Script": {"days": "items"}
-        }
         
-        with open(CODES_FILE, 'r') as f:
-            data = json.load(f)
-            
-        new_codes = []
-        for _ in range(min(count, 50)):
-            code = ''.join(random.choices('ABCDEFGHJKLMNPQRSTUVWXYZ23456789', k=10))
-            new_code = {
-                "code": code, 
-                "plan": plan, 
-                "days": plan_data[plan]["days"],
-                "created_at": datetime.now(timezone.utc).isoformat(), 
-                "created_by": str(interaction.user.id), 
-                "redeemed": False
-            }
-            data["codes"].append(new_code)
-            new_codes.append(f"`{code}` - {plan}")
-            
-        with open(CODES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-        
-        codes_text = "\n".join(new_codes)
-        if len(codes_text) > 2000:
-            chunks = [codes_text[i:i+2000] for i in range(0, len(codes_text), 2000)]
-            for i, chunk in enumerate(chunks):
-                if i == 0:
-                    await interaction.followup.send(f"✅ Generated {len(new_codes)} {plan} codes:\n\n{chunk}", ephemeral=True)
-                else:
-                    await interaction.followup.send(chunk, ephemeral=True)
+        new_codes = await create_codes(plan, plan_info["days"], max(1, min(count, GENERATE_CODES_MAX)), str(interaction.user.id))
+        log.info("✅ Generated codes", stage="generate_codes", plan=plan, count=len(new_codes), admin_id=str(interaction.user.id))
+        
+        # Up to 50 codes still fit in one message; anything larger goes out as a single attachment
+        header = f"✅ Generated {len(new_codes)} {plan} codes"
+        if len(new_codes) <= 50:
+            codes_text = "\n".join(f"`{c['code']}` - {plan}" for c in new_codes)
+            await interaction.followup.send(f"{header}:\n\n{codes_text}", ephemeral=True)
         else:
-            await interaction.followup.send(f"✅ Generated {len(new_codes)} {plan} codes:\n\n{codes_text}", ephemeral=True)
+            filename = f"codes_{plan}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            await interaction.followup.send(f"{header} (attached)", file=export_codes_file(new_codes, file_format, filename), ephemeral=True)
         
     except Exception as e:
-        print(f"Generate error: {e}")
+        log.exception("❌ Generate codes error", stage="generate_codes")
         await interaction.followup.send("❌ Error generating codes", ephemeral=True)
 
+CODES_PAGE_SIZE = 15
+
+def format_code_counts(counts):
+    lines = [f"**Available codes: {sum(counts.values())}**"]
+    lines.extend(f"• {plan}: {count}" for plan, count in sorted(counts.items()))
+    return "\n".join(lines)
+
+class CodesPageView(discord.ui.View):
+    """Prev/Next pages of unredeemed codes, each fetched by cursor when a button is pressed"""
+
+    def __init__(self, owner_id):
+        super().__init__(timeout=600)
+        self.owner_id = owner_id
+        self.cursors = [None]  # the cursor each visited page starts after; the last one is the current page
+        self.page = []
+
+    async def load(self):
+        # One extra row tells whether there is a next page without counting the rest
+        rows = await storage.unredeemed_codes_page(self.cursors[-1], CODES_PAGE_SIZE + 1)
+        self.page = rows[:CODES_PAGE_SIZE]
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = len(rows) <= CODES_PAGE_SIZE
+
+    def render(self):
+        lines = [f"**Available codes — page {len(self.cursors)}:**"]
+        for code in self.page:
+            created_at = code.get("created_at", "")[:16].replace("T", " ")
+            lines.append(f"`{code['code']}` - {code['plan']} (Created by <@{code['created_by']}> on {created_at})")
+        if not self.page:
+            lines.append("ℹ️ No available codes")
+        return "\n".join(lines)
+
+    async def interaction_check(self, interaction):
+        return interaction.user.id == self.owner_id
+
+    @discord.ui.button(label="◀ Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await self.load()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        if self.page:
+            last = self.page[-1]
+            self.cursors.append((last.get("created_at", ""), last["code"]))
+        await self.load()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+class BrowseCodesView(discord.ui.View):
+    """Button under the /check_codes counts that opens the paginated code list"""
+
+    def __init__(self, owner_id):
+        super().__init__(timeout=600)
+        self.owner_id = owner_id
+
+    async def interaction_check(self, interaction):
+        return interaction.user.id == self.owner_id
+
+    @discord.ui.button(label="📋 Browse codes", style=discord.ButtonStyle.primary)
+    async def browse(self, interaction, button):
+        view = CodesPageView(self.owner_id)
+        await view.load()
+        await interaction.response.send_message(view.render(), view=view, ephemeral=True)
+
 @bot.tree.command(name="check_codes", description="[ADMIN] Check available codes")
 async def check_codes(interaction: discord.Interaction):
     try:
@@ -536,37 +3233,76 @@ async def check_codes(interaction: discord.Interaction):
         
         await interaction.response.defer(ephemeral=True)
             
-        with open(CODES_FILE, 'r') as f:
-            data = json.load(f)
-            
-        available_codes = [c for c in data["codes"] if not c["redeemed"]]
+        counts = await storage.available_code_counts()
         
-        if not available_codes:
+        if not counts:
             await interaction.followup.send("ℹ️ No available codes", ephemeral=True)
             return
-            
-        message = ["**Available codes:**"]
-        for code in available_codes:
-            created_at = datetime.fromisoformat(code["created_at"].replace('Z', '+00:00')).strftime("%Y-%m-%d %H:%M")
-            message.append(
-                f"`{code['code']}` - {code['plan']} (Created by <@{code['created_by']}> on {created_at})"
-            )
         
-        full_message = "\n".join(message)
-        if len(full_message) > 2000:
-            chunks = [full_message[i:i+2000] for i in range(0, len(full_message), 2000)]
-            for i, chunk in enumerate(chunks):
-                if i == 0:
-                    await interaction.followup.send(chunk, ephemeral=True)
-                else:
-                    await interaction.followup.send(chunk, ephemeral=True)
-        else:
-            await interaction.followup.send(full_message, ephemeral=True)
+        await interaction.followup.send(format_code_counts(counts), view=BrowseCodesView(interaction.user.id), ephemeral=True)
         
     except Exception as e:
-        print(f"Check codes error: {e}")
+        log.exception("❌ Check codes error")
         await interaction.followup.send("❌ Error checking codes", ephemeral=True)
 
+@bot.tree.command(name="archive_history", description="[ADMIN] Archive old verified orders and redeemed codes")
+async def archive_history_command(interaction: discord.Interaction, days: int = 90):
+    try:
+        if not is_admin(interaction.user.id):
+            await interaction.response.send_message("❌ No permission!", ephemeral=True)
+            return
+        
+        await interaction.response.defer(ephemeral=True)
+        
+        orders, codes = await archive_history(max(1, days))
+        await interaction.followup.send(f"🗄️ Archived {orders} orders and {codes} codes older than {max(1, days)} days", ephemeral=True)
+        
+    except Exception as e:
+        log.exception("❌ Archive error", stage="archive")
+        await interaction.followup.send("❌ Error archiving history", ephemeral=True)
+
+@bot.tree.command(name="sales_report", description="[ADMIN] Order volume and revenue by plan, status and day")
+async def sales_report(interaction: discord.Interaction, days: int = 30, rebuild: bool = False):
+    try:
+        if not is_admin(interaction.user.id):
+            await interaction.response.send_message("❌ No permission!", ephemeral=True)
+            return
+        
+        await interaction.response.defer(ephemeral=True)
+        
+        if rebuild:
+            with log_stage("📈 Rebuilt sales aggregates", "sales.rebuild"):
+                await rebuild_sales()
+        
+        report = format_sales_report(await sales_rows(), max(0, days))
+        await interaction.followup.send(report, ephemeral=True)
+        
+    except Exception as e:
+        log.exception("❌ Sales report error")
+        await interaction.followup.send("❌ Error building sales report", ephemeral=True)
+
+@bot.tree.command(name="lookup", description="[ADMIN] Find an order or code, including archived ones")
+async def lookup(interaction: discord.Interaction, kind: Literal["order", "code"], key: str):
+    try:
+        if not is_admin(interaction.user.id):
+            await interaction.response.send_message("❌ No permission!", ephemeral=True)
+            return
+        
+        await interaction.response.defer(ephemeral=True)
+        
+        found = await lookup_record(f"{kind}s", key)
+        if not found:
+            await interaction.followup.send(f"❌ {kind.capitalize()} `{key}` not found", ephemeral=True)
+            return
+        
+        where, record = found
+        details = json.dumps(record, indent=2, ensure_ascii=False)[:1800]
+        await interaction.followup.send(f"🔎 {kind.capitalize()} `{key}` ({where}):\n```json\n{details}\n```", ephemeral=True)
+        
+    except Exception as e:
+        log.exception("❌ Lookup error")
+        await interaction.followup.send("❌ Error looking up record", ephemeral=True)
+
 @bot.event
 async def on_raw_reaction_add(payload):
     """Handle reaction verification"""
@@ -583,8 +3319,15 @@ async def on_raw_reaction_add(payload):
         channel = bot.get_channel(payload.channel_id)
         if not channel:
             return
-            
-        message = await channel.fetch_message(payload.message_id)
+        
+        order_id = verification_messages.get(payload.message_id)
+        if order_id:
+            # Known message: no REST fetch and no embed parsing needed
+            await verify_order_from_reaction(order_id, payload.user_id, channel.get_partial_message(payload.message_id))
+            return
+        
+        # Messages posted before the index existed: read the order ID from the embed
+        message = await discord_actions.submit(f"fetches:{channel.id}", PRIORITY_ROLE, lambda: channel.fetch_message(payload.message_id))
         
         if not message.embeds:
             return
@@ -609,113 +3352,233 @@ async def on_raw_reaction_add(payload):
         await verify_order_from_reaction(order_id, payload.user_id, message)
         
     except Exception as e:
-        print(f"Reaction verification error: {e}")
+        log.exception("❌ Reaction verification error", message_id=payload.message_id)
 
-async def verify_order_from_reaction(order_id, admin_id, message):
-    """Verify order when admin reacts with ✅"""
-    try:
-        embed = message.embeds[0]
-        discord_id = None
-        minecraft_username = None
-        plan = None
-        amount = None
-        
-        for field in embed.fields:
-            if field.name == "Discord User":
-                discord_id = field.value.replace('<@', '').replace('>', '').strip()
-            elif field.name == "Minecraft Username":
-                minecraft_username = field.value.strip('`')
-            elif field.name == "Plan":
-                plan = field.value.strip('`')
-            elif field.name == "Amount":
-                amount = field.value.strip('`').replace(',', '')
-        
-        # Update order status
-        orders = load_orders()
-        if order_id in orders:
-            orders[order_id]["status"] = "verified"
-            orders[order_id]["verified_at"] = datetime.now().isoformat()
-            orders[order_id]["verified_by"] = str(admin_id)
-            
-            # If this was a direct payment, we might not have a Discord ID yet
-            if not discord_id and "discord_id" in orders[order_id] and orders[order_id]["discord_id"] != "unknown":
-                discord_id = orders[order_id]["discord_id"]
-            
-            save_orders(orders)
-        
-        # Assign role if we have Discord ID
-        if discord_id and discord_id != "unknown":
+async def mark_message_verified(message, order_id, order, verified_by):
+    """Turn a verification message into the green "Payment Verified" embed"""
+    embed = build_order_embed(order_id, order)
+    embed.title = "✅ Payment Verified"
+    embed.color = discord.Color.green()
+    embed.add_field(name="✅ Verified By", value=verified_by, inline=True)
+    embed.add_field(name="🕒 Verified At", value=f"<t:{int(datetime.now(timezone.utc).timestamp())}:R>", inline=True)
+    
+    await asyncio.gather(
+        discord_actions.submit(f"edits:{message.channel.id}", PRIORITY_EMBED, lambda: message.edit(embed=embed), coalesce_key=f"edit:{message.id}"),
+        discord_actions.submit(f"reactions:{message.channel.id}", PRIORITY_EMBED, message.clear_reactions, coalesce_key=f"clear:{message.id}")
+    )
+
+async def deliver_matched_payment(order_id, order):
+    """Grant the role for a purchase settled by an in-game payment; returns True when done"""
+    with log_stage("🤖 Matched payment delivery", "verify.auto", order_id=order_id, discord_id=order["discord_id"], minecraft_username=order.get("minecraft_username"), plan=order["plan"]) as fields:
+        try:
             guild = bot.get_guild(GUILD_ID)
             if guild:
-                member = guild.get_member(int(discord_id))
-                if member:
+                member = await members.resolve(guild, order["discord_id"])
+                role = guild.get_role(PREMIUM_ROLE_ID)
+                if member and role:
+                    await discord_actions.submit(f"roles:{guild.id}", PRIORITY_ROLE, lambda: member.add_roles(role))
+                    fields["role_assigned"] = True
+                    
+                    try:
+                        dm_message = (
+                            f"🎉 Ваша покупка подтверждена! Вы получили доступ к конфигурациям.\n\n"
+                            f"**Детали заказа:**\n"
+                            f"• План: {order['plan']}\n"
+                            f"• Сумма: {order['amount']:,}\n"
+                            f"• Minecraft: {order.get('minecraft_username', 'N/A')}\n"
+                            f"• Подтверждено: автоматически\n\n"
+                            f"Если не загружается кфг - при входе в майн копируется хвид (если не копируется то используйте https://discord.com/channels/1288902708777979904/1424880610324910121)\n"
+                            f"В канале авторизации пиши `/register + хвид`\n"
+                            f"**ПРИМЕР КОМАНДЫ ДЛЯ АВТОРИЗАЦИИ:** `/register hwid: 731106141075386bfac06e0f2ab053be`\n"
+                            f"Канал находится в дискорд сервере невера. После авторизации перезапусти майн!"
+                        )
+                        queue_dm(member, dm_message, "verify.auto", order_id=order_id)
+                        fields["dm_queued"] = True
+                    except Exception as e:
+                        fields["dm_error"] = str(e)
+            
+            # Without a message ID the purchase embed has not landed yet; post_purchase_embed
+            # sees the verified order when it does and updates the embed itself
+            channel = bot.get_channel(VERIFICATION_CHANNEL_ID)
+            if channel and order.get("message_id"):
+                await mark_message_verified(channel.get_partial_message(order["message_id"]), order_id, order, "🤖 In-game payment")
+            
+            return True
+            
+        except Exception as e:
+            fields["error"] = f"{type(e).__name__}: {e}"
+            return False
+
+async def verify_order_from_reaction(order_id, admin_id, message):
+    """Verify order when admin reacts with ✅"""
+    with log_stage("✅ Reaction verification", "verify.reaction", order_id=order_id, admin_id=str(admin_id), message_id=message.id) as fields:
+        try:
+            async with order_locks.hold(order_id):
+                order = await storage.get_order(order_id)
+                if not order:
+                    fields["outcome"] = "not_found"
+                    return
+                
+                # An order verified already (second ✅, /manual_verify, in-game payment) keeps
+                # its original verification and must not extend the subscription again
+                fields["outcome"] = "already_verified" if order.get("status") == "verified" else "verified"
+                if order.get("status") != "verified":
+                    order = await storage.verify_order(order_id, str(admin_id), **schedule_subscription(order_id, order.get("discord_id"), order["days"]))
+                
+                verification_messages.pop(message.id, None)
+                pending_amounts.release(order_id)
+            discord_id = order.get("discord_id")
+            plan = order["plan"]
+            amount = order["amount"]
+            fields.update(discord_id=discord_id, plan=plan, minecraft_username=order.get("minecraft_username"))
+            
+            # Assign role if we have Discord ID
+            member = None
+            if discord_id and discord_id != "unknown":
+                guild = bot.get_guild(GUILD_ID)
+                if guild:
+                    member = await members.resolve(guild, discord_id)
                     role = guild.get_role(PREMIUM_ROLE_ID)
-                    if role:
-                        await member.add_roles(role)
-                        print(f"✅ Role {PREMIUM_ROLE_ID} assigned to {member.display_name}")
-                        
-                        try:
-                            admin_user = await bot.fetch_user(admin_id)
-                            dm_message = (
-                                f"🎉 Ваша покупка подтверждена! Вы получили доступ к конфигурациям.\n\n"
-                                f"**Детали заказа:**\n"
-                                f"• План: {plan}\n"
-                                f"• Сумма: {int(amount):,}\n"
-                                f"• Подтверждено: {admin_user.display_name}\n\n"
-                                f"Если не загружается кфг - при входе в майн копируется хвид (если не копируется то используйте https://discord.com/channels/1288902708777979904/1424880610324910121)\n"
-                                f"В канале авторизации пиши `/register + хвид`\n"
-                                f"**ПРИМЕР КОМАНДЫ ДЛЯ АВТОРИЗАЦИИ:** `/register hwid: 731106141075386bfac06e0f2ab053be`\n"
-                                f"Канал находится в дискорд сервере невера. После авторизации перезапусти майн!"
-                            )
-                            
-                            dm_channel = await member.create_dm()
-                            await dm_channel.send(dm_message)
-                            print(f"✅ DM sent to {member.display_name}")
-                            
-                        except discord.Forbidden:
-                            print(f"❌ Cannot send DM to {member.display_name} (DMs disabled)")
-                        except Exception as e:
-                            print(f"❌ Error sending DM: {e}")
-        
-        embed.title = "✅ Payment Verified"
-        embed.color = discord.Color.green()
-        embed.add_field(name="✅ Verified By", value=f"<@{admin_id}>", inline=True)
-        embed.add_field(name="🕒 Verified At", value=f"<t:{int(datetime.now(timezone.utc).timestamp())}:R>", inline=True)
-        
-        await message.edit(embed=embed)
-        await message.clear_reactions()
-        
-        print(f"Order {order_id} verified by {admin_id}")
-        
-    except Exception as e:
-        print(f"Order verification error: {e}")
+                    if member and role:
+                        await discord_actions.submit(f"roles:{guild.id}", PRIORITY_ROLE, lambda: member.add_roles(role))
+                        fields["role_assigned"] = True
+            
+            await mark_message_verified(message, order_id, order, f"<@{admin_id}>")
+            
+            if fields.get("role_assigned"):
+                try:
+                    # Only needed for the DM text, so looked up at DM priority after the embed is updated
+                    admin_user = (await members.resolve(guild, admin_id, priority=PRIORITY_DM)
+                                  or await discord_actions.submit("users", PRIORITY_DM, lambda: bot.fetch_user(admin_id)))
+                    dm_message = (
+                        f"🎉 Ваша покупка подтверждена! Вы получили доступ к конфигурациям.\n\n"
+                        f"**Детали заказа:**\n"
+                        f"• План: {plan}\n"
+                        f"• Сумма: {amount:,}\n"
+                        f"• Подтверждено: {admin_user.display_name}\n\n"
+                        f"Если не загружается кфг - при входе в майн копируется хвид (если не копируется то используйте https://discord.com/channels/1288902708777979904/1424880610324910121)\n"
+                        f"В канале авторизации пиши `/register + хвид`\n"
+                        f"**ПРИМЕР КОМАНДЫ ДЛЯ АВТОРИЗАЦИИ:** `/register hwid: 731106141075386bfac06e0f2ab053be`\n"
+                        f"Канал находится в дискорд сервере невера. После авторизации перезапусти майн!"
+                    )
+                    queue_dm(member, dm_message, "verify.reaction", order_id=order_id)
+                    fields["dm_queued"] = True
+                except Exception as e:
+                    fields["dm_error"] = str(e)
+            
+        except Exception as e:
+            fields["error"] = f"{type(e).__name__}: {e}"
+
+def command_tree_hash(guild):
+    """Hash of the command definitions that a sync for `guild` (None for global) would upload"""
+    definitions = [command.to_dict() for command in bot.tree.get_commands(guild=guild)]
+    definitions.sort(key=lambda d: d["name"])
+    return hashlib.sha256(json.dumps(definitions, sort_keys=True).encode()).hexdigest()
+
+def read_command_sync_state():
+    try:
+        with open(COMMAND_SYNC_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+commands_synced = False
+
+async def sync_commands_if_changed():
+    """Sync the command tree only when its definitions differ from the last successful sync"""
+    guild = discord.Object(id=GUILD_ID) if COMMAND_SYNC_SCOPE == "guild" else None
+    if guild:
+        bot.tree.copy_global_to(guild=guild)
+    
+    scope = f"guild:{GUILD_ID}" if guild else "global"
+    tree_hash = command_tree_hash(guild)
+    state = await run_in_storage_thread(read_command_sync_state)
+    if state.get(scope) == tree_hash:
+        log.info("✅ Commands unchanged, skipping sync", scope=scope)
+        return
+    
+    synced = await bot.tree.sync(guild=guild)
+    await run_in_storage_thread(write_json_atomic, COMMAND_SYNC_FILE, {**state, scope: tree_hash})
+    log.info("✅ Synced commands", scope=scope, commands=len(synced))
 
 @bot.event
 async def on_ready():
-    print(f"✅ Discord bot logged in as {bot.user}")
+    global commands_synced
+    log.info("✅ Discord bot logged in", user=str(bot.user))
+    if commands_synced:
+        # on_ready fires again after a reconnect; the tree cannot have changed since
+        return
     try:
-        synced = await bot.tree.sync()
-        print(f"✅ Synced {len(synced)} commands")
+        await sync_commands_if_changed()
+        commands_synced = True
         
     except Exception as e:
-        print(f"❌ Sync error: {e}")
+        log.exception("❌ Sync error")
 
 # ========== START BOTH SERVERS ==========
-async def main():
-    """Start both Discord bot and HTTP server"""
+async def main(split=False):
+    """Start both Discord bot and HTTP server; with `split`, payments come from the ingest workers' spool"""
+    global recovery_seconds
+    started = time.perf_counter()
+    try:
+        with log_stage("♻️ Recovered stored state", "recovery", backend=STORAGE_BACKEND) as fields:
+            await run_in_storage_thread(storage.load)
+            orders = await run_in_storage_thread(lambda: list(storage.iter_orders()))
+            rebuild_runtime_state(orders)
+            fields["orders"] = len(orders)
+    except StorageCorruptError:
+        # Exiting non-zero keeps the damaged files untouched for a restore instead of starting empty
+        log.critical("❌ CRITICAL: stored state failed its integrity check, refusing to start")
+        exit(1)
+    recovery_seconds = time.perf_counter() - started
+    if split:
+        await run_in_storage_thread(payment_spool.open)
+    
+    # Nothing below may await before bot.start: these tasks call bot.wait_until_ready(),
+    # which only works once bot.start has begun logging in
+    payment_queue.start()
+    asyncio.create_task(discord_actions.run())
+    asyncio.create_task(subscriptions.run())
+    asyncio.create_task(monitor_event_loop_lag())
+    asyncio.create_task(watch_plan_catalog())
+    if ARCHIVE_AFTER_DAYS > 0:
+        asyncio.create_task(archive_history_periodically())
+    
     # Start HTTP server in the background
-    http_task = asyncio.create_task(start_http_server())
+    if split:
+        asyncio.create_task(consume_payment_spool())
+        http_task = asyncio.create_task(start_http_server(ADMIN_PORT, payment_handlers=None))
+    else:
+        http_task = asyncio.create_task(start_http_server())
     
     # Start Discord bot
-    print("✅ Starting Discord bot...")
+    log.info("✅ Starting Discord bot...")
     await bot.start(DISCORD_BOT_TOKEN)
 
 if __name__ == "__main__":
-    print("🚀 Starting Discord bot with HTTP payment server...")
+    if CLI_COMMAND == "import-json":
+        import_json_to_sqlite()
+        exit(0)
+    
+    if CLI_COMMAND == "ingest":
+        # HTTP ingest tier only; run `python combined_bot.py discord` next to it
+        for worker in start_ingest_workers(INGEST_WORKERS):
+            worker.join()
+        exit(0)
     
     if not DISCORD_BOT_TOKEN:
-        print("❌ DISCORD_BOT_TOKEN environment variable is required!")
+        log.critical("❌ DISCORD_BOT_TOKEN environment variable is required!")
         exit(1)
     
-    # Run both servers
-    asyncio.run(main())
+    if CLI_COMMAND == "split":
+        # Ingest workers and the Discord process on one machine, sharing the spool file
+        start_ingest_workers(INGEST_WORKERS)
+    
+    if CLI_COMMAND in ("discord", "split"):
+        log.info("🚀 Starting Discord bot fed by the payment spool...")
+        asyncio.run(main(split=True))
+    else:
+        log.info("🚀 Starting Discord bot with HTTP payment server...")
+        
+        # Run both servers
+        asyncio.run(main())
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# combined_bot reads its configuration at import time and exits without a token
+os.environ.setdefault("DISCORD_BOT_TOKEN", "test-token")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from combined_bot import JsonStorage, SqliteStorage, run_in_storage_thread
+
+
+def code(i, created_at):
+    return {"code": f"CODE{i:03d}", "plan": "30d", "days": 30, "created_at": created_at, "redeemed": False}
+
+
+async def open_storage(backend, tmp_path):
+    if backend == "json":
+        storage = JsonStorage(*(str(tmp_path / name) for name in ("o.json", "o.journal", "c.json", "c.journal")))
+    else:
+        storage = SqliteStorage(str(tmp_path / "bot.db"))
+    await run_in_storage_thread(storage.load)
+    return storage
+
+
+async def all_pages(storage, limit):
+    pages, cursor = [], None
+    while True:
+        page = await storage.unredeemed_codes_page(cursor, limit)
+        if not page:
+            return pages
+        pages.append([c["code"] for c in page])
+        cursor = (page[-1]["created_at"], page[-1]["code"])
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_pages_follow_creation_order_and_skip_redeemed_codes(backend, tmp_path):
+    async def run():
+        storage = await open_storage(backend, tmp_path)
+        # Added out of order, with ties on created_at broken by the code
+        codes = [code(i, f"2026-01-{10 - i // 2:02d}T00:00:00") for i in range(10)]
+        await storage.add_codes(codes)
+        await storage.redeem_code("CODE004", "1")
+        await storage.redeem_code("CODE007", "1")
+        return await all_pages(storage, 3)
+
+    pages = asyncio.run(run())
+
+    assert pages == [["CODE008", "CODE009", "CODE006"], ["CODE005", "CODE002", "CODE003"], ["CODE000", "CODE001"]]
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_cursor_stays_valid_when_codes_change_between_pages(backend, tmp_path):
+    async def run():
+        storage = await open_storage(backend, tmp_path)
+        await storage.add_codes([code(i, f"2026-01-01T00:00:{i:02d}") for i in range(6)])
+        first = await storage.unredeemed_codes_page(None, 3)
+        cursor = (first[-1]["created_at"], first[-1]["code"])
+        # Redeeming a code on the next page and adding an older one must not shift the cursor
+        await storage.redeem_code("CODE003", "1")
+        await storage.add_codes([code(99, "2025-12-31T00:00:00")])
+        return [c["code"] for c in first], [c["code"] for c in await storage.unredeemed_codes_page(cursor, 3)]
+
+    first, second = asyncio.run(run())
+
+    assert first == ["CODE000", "CODE001", "CODE002"]
+    assert second == ["CODE004", "CODE005"]
+
+
+def test_index_is_rebuilt_once_most_codes_are_redeemed(tmp_path):
+    async def run():
+        storage = await open_storage("json", tmp_path)
+        await storage.add_codes([code(i, f"2026-01-01T00:00:{i:02d}") for i in range(10)])
+        for i in range(7):
+            await storage.redeem_code(f"CODE{i:03d}", "1")
+        return await all_pages(storage, 2), len(storage.codes._by_created)
+
+    pages, indexed = asyncio.run(run())
+
+    assert pages == [["CODE007", "CODE008"], ["CODE009"]]
+    assert indexed == 3
@@ -0,0 +1,248 @@
+import asyncio
+import errno
+import json
+import os
+
+import pytest
+
+import combined_bot
+from combined_bot import (CodeStore, OrderStore, StorageCorruptError, encode_journal_line, read_snapshot,
+                          write_snapshot_atomic)
+
+
+def order(amount, status="pending"):
+    return {"discord_id": "1", "amount": amount, "days": 30, "plan": "30d", "status": status,
+            "created_at": "2026-01-01T00:00:00"}
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "orders.json"), str(tmp_path / "orders.journal")
+
+
+def load(paths, store_class=OrderStore, **options):
+    store = store_class(*paths, **options)
+    store.load()
+    return store
+
+
+def write_journal(path, lines):
+    with open(path, "wb") as f:
+        f.write(b"".join(line if isinstance(line, bytes) else line.encode() for line in lines))
+
+
+def test_writes_survive_a_reload(paths):
+    async def write():
+        store = load(paths)
+        await store.put("a", order(1))
+        await store.put("b", order(2))
+        await store.update("a", status="verified")
+        await store.delete_many(["b"])
+        store._journal.close()
+
+    asyncio.run(write())
+    store = load(paths)
+    assert dict(store.items()) == {"a": {**order(1), "status": "verified"}}
+    assert store.sales.rows() == [("2026-01-01", "30d", "verified", 1, 1)]
+
+
+def test_legacy_snapshot_and_journal_are_replayed_and_rewritten(paths):
+    snapshot_path, journal_path = paths
+    with open(snapshot_path, "w") as f:
+        json.dump({"a": order(1)}, f)
+    write_journal(journal_path, [json.dumps({"op": "put", "id": "b", "value": order(2)}) + "\n"])
+
+    store = load(paths)
+
+    assert set(dict(store.items())) == {"a", "b"}
+    data, checksum, previous = read_snapshot(snapshot_path)
+    assert set(data) == {"a", "b"} and checksum and previous is None
+    with open(journal_path, "rb") as f:
+        assert [json.loads(line.split(b" ", 1)[1]) for line in f] == [{"op": "base", "snapshot": checksum}]
+
+
+def test_torn_tail_is_truncated(paths):
+    snapshot_path, journal_path = paths
+    checksum = write_snapshot_atomic(snapshot_path, {"a": order(1)}, None)
+    intact = [encode_journal_line({"op": "base", "snapshot": checksum}),
+              encode_journal_line({"op": "put", "id": "b", "value": order(2)})]
+    torn = encode_journal_line({"op": "put", "id": "c", "value": order(3)})[:20]
+    write_journal(journal_path, intact + [torn])
+
+    store = load(paths)
+    store._journal.close()
+
+    assert set(dict(store.items())) == {"a", "b"}
+    with open(journal_path) as f:
+        assert f.read() == "".join(intact)
+
+
+def test_damaged_entry_before_the_end_raises(paths):
+    snapshot_path, journal_path = paths
+    checksum = write_snapshot_atomic(snapshot_path, {}, None)
+    damaged = encode_journal_line({"op": "put", "id": "b", "value": order(2)}).replace('"b"', '"x"')
+    write_journal(journal_path, [encode_journal_line({"op": "base", "snapshot": checksum}), damaged,
+                                 encode_journal_line({"op": "put", "id": "c", "value": order(3)})])
+
+    with pytest.raises(StorageCorruptError, match="damaged entry"):
+        load(paths)
+
+
+def test_journal_of_another_snapshot_raises(paths):
+    snapshot_path, journal_path = paths
+    write_snapshot_atomic(snapshot_path, {"a": order(1)}, None)
+    write_journal(journal_path, [encode_journal_line({"op": "base", "snapshot": "0" * 64}),
+                                 encode_journal_line({"op": "put", "id": "b", "value": order(2)})])
+
+    with pytest.raises(StorageCorruptError, match="does not continue"):
+        load(paths)
+
+
+def test_journal_of_the_replaced_snapshot_is_skipped(paths):
+    # Crash after the compacted snapshot was renamed into place but before its journal was started
+    snapshot_path, journal_path = paths
+    old = write_snapshot_atomic(snapshot_path, {"a": order(1)}, None)
+    write_journal(journal_path, [encode_journal_line({"op": "base", "snapshot": old}),
+                                 encode_journal_line({"op": "put", "id": "b", "value": order(2)})])
+    new = write_snapshot_atomic(snapshot_path, {"a": order(1), "b": order(2)}, old)
+
+    store = load(paths)
+    store._journal.close()
+
+    assert set(dict(store.items())) == {"a", "b"}
+    assert store.sales.rows() == [("2026-01-01", "30d", "pending", 2, 3)]
+    with open(journal_path) as f:
+        assert f.read() == encode_journal_line({"op": "base", "snapshot": new})
+
+
+def test_snapshot_checksum_mismatch_raises(paths):
+    snapshot_path, _ = paths
+    write_snapshot_atomic(snapshot_path, {"a": order(1)}, None)
+    with open(snapshot_path, "rb") as f:
+        raw = f.read()
+    with open(snapshot_path, "wb") as f:
+        f.write(raw.replace(b'"amount": 1', b'"amount": 9'))
+
+    with pytest.raises(StorageCorruptError, match="checksum mismatch"):
+        load(paths)
+
+
+def failing_fsync(monkeypatch, failures=1):
+    """Makes the next `failures` fsync calls raise ENOSPC, after the data reached the file"""
+    real_fsync, calls = os.fsync, {"left": failures}
+
+    def fsync(fd):
+        if calls["left"]:
+            calls["left"] -= 1
+            raise OSError(errno.ENOSPC, "No space left on device")
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", fsync)
+
+
+def test_failed_append_is_cut_off_and_undone(paths, monkeypatch):
+    async def write():
+        store = load(paths)
+        await store.put("a", order(1))
+        await store.put("b", order(2))
+        failing_fsync(monkeypatch)
+        with pytest.raises(OSError):
+            await store.put_many([("a", order(3)), ("c", order(4))])
+        with pytest.raises(OSError):
+            failing_fsync(monkeypatch)
+            await store.delete_many(["b"])
+        in_memory, sales = dict(store.items()), store.sales.rows()
+        await store.put("d", order(5))
+        store._journal.close()
+        return in_memory, sales
+
+    in_memory, sales = asyncio.run(write())
+
+    assert in_memory == {"a": order(1), "b": order(2)}
+    assert sales == [("2026-01-01", "30d", "pending", 2, 3)]
+    assert dict(load(paths).items()) == {"a": order(1), "b": order(2), "d": order(5)}
+
+
+def test_store_refuses_writes_when_a_failed_append_cannot_be_cut_off(paths, monkeypatch):
+    def truncate(path, length):
+        raise OSError(errno.EIO, "Input/output error")
+
+    async def write():
+        store = load(paths)
+        await store.put("a", order(1))
+        failing_fsync(monkeypatch)
+        monkeypatch.setattr(os, "truncate", truncate)
+        with pytest.raises(OSError):
+            await store.put("b", order(2))
+        with pytest.raises(StorageCorruptError, match="read-only"):
+            await store.put("c", order(3))
+        return dict(store.items())
+
+    assert asyncio.run(write()) == {"a": order(1)}
+    monkeypatch.undo()
+    # Whether the failed entry reached the disk is unknown, but the journal still loads
+    assert load(paths).get("a") == order(1)
+
+
+def test_compaction_starts_a_journal_on_the_new_snapshot(paths):
+    # The first entry stays below the minimum, the second one crosses it
+    first_entry = len(encode_journal_line({"op": "put", "id": "a", "value": order(1)}))
+
+    async def write():
+        store = load(paths, compact_min_bytes=first_entry + 1)
+        await store.put("a", order(1))
+        assert not store._compacting
+        await store.put("b", order(2))
+        await combined_bot.run_in_storage_thread(lambda: None)
+        store._journal.close()
+
+    asyncio.run(write())
+    data, checksum, _ = read_snapshot(paths[0])
+    assert set(data) == {"a", "b"}
+    with open(paths[1]) as f:
+        assert f.read() == encode_journal_line({"op": "base", "snapshot": checksum})
+    assert set(dict(load(paths).items())) == {"a", "b"}
+
+
+def test_compaction_waits_for_the_journal_to_reach_a_share_of_the_snapshot(paths):
+    write_snapshot_atomic(paths[0], {str(i): order(i) for i in range(100)}, None)
+
+    async def write():
+        store = load(paths, compact_ratio=0.5, compact_min_bytes=0)
+        snapshot_bytes = store._snapshot_bytes
+        journal_sizes = []
+        while not store._compacting:
+            journal_sizes.append(store._journal_bytes)
+            await store.put(str(len(journal_sizes)), order(1))
+        journal_sizes.append(store._journal_bytes)
+        await combined_bot.run_in_storage_thread(lambda: None)
+        store._journal.close()
+        return journal_sizes, snapshot_bytes
+
+    journal_sizes, snapshot_bytes = asyncio.run(write())
+
+    assert len(journal_sizes) > 10
+    assert journal_sizes[-2] < snapshot_bytes * 0.5 <= journal_sizes[-1]
+    assert set(dict(load(paths).items())) == {str(i) for i in range(100)}
+
+
+@pytest.mark.parametrize("records", [{}, {"a": order(1), "b": {"nested": ["x", 1.5, None]}}])
+def test_streamed_snapshot_matches_json_dumps(paths, records):
+    store = OrderStore(*paths)
+    store._write_snapshot(records)
+    store._journal.close()
+
+    with open(paths[0], "rb") as f:
+        assert f.read().partition(b"\n")[2] == json.dumps(records).encode()
+    assert read_snapshot(paths[0])[0] == records
+
+
+def test_code_snapshot_keeps_the_codes_file_layout(tmp_path):
+    paths = str(tmp_path / "codes.json"), str(tmp_path / "codes.journal")
+    codes = {c: {"code": c, "plan": "30d", "days": 30, "redeemed": False} for c in ("A", "B")}
+    store = CodeStore(*paths)
+    store._write_snapshot(codes)
+    store._journal.close()
+
+    assert read_snapshot(paths[0])[0] == {"codes": list(codes.values())}
+    assert dict(load(paths, CodeStore).items()) == codes
@@ -0,0 +1,45 @@
+from datetime import datetime
+
+from combined_bot import OrderIdAllocator
+
+
+def parts(order_id):
+    prefix, stamp, seq = order_id.split("_")
+    return prefix, stamp, int(seq)
+
+
+def test_ids_are_unique_and_increasing_across_prefixes():
+    allocator = OrderIdAllocator()
+    ids = [allocator.allocate("purchase" if i % 2 else "redeem") for i in range(500)]
+
+    keys = [parts(order_id)[1:] for order_id in ids]
+    assert keys == sorted(keys) and len(set(keys)) == len(keys)
+
+
+def test_sequence_overflow_borrows_the_next_second():
+    allocator = OrderIdAllocator()
+    allocator.observe("purchase_20991231235959_9999")
+
+    assert allocator.allocate("purchase") == "purchase_21000101000000_0000"
+    assert allocator.allocate("redeem") == "redeem_21000101000000_0001"
+
+
+def test_observed_ids_keep_ids_increasing_when_the_clock_is_behind():
+    allocator = OrderIdAllocator()
+    allocator.observe("purchase_20990101000000_0005")
+    allocator.observe("purchase_20980101000000_0042")
+
+    assert allocator.allocate("purchase") == "purchase_20990101000000_0006"
+
+
+def test_legacy_ids_count_as_sequence_zero():
+    allocator = OrderIdAllocator()
+    allocator.observe("purchase_20990101000000")
+    allocator.observe("manual_1234")
+
+    assert allocator.allocate("direct") == "direct_20990101000000_0001"
+
+
+def test_fresh_allocator_uses_the_current_second():
+    stamp = parts(OrderIdAllocator().allocate("purchase"))[1]
+    assert abs((datetime.strptime(stamp, OrderIdAllocator.STAMP_FORMAT) - datetime.now()).total_seconds()) < 5
@@ -0,0 +1,133 @@
+import asyncio
+import json
+
+import pytest
+
+import combined_bot
+from combined_bot import IdempotencyCache, handle_payment_batch
+
+
+class BatchRequest:
+    def __init__(self, records):
+        self.body = json.dumps(records)
+
+    async def text(self):
+        return self.body
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    """Replaces process_direct_payments with a fake that waits for `release` and logs its batches"""
+    state = {"batches": [], "release": None}
+
+    async def process_direct_payments(payments):
+        state["batches"].append([key for _, _, key in payments])
+        await state["release"].wait()
+        return [(f"direct_{key}", {"plan": "30d"}) for _, _, key in payments]
+
+    monkeypatch.setattr(combined_bot, "payment_results", IdempotencyCache(100, 3600))
+    monkeypatch.setattr(combined_bot, "process_direct_payments", process_direct_payments)
+    return state
+
+
+def payment(key):
+    return {"minecraft_username": "player", "amount": 100, "idempotency_key": key}
+
+
+def batch_results(response):
+    return json.loads(response.body)["results"]
+
+
+def test_batch_waits_for_a_payment_being_recorded_by_another_request(recorded):
+    async def run():
+        recorded["release"] = asyncio.Event()
+        started = asyncio.Event()
+
+        async def single():
+            started.set()
+            await asyncio.sleep(0.01)
+            return {"status": "success", "order_id": "direct_single", "plan": "30d", "message": ""}
+
+        first = asyncio.create_task(combined_bot.payment_results.run_once("k1", single))
+        await started.wait()
+        recorded["release"].set()
+        response = await handle_payment_batch(BatchRequest([payment("k1"), payment("k2")]))
+        return await first, batch_results(response)
+
+    (single_result, duplicate), results = asyncio.run(run())
+
+    assert not duplicate
+    assert recorded["batches"] == [["k2"]]
+    assert results[0] == {"index": 0, **single_result, "duplicate": True}
+    assert results[1]["order_id"] == "direct_k2"
+
+
+def test_payment_waits_for_a_batch_recording_the_same_key(recorded):
+    async def run():
+        recorded["release"] = asyncio.Event()
+        batch = asyncio.create_task(handle_payment_batch(BatchRequest([payment("k1")])))
+        await asyncio.sleep(0)
+        assert combined_bot.payment_results.in_flight("k1")
+
+        async def single():
+            raise AssertionError("the payment was recorded twice")
+
+        retry = asyncio.create_task(combined_bot.payment_results.run_once("k1", single))
+        await asyncio.sleep(0)
+        recorded["release"].set()
+        return batch_results(await batch), await retry
+
+    results, (retry_result, duplicate) = asyncio.run(run())
+
+    assert duplicate and retry_result["order_id"] == results[0]["order_id"] == "direct_k1"
+    assert combined_bot.payment_results.get("k1") == retry_result
+
+
+def test_failed_batch_releases_its_keys(recorded, monkeypatch):
+    async def failing(payments):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(combined_bot, "process_direct_payments", failing)
+
+    async def run():
+        response = await handle_payment_batch(BatchRequest([payment("k1")]))
+        return response.status, combined_bot.payment_results.in_flight("k1"), combined_bot.payment_results.get("k1")
+
+    status, in_flight, cached = asyncio.run(run())
+
+    assert status == 500 and in_flight is None and cached is None
+
+
+def batch_reply(records):
+    async def run():
+        response = await handle_payment_batch(BatchRequest(records))
+        return response.status, json.loads(response.body)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("records", [[], [{"amount": 100}], [payment("k1") | {"amount": "lots"}]])
+def test_batch_without_an_accepted_payment_is_rejected(recorded, records):
+    status, reply = batch_reply(records)
+
+    assert status == 400 and reply["status"] == "error" and reply["accepted"] == 0
+    assert recorded["batches"] == []
+
+
+def test_batch_with_some_rejected_payments_is_partial(recorded):
+    recorded["release"] = asyncio.Event()
+    recorded["release"].set()
+
+    status, reply = batch_reply([payment("k1"), {"amount": 100}])
+
+    assert status == 202 and reply["status"] == "partial"
+    assert (reply["accepted"], reply["failed"]) == (1, 1)
+    assert [result["status"] for result in reply["results"]] == ["success", "error"]
+
+
+def test_batch_of_replayed_payments_succeeds(recorded):
+    combined_bot.payment_results.put("k1", {"status": "success", "order_id": "direct_k1", "plan": "30d", "message": ""})
+
+    status, reply = batch_reply([payment("k1")])
+
+    assert status == 202 and reply["status"] == "success" and reply["accepted"] == 0
+    assert reply["results"][0]["duplicate"]
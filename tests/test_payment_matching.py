@@ -0,0 +1,163 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+
+import combined_bot
+from combined_bot import JsonStorage, PendingAmountIndex, SubscriptionExpiryScheduler, run_in_storage_thread
+
+
+@pytest.fixture
+def shop(tmp_path, monkeypatch):
+    """Fresh storage, reservations and subscriptions; notifications and embed edits are recorded, not sent"""
+    storage = JsonStorage(*(str(tmp_path / name) for name in ("o.json", "o.journal", "c.json", "c.journal")))
+    notified, marked = [], []
+
+    async def mark_message_verified(message, order_id, order, verified_by):
+        marked.append(order_id)
+
+    monkeypatch.setattr(combined_bot, "storage", storage)
+    monkeypatch.setattr(combined_bot, "pending_amounts", PendingAmountIndex(3600))
+    monkeypatch.setattr(combined_bot, "subscriptions", SubscriptionExpiryScheduler())
+    monkeypatch.setattr(combined_bot.payment_queue, "submit", lambda order_id, accepted_at=None: notified.append(order_id))
+    monkeypatch.setattr(combined_bot, "mark_message_verified", mark_message_verified)
+    return storage, notified, marked
+
+
+async def place_order(storage, order_id, low=1000, high=1999):
+    amount, reserved_until = combined_bot.pending_amounts.reserve(order_id, low, high)
+    await storage.create_order(order_id, {
+        "discord_id": "42", "amount": amount, "days": 30, "plan": "30d", "status": "pending",
+        "is_code_redemption": False, "created_at": datetime.now().isoformat(),
+        "reserved_until": datetime.fromtimestamp(reserved_until).isoformat(),
+    })
+    return amount
+
+
+def run(shop, scenario):
+    async def main():
+        await run_in_storage_thread(shop[0].load)
+        return await scenario(shop[0])
+    return asyncio.run(main())
+
+
+def test_reserved_amounts_are_unique_until_the_range_is_full():
+    index = PendingAmountIndex(3600)
+    amounts = [index.reserve(f"order_{i}", 100, 109)[0] for i in range(10)]
+
+    assert sorted(amounts) == list(range(100, 110))
+    with pytest.raises(RuntimeError, match="No free payment amount"):
+        index.reserve("order_10", 100, 109)
+
+
+def test_expired_reservations_are_not_settled_and_free_their_amount():
+    index = PendingAmountIndex(3600)
+    index.add("old", 100, time.time() - 1)
+
+    assert index.settle(100) is None
+    assert index.reserve("new", 100, 100)[0] == 100
+    assert index.settle(100) == "new"
+
+
+def test_a_reservation_is_settled_only_once():
+    index = PendingAmountIndex(3600)
+    amount, _ = index.reserve("order_1", 100, 199)
+
+    assert index.settle(amount) == "order_1"
+    assert index.settle(amount) is None
+    assert len(index) == 0
+
+
+def test_matching_payment_verifies_the_pending_order(shop):
+    async def scenario(storage):
+        amount = await place_order(storage, "order_1")
+        result = await combined_bot.process_direct_payment("player", amount)
+        return result, await storage.get_order("order_1")
+
+    result, order = run(shop, scenario)
+
+    assert result["order_id"] == "order_1" and result["message"].startswith("Payment matched")
+    assert order["status"] == "verified" and order["verified_by"] == "auto" and order["minecraft_username"] == "player"
+    assert order["expires_at"] and combined_bot.subscriptions.is_active("42")
+    assert shop[1] == ["order_1"]
+
+
+def test_two_equal_payments_in_one_batch_settle_the_order_once(shop):
+    async def scenario(storage):
+        amount = await place_order(storage, "order_1")
+        created = await combined_bot.process_direct_payments([("player", amount, None), ("other", amount, None)])
+        return created, await storage.get_order("order_1")
+
+    (first, second), order = run(shop, scenario)
+
+    assert first[0] == "order_1" and first[1]["status"] == "verified"
+    assert second[0].startswith("direct_") and second[1]["status"] == "paid"
+    assert order["minecraft_username"] == "player"
+
+
+def test_payment_for_an_order_that_is_no_longer_pending_becomes_a_direct_order(shop):
+    async def scenario(storage):
+        amount = await place_order(storage, "order_1")
+        # Verified by other means while the reservation was still held
+        await storage.update_order("order_1", status="verified", verified_by="1")
+        result = await combined_bot.process_direct_payment("player", amount)
+        return result, await storage.get_order("order_1")
+
+    result, order = run(shop, scenario)
+
+    assert result["order_id"].startswith("direct_") and result["message"].startswith("Payment recorded")
+    assert order["verified_by"] == "1" and "minecraft_username" not in order
+
+
+def test_reaction_verification_releases_the_reservation(shop):
+    class Message:
+        id = 555
+
+    async def scenario(storage):
+        amount = await place_order(storage, "order_1")
+        await combined_bot.verify_order_from_reaction("order_1", 1, Message())
+        return amount, await combined_bot.process_direct_payment("player", amount), await storage.get_order("order_1")
+
+    amount, result, order = run(shop, scenario)
+
+    assert order["status"] == "verified" and order["verified_by"] == "1"
+    assert result["order_id"].startswith("direct_")
+    assert shop[2] == ["order_1"]
+
+
+def test_manual_verification_releases_the_reservation(shop):
+    class Followup:
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, content, ephemeral=False):
+            self.sent.append(content)
+
+    class Response:
+        async def defer(self, ephemeral=False):
+            pass
+
+    class User:
+        def __init__(self, user_id):
+            self.id = user_id
+            self.display_name = f"user{user_id}"
+            self.mention = f"<@{user_id}>"
+
+    class Interaction:
+        user = User(int(combined_bot.ADMIN_IDS[0]))
+        response = Response()
+        followup = Followup()
+
+    interaction = Interaction()
+
+    async def scenario(storage):
+        amount = await place_order(storage, "order_1")
+        await combined_bot.manual_verify.callback(interaction, "order_1", User(42))
+        return combined_bot.pending_amounts.settle(amount), await storage.get_order("order_1")
+
+    settled, order = run(shop, scenario)
+
+    assert settled is None
+    assert order["status"] == "verified" and order["discord_id"] == "42"
+    assert interaction.followup.sent[-1].startswith("✅ Order order_1 verified")
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from combined_bot import PLANS_FILE, PlanCatalog
+
+
+def plan(name, low, high, days=30):
+    return {"name": name, "price": [low, high], "days": days}
+
+
+def test_detect_uses_inclusive_ranges():
+    catalog = PlanCatalog([plan("30d", 100, 199), plan("90d", 300, 399, 90), plan("Script", 400, 400, "permanent")])
+
+    assert [catalog.detect(a) for a in (99, 100, 199, 200, 300, 399, 400, 401)] == \
+        [None, "30d", "30d", None, "90d", "90d", "Script", None]
+    assert catalog.get("90d") == {"price": (300, 399), "days": 90}
+    assert catalog.names() == ["30d", "90d", "Script"]
+
+
+@pytest.mark.parametrize("plans, message", [
+    ([plan("a", 100, 200), plan("b", 200, 300)], "overlap"),
+    ([plan("a", 100, 300), plan("b", 150, 160)], "overlap"),
+    ([plan("a", 100, 200), plan("a", 300, 400)], "defined twice"),
+    ([plan("a", 200, 100)], "invalid price range"),
+    ([plan("a", 100, 200, 0)], "invalid days"),
+])
+def test_invalid_catalogs_are_rejected(plans, message):
+    with pytest.raises(ValueError, match=message):
+        PlanCatalog(plans)
+
+
+def test_load_reads_the_file_and_its_mtime(tmp_path):
+    path = tmp_path / "plans.json"
+    path.write_text(json.dumps({"plans": [plan("30d", 100, 199)]}))
+
+    catalog = PlanCatalog.load(str(path))
+
+    assert catalog.detect(150) == "30d" and catalog.mtime == path.stat().st_mtime
+
+
+def test_shipped_catalog_is_valid():
+    assert len(PlanCatalog.load(PLANS_FILE)) > 0
@@ -0,0 +1,130 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import combined_bot
+from combined_bot import OrderIdAllocator, SubscriptionExpiryScheduler, rebuild_runtime_state
+
+DAY = 86400
+START = datetime(2026, 1, 1).timestamp()
+
+
+def stamp(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+def verified(discord_id, days, verified_at, **fields):
+    return {"discord_id": discord_id, "days": days, "status": "verified", "created_at": stamp(verified_at),
+            "verified_at": stamp(verified_at), **fields}
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """A fresh scheduler installed as the module's `subscriptions`"""
+    scheduler = SubscriptionExpiryScheduler()
+    monkeypatch.setattr(combined_bot, "subscriptions", scheduler)
+    monkeypatch.setattr(combined_bot, "order_ids", OrderIdAllocator())
+    return scheduler
+
+
+def test_extend_stacks_on_the_running_subscription():
+    scheduler = SubscriptionExpiryScheduler()
+
+    assert scheduler.extend("1", 30, start=START, order_id="a") == START + 30 * DAY
+    # Bought again before it ran out: the new days start where the old ones end
+    assert scheduler.extend("1", 10, start=START + DAY, order_id="b") == START + 40 * DAY
+    # Bought again after it ran out: the new days start at the purchase
+    assert scheduler.extend("1", 5, start=START + 50 * DAY, order_id="c") == START + 55 * DAY
+
+
+def test_extended_subscriptions_expire_once_at_the_latest_expiry():
+    scheduler = SubscriptionExpiryScheduler()
+    scheduler.extend("1", 30, start=START, order_id="a")
+    scheduler.extend("1", 10, start=START, order_id="b")
+
+    # The entry pushed for the first purchase is stale and skipped
+    assert scheduler._pop_due(START + 30 * DAY) == []
+    assert scheduler._pop_due(START + 40 * DAY) == [("1", START + 40 * DAY, "b")]
+    assert scheduler._pop_due(START + 100 * DAY) == [] and len(scheduler) == 0
+
+
+def test_permanent_plans_are_never_expired():
+    scheduler = SubscriptionExpiryScheduler()
+    scheduler.extend("1", 30, start=START, order_id="a")
+    scheduler.make_permanent("1")
+
+    assert scheduler._pop_due(START + 1000 * DAY) == []
+    assert scheduler.is_active("1")
+
+    scheduler._retry([("1", START + 30 * DAY, "a")])
+    assert len(scheduler) == 0 and scheduler._heap == []
+
+
+def test_revocation_is_retried_when_the_role_cannot_be_found(scheduler, monkeypatch):
+    monkeypatch.setattr(combined_bot.bot, "get_guild", lambda guild_id: None)
+    scheduler.extend("1", 30, start=START, order_id="a")
+
+    due = scheduler._pop_due(START + 30 * DAY)
+    asyncio.run(scheduler._revoke(due))
+
+    retry_at = scheduler._heap[0][0]
+    assert scheduler._pop_due(retry_at - 1) == []
+    assert scheduler._pop_due(retry_at) == due
+
+
+def test_retry_does_not_undo_a_later_extension():
+    scheduler = SubscriptionExpiryScheduler(retry_seconds=0)
+    scheduler.extend("1", 30, start=START, order_id="a")
+    failed = scheduler._pop_due(START + 30 * DAY)
+    # Renewed while the revocation was failing
+    scheduler.extend("1", 30, start=START + 31 * DAY, order_id="b")
+
+    scheduler._retry(failed)
+
+    assert scheduler._pop_due(START + 60 * DAY) == []
+    assert scheduler._pop_due(START + 61 * DAY) == [("1", START + 61 * DAY, "b")]
+
+
+def test_legacy_orders_are_replayed_in_verification_order(scheduler):
+    # Stored newest first; replaying in this order would stack to 41 days instead of 40
+    rebuild_runtime_state([
+        ("purchase_2", verified("1", 10, START + DAY)),
+        ("purchase_1", verified("1", 30, START)),
+    ])
+
+    assert scheduler._expires["1"] == START + 40 * DAY
+    assert scheduler._orders["1"] == "purchase_2"
+
+
+def test_rebuild_keeps_permanent_plans_and_stored_expiries(scheduler):
+    expires_at = START + 400 * DAY
+    rebuild_runtime_state([
+        ("purchase_1", verified("1", "permanent", START)),
+        ("purchase_2", verified("2", 30, START, expires_at=stamp(expires_at))),
+        ("purchase_3", {**verified("3", 30, START), "status": "pending"}),
+    ])
+
+    assert scheduler.is_active("1") and "1" not in scheduler._expires
+    assert scheduler._expires == {"2": expires_at} and scheduler._orders["2"] == "purchase_2"
+
+
+def test_a_revoked_expiry_is_not_revoked_again_after_restart(scheduler):
+    expired_at = START + 30 * DAY
+    rebuild_runtime_state([
+        ("purchase_1", verified("1", 30, START, expires_at=stamp(expired_at), role_revoked_at=stamp(expired_at + 60))),
+        ("purchase_2", verified("2", 30, START, expires_at=stamp(expired_at))),
+    ])
+
+    assert scheduler._pop_due(expired_at + DAY) == [("2", expired_at, "purchase_2")]
+
+
+def test_a_revocation_older_than_a_renewal_does_not_cancel_it(scheduler):
+    expired_at = START + 30 * DAY
+    renewed_until = expired_at + 30 * DAY
+    rebuild_runtime_state([
+        ("purchase_1", verified("1", 30, START, expires_at=stamp(expired_at), role_revoked_at=stamp(expired_at + 60))),
+        ("purchase_2", verified("1", 30, expired_at + DAY, expires_at=stamp(renewed_until))),
+    ])
+
+    assert scheduler._pop_due(renewed_until) == [("1", renewed_until, "purchase_2")]